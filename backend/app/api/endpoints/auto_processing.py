@@ -1,8 +1,8 @@
 """
 Endpoints para el procesamiento automático de archivos CSV
 """
-from typing import List, Dict
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from typing import List, Dict, Optional
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Query
 from app.services.csv_processor import csv_processor
 from app.services.file_watcher import start_file_watcher, stop_file_watcher, get_file_watcher_status
 import logging
@@ -12,14 +12,26 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.post("/process-pending")
-async def process_pending_files(background_tasks: BackgroundTasks):
+def process_pending_files(background_tasks: BackgroundTasks, prioridad: int = 0):
     """
     Procesar todos los archivos CSV pendientes en la carpeta raw
+    (un trabajo de la cola por archivo; ver GET /jobs)
     """
     try:
         logger.info("Iniciando procesamiento de archivos pendientes")
         
-        # Ejecutar procesamiento en background
+        if csv_processor.cola_habilitada():
+            try:
+                trabajos = csv_processor.encolar_pendientes(prioridad)
+                return {
+                    "status": "queued",
+                    "message": f"Se encolaron {len(trabajos)} archivos pendientes",
+                    "trabajos": [{"id_trabajo": t["id_trabajo"], "archivo": t["archivo"], "estado": t["estado"]} for t in trabajos]
+                }
+            except Exception as e:
+                logger.error(f"No se pudo usar la cola de trabajos; se procesa en el API: {e}")
+        
+        # Sin cola (RECWAY_COLA_TRABAJOS=0 o no disponible): procesamiento en background dentro del API
         def proceso_background():
             return csv_processor.procesar_archivos_pendientes()
         
@@ -38,14 +50,27 @@ async def process_pending_files(background_tasks: BackgroundTasks):
         )
 
 @router.post("/process-file/{filename}")
-async def process_specific_file(filename: str, background_tasks: BackgroundTasks):
+def process_specific_file(filename: str, background_tasks: BackgroundTasks, prioridad: int = 0):
     """
     Procesar un archivo CSV específico
     """
     try:
         logger.info(f"Iniciando procesamiento de archivo: {filename}")
         
-        # Ejecutar procesamiento en background
+        if csv_processor.cola_habilitada():
+            try:
+                trabajo = csv_processor.encolar_archivo(filename, prioridad)
+                return {
+                    "status": "queued",
+                    "message": f"El archivo {filename} está en la cola de procesamiento",
+                    "filename": filename,
+                    "id_trabajo": trabajo["id_trabajo"],
+                    "estado": trabajo["estado"]
+                }
+            except Exception as e:
+                logger.error(f"No se pudo encolar {filename}; se procesa en el API: {e}")
+        
+        # Sin cola (RECWAY_COLA_TRABAJOS=0 o no disponible): procesamiento en background dentro del API
         def proceso_background():
             return csv_processor.procesar_archivo_especifico(filename)
         
@@ -65,7 +90,7 @@ async def process_specific_file(filename: str, background_tasks: BackgroundTasks
         )
 
 @router.get("/process-status")
-async def get_process_status():
+def get_process_status():
     """
     Obtener estado del procesamiento (archivos pendientes)
     """
@@ -76,11 +101,21 @@ async def get_process_status():
             csv_processor.prefijo_busqueda
         )
         
+        cola_trabajos = None
+        if csv_processor.cola_habilitada():
+            try:
+                cola_trabajos = csv_processor.resumen_cola()
+            except Exception as e:
+                cola_trabajos = {"error": f"Cola de trabajos no disponible: {e}"}
+        
         return {
             "archivos_pendientes": len(archivos_pendientes),
             "archivos": archivos_pendientes,
             "carpeta_raw": csv_processor.carpeta_csv,
-            "carpeta_procesados": csv_processor.carpeta_almacenamiento_csv
+            "carpeta_procesados": csv_processor.carpeta_almacenamiento_csv,
+            "cache_grafos": csv_processor.estadisticas_cache_grafos(),
+            "pool_procesamiento": csv_processor.estadisticas_pool(),
+            "cola_trabajos": cola_trabajos
         }
         
     except Exception as e:
@@ -90,6 +125,25 @@ async def get_process_status():
             detail=f"Error obteniendo estado: {str(e)}"
         )
 
+@router.post("/graph-manifest/refresh")
+async def refresh_graph_manifest():
+    """
+    Volver a escanear la carpeta de grafos (por ejemplo después de agregar teselas)
+    """
+    try:
+        total = csv_processor.refrescar_manifiesto_grafos()
+        return {
+            "status": "success",
+            "teselas": total
+        }
+        
+    except Exception as e:
+        logger.error(f"Error refrescando manifiesto de grafos: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error refrescando manifiesto: {str(e)}"
+        )
+
 @router.get("/processed-files")
 async def get_processed_files():
     """
@@ -106,6 +160,12 @@ async def get_processed_files():
         if carpeta_procesados.exists():
             archivos_csv = [f.name for f in carpeta_procesados.glob("*.csv")]
         
+        # Listar copias Parquet del almacén columnar
+        carpeta_columnar = Path(csv_processor.carpeta_almacenamiento_columnar)
+        archivos_columnares = []
+        if carpeta_columnar.exists():
+            archivos_columnares = [f.name for f in carpeta_columnar.glob("*.parquet")]
+        
         # Listar archivos JSON generados
         archivos_json = []
         if carpeta_json.exists():
@@ -113,6 +173,7 @@ async def get_processed_files():
         
         return {
             "archivos_csv_procesados": archivos_csv,
+            "archivos_columnares": archivos_columnares,
             "archivos_json_generados": archivos_json,
             "total_procesados": len(archivos_csv),
             "total_json": len(archivos_json)
@@ -125,6 +186,51 @@ async def get_processed_files():
             detail=f"Error obteniendo archivos procesados: {str(e)}"
         )
 
+@router.get("/output-index")
+async def get_output_index(desde: int = 0, limite: int = 100):
+    """
+    Registros de index.jsonl (un viaje terminado por línea) a partir de la posición 'desde';
+    llamar de nuevo con 'siguiente' para obtener solo los viajes nuevos
+    """
+    try:
+        registros, siguiente = csv_processor.leer_indice_salida(desde, limite)
+        return {
+            "registros": registros,
+            "siguiente": siguiente,
+            "total": len(registros)
+        }
+        
+    except Exception as e:
+        logger.error(f"Error leyendo índice de salida: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error leyendo índice de salida: {str(e)}"
+        )
+
+@router.get("/processed-ledger")
+def get_processed_ledger(sha256: Optional[str] = None, archivo: Optional[str] = None, estado: Optional[str] = None,
+                         limite: int = Query(100, ge=1, le=1000)):
+    """
+    Registro de archivos procesados por contenido (sha256): estado, segmentos, tiempos y
+    archivos de salida. Con sha256 o archivo retorna solo ese contenido (404 si no está)
+    """
+    try:
+        if sha256 is None and archivo is None:
+            return {"registros": csv_processor.listar_registro_archivos(estado, limite)}
+        registro = csv_processor.buscar_registro_archivo(sha256, archivo)
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error leyendo registro de archivos: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error leyendo registro de archivos: {str(e)}"
+        )
+    if registro is None:
+        raise HTTPException(status_code=404, detail="El contenido no está en el registro de archivos procesados")
+    return registro
+
 @router.delete("/clear-processed")
 async def clear_processed_files():
     """
@@ -148,20 +254,37 @@ async def clear_processed_files():
         
         # Limpiar JSON output
         if carpeta_json_output.exists():
-            for archivo in carpeta_json_output.glob("*.json"):
+            for archivo in [*carpeta_json_output.glob("*.json"), *carpeta_json_output.glob("index.jsonl")]:
                 archivo.unlink()
                 archivos_eliminados += 1
         
-        # Limpiar JSON storage
+        # Limpiar JSON storage (incluye las variantes comprimidas .json.gz / .json.zst)
         if carpeta_json_storage.exists():
-            for archivo in carpeta_json_storage.glob("*.json"):
+            for archivo in carpeta_json_storage.glob("*.json*"):
+                archivo.unlink()
+                archivos_eliminados += 1
+
+        # Copias Parquet del almacén columnar (también se pueden reprocesar por nombre)
+        carpeta_columnar = Path(csv_processor.carpeta_almacenamiento_columnar)
+        if carpeta_columnar.exists():
+            for archivo in carpeta_columnar.glob("*.parquet"):
                 archivo.unlink()
                 archivos_eliminados += 1
         
+        # Avance guardado de emparejamientos interrumpidos
+        carpeta_puntos_control = Path(csv_processor.carpeta_puntos_control)
+        if carpeta_puntos_control.exists():
+            for carpeta in carpeta_puntos_control.iterdir():
+                shutil.rmtree(carpeta, ignore_errors=True)
+
+        # Sin los resultados, el registro por contenido ya no puede evitar reprocesar
+        registros_eliminados = csv_processor.limpiar_registro_archivos()
+
         return {
             "status": "success",
             "message": f"Se eliminaron {archivos_eliminados} archivos procesados",
-            "archivos_eliminados": archivos_eliminados
+            "archivos_eliminados": archivos_eliminados,
+            "registros_eliminados": registros_eliminados
         }
         
     except Exception as e:
@@ -183,8 +306,12 @@ async def get_file_watcher_status_endpoint():
         return {
             "status": "active" if status["is_running"] else "inactive",
             "is_running": status["is_running"],
+            "backend": status["backend"],
             "watch_folder": status["watch_folder"],
             "observer_alive": status["observer_alive"],
+            "processing": status["processing"],
+            "processed_count": status["processed_count"],
+            "executor": status["executor"],
             "message": "File watcher está monitoreando archivos" if status["is_running"] else "File watcher no está activo"
         }
         
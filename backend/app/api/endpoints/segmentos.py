@@ -0,0 +1,80 @@
+"""
+Endpoints de consulta de segmentos procesados (PostGIS)
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import Response
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+import logging
+
+from app.db.session import get_db
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+LIMITE_DEFECTO = 2000
+LIMITE_MAXIMO = 20000
+
+# La caja se resuelve con el índice GiST de segmento.geom (operador &&); el GeoJSON se
+# arma en la base de datos para no crear un objeto Python por segmento. El id se
+# devuelve como texto sin signo (el mismo valor que el 'id' de los JSON del
+# procesamiento; en la tabla se guarda como bigint con los mismos bits).
+SQL_VIEWPORT = text("""
+SELECT json_build_object(
+    'type', 'FeatureCollection',
+    'features', COALESCE(json_agg(f.feature), '[]'::json)
+)::text
+FROM (
+    SELECT json_build_object(
+        'type', 'Feature',
+        'id', (s.id_segmento::numeric + CASE WHEN s.id_segmento < 0 THEN 18446744073709551616 ELSE 0 END)::text,
+        'geometry', ST_AsGeoJSON(s.geom, 7)::json,
+        'properties', json_build_object(
+            'nombre', s.nombre,
+            'tipo', s.tipo,
+            'longitud', s.longitud,
+            'cantidad_muestras', s.cantidad_muestras,
+            'ultima_fecha_muestra', s.ultima_fecha_muestra,
+            'iri', i.iri_estandar,
+            'IRI_modificado', i.iri_modificado,
+            'IQR', i.nota_general
+        )
+    ) AS feature
+    FROM segmento s
+    LEFT JOIN indicesSegmento i ON i.id_segmento_seleccionado = s.id_segmento
+    WHERE s.geom && ST_MakeEnvelope(:min_lng, :min_lat, :max_lng, :max_lat, 4326)
+    LIMIT :limite
+) f
+""")
+
+
+@router.get("/viewport")
+def get_segments_in_viewport(
+    min_lng: float = Query(..., ge=-180, le=180),
+    min_lat: float = Query(..., ge=-90, le=90),
+    max_lng: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    limite: int = Query(LIMITE_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    db: Session = Depends(get_db)
+):
+    """
+    Segmentos que intersectan la caja del mapa, como GeoJSON FeatureCollection
+    (coordenadas lon/lat, EPSG:4326)
+    """
+    if min_lng > max_lng or min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="La caja debe cumplir min_lng <= max_lng y min_lat <= max_lat")
+    try:
+        geojson = db.execute(SQL_VIEWPORT, {
+            "min_lng": min_lng, "min_lat": min_lat,
+            "max_lng": max_lng, "max_lat": max_lat,
+            "limite": limite
+        }).scalar()
+        return Response(content=geojson, media_type="application/geo+json")
+
+    except Exception as e:
+        logger.error(f"Error consultando segmentos del viewport: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error consultando segmentos del viewport: {str(e)}"
+        )
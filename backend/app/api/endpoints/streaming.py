@@ -0,0 +1,121 @@
+"""
+Ingesta en tiempo real de telemetría GPS/IMU (services/sesiones_streaming.py)
+
+Protocolo del WebSocket /ws:
+- Al conectar el servidor envía {"tipo": "sesion", "id_sesion": ...}
+- El dispositivo envía el CSV mientras graba, en mensajes de texto (o binarios UTF-8)
+  con el mismo formato del archivo: metadatos '# clave: valor', encabezado
+  'timestamp,...' y filas. Un mensaje puede cortar una línea; se completa con el siguiente
+- El servidor responde {"tipo": "segmentos", "segmentos": [...]} cada vez que se
+  cierran segmentos (mismo formato de los JSON del procesamiento)
+- {"accion": "fin"} termina el viaje: se emite el último segmento, se envía
+  {"tipo": "fin", ...} y se cierra la conexión. Si el dispositivo se desconecta
+  o no envía nada en RECWAY_STREAMING_INACTIVIDAD segundos se termina igual
+"""
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Optional
+
+import anyio
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+import logging
+
+services_dir = Path(__file__).resolve().parent.parent.parent / 'services'
+if str(services_dir) not in sys.path:
+    sys.path.insert(0, str(services_dir))
+import sesiones_streaming as ss
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+INACTIVIDAD = float(os.getenv("RECWAY_STREAMING_INACTIVIDAD", "300"))
+
+
+async def _enviar_segmentos(websocket: WebSocket, segmentos):
+    if segmentos:
+        await websocket.send_json({"tipo": "segmentos", "segmentos": segmentos})
+
+
+async def _finalizar(websocket: WebSocket, sesion, codigo: int):
+    """Emite el último segmento, envía el resumen de la sesión y cierra la conexión."""
+    segmentos = await anyio.to_thread.run_sync(ss.terminar_sesion, sesion.id_sesion)
+    await _enviar_segmentos(websocket, segmentos)
+    await websocket.send_json({"tipo": "fin", **sesion.estado()})
+    await websocket.close(code=codigo)
+
+
+@router.websocket("/ws")
+async def stream_ws(websocket: WebSocket, nombre: Optional[str] = None):
+    await websocket.accept()
+    try:
+        sesion = ss.crear_sesion(nombre)
+    except ss.LimiteSesiones as e:
+        await websocket.send_json({"tipo": "error", "detalle": str(e)})
+        await websocket.close(code=1013)
+        return
+    await websocket.send_json({"tipo": "sesion", "id_sesion": sesion.id_sesion, "nombre": sesion.nombre})
+    terminado = False
+    try:
+        while True:
+            mensaje = None
+            with anyio.move_on_after(INACTIVIDAD):
+                mensaje = await websocket.receive()
+            if mensaje is None:
+                logger.info(f"Sesión de streaming {sesion.id_sesion} sin actividad; terminando")
+                terminado = True
+                await _finalizar(websocket, sesion, 1001)
+                return
+            if mensaje["type"] == "websocket.disconnect":
+                break
+            texto = mensaje.get("text")
+            if texto is None:
+                texto = (mensaje.get("bytes") or b"").decode("utf-8")
+            if texto.lstrip().startswith("{"):
+                if json.loads(texto).get("accion") == "fin":
+                    terminado = True
+                    await _finalizar(websocket, sesion, 1000)
+                    return
+                continue
+            # El emparejamiento y la persistencia no ocupan el event loop
+            segmentos = await anyio.to_thread.run_sync(sesion.agregar, texto)
+            await _enviar_segmentos(websocket, segmentos)
+
+    except WebSocketDisconnect:
+        pass
+    except ValueError as e:
+        # CSV o mensaje de control mal formado
+        logger.warning(f"Sesión de streaming {sesion.id_sesion}: {e}")
+        await websocket.send_json({"tipo": "error", "detalle": str(e)})
+        await websocket.close(code=1003)
+    except Exception as e:
+        logger.error(f"Error en la sesión de streaming {sesion.id_sesion}: {e}")
+        await websocket.close(code=1011)
+    finally:
+        if not terminado:
+            # Lo recibido hasta aquí se procesa (y persiste) aunque el dispositivo no haya avisado el fin,
+            # también si la tarea se cancela (apagado del servidor)
+            with anyio.CancelScope(shield=True):
+                await anyio.to_thread.run_sync(ss.terminar_sesion, sesion.id_sesion)
+
+
+@router.get("/sessions")
+def list_sessions():
+    """
+    Sesiones de streaming activas: filas y fixes recibidos, segmentos emitidos y memoria en uso
+    """
+    return {"sesiones": ss.listar_sesiones(), "max_sesiones": ss.max_sesiones()}
+
+
+@router.get("/sessions/{id_sesion}")
+def get_session(id_sesion: str, recientes: int = Query(50, ge=0, le=ss.SEGMENTOS_RECIENTES)):
+    """
+    Estado de una sesión activa y sus últimos segmentos emitidos
+    """
+    sesion = ss.obtener_sesion(id_sesion)
+    if sesion is None:
+        raise HTTPException(status_code=404, detail=f"No hay una sesión activa {id_sesion}")
+    segmentos = list(sesion.recientes)
+    return {**sesion.estado(), "segmentos": segmentos[len(segmentos) - recientes:] if recientes else []}
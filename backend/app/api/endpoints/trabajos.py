@@ -0,0 +1,79 @@
+"""
+Endpoints de la cola de trabajos de procesamiento (services/cola_trabajos.py)
+"""
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from app.services.csv_processor import csv_processor
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+def _verificar_cola():
+    if not csv_processor.cola_habilitada():
+        raise HTTPException(status_code=503, detail="La cola de trabajos no está habilitada (RECWAY_COLA_TRABAJOS=0)")
+
+
+@router.get("")
+def list_jobs(estado: Optional[str] = None, limite: int = Query(100, ge=1, le=1000)):
+    """
+    Trabajos más recientes (estado, progreso, intentos y tiempos en cola y de proceso)
+    y la cantidad de trabajos por estado
+    """
+    _verificar_cola()
+    try:
+        return {
+            "resumen": csv_processor.resumen_cola(),
+            "trabajos": csv_processor.listar_trabajos(estado, limite)
+        }
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error listando trabajos: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error listando trabajos: {str(e)}"
+        )
+
+
+@router.get("/{id_trabajo}")
+def get_job(id_trabajo: int):
+    """
+    Estado, progreso, etapa, resultado o error de un trabajo
+    """
+    _verificar_cola()
+    try:
+        trabajo = csv_processor.obtener_trabajo(id_trabajo)
+
+    except Exception as e:
+        logger.error(f"Error obteniendo trabajo {id_trabajo}: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error obteniendo trabajo: {str(e)}"
+        )
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail=f"No existe el trabajo {id_trabajo}")
+    return trabajo
+
+
+@router.post("/{id_trabajo}/retry")
+def retry_job(id_trabajo: int):
+    """
+    Volver a encolar un trabajo fallido
+    """
+    _verificar_cola()
+    try:
+        trabajo = csv_processor.reintentar_trabajo(id_trabajo)
+
+    except Exception as e:
+        logger.error(f"Error reintentando trabajo {id_trabajo}: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error reintentando trabajo: {str(e)}"
+        )
+    if trabajo is None:
+        raise HTTPException(status_code=409, detail=f"El trabajo {id_trabajo} no existe o no está fallido")
+    return trabajo
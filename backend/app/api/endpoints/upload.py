@@ -1,9 +1,14 @@
 """Endpoint simple para subir CSV y colocarlo en uploads/csv/raw"""
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
 from pathlib import Path
-import shutil
+from python_multipart.multipart import MultipartParser, parse_options_header
+import anyio
+import asyncio
+import hashlib
+import os
 import sys
 import traceback
+import uuid
 from typing import Optional
 
 router = APIRouter()
@@ -13,44 +18,253 @@ BACKEND_BASE = Path(__file__).resolve().parent.parent.parent.parent  # .../backe
 RAW_DIR = BACKEND_BASE / "uploads" / "csv" / "raw"
 RAW_DIR.mkdir(parents=True, exist_ok=True)
 
-@router.post("/upload-csv")
-async def upload_csv_file(background_tasks: BackgroundTasks, file: UploadFile = File(...), sync: bool = False):
-    print("[UPLOAD] Inicio subida archivo:", file.filename)
-    if not file.filename.lower().endswith('.csv'):
-        raise HTTPException(status_code=400, detail="Solo se permiten archivos .csv")
-    target_path = RAW_DIR / file.filename
-    # Evitar sobreescritura añadiendo sufijo si existe
-    counter = 1
-    base = target_path.stem
-    ext = target_path.suffix
-    while target_path.exists():
-        target_path = RAW_DIR / f"{base}_{counter}{ext}"
-        counter += 1
+TAMANO_BLOQUE = 1024 * 1024
+TAMANO_MAXIMO = int(os.getenv("RECWAY_TAMANO_MAXIMO_CSV_MB", "2048")) * 1024 * 1024
+MARGEN_MULTIPART = 64 * 1024  # encabezados y delimitadores multipart además del CSV
+PRIORIDAD_SYNC = 10  # con sync=true hay un cliente esperando: su trabajo pasa adelante en la cola
+ESPERA_MAXIMA_SYNC = float(os.getenv("RECWAY_ESPERA_MAXIMA_SYNC", "900"))
+
+
+def _escribir_bloque(archivo, resumen, bloque):
+    # En un hilo: escritura y sha256 del bloque sin ocupar el event loop
+    archivo.write(bloque)
+    resumen.update(bloque)
+
+
+def _publicar(temporal: Path, destino: Path) -> Path:
+    """
+    Hace visible el archivo completo con enlace duro (atómico): el file watcher nunca ve
+    un CSV a medio escribir. Si el nombre existe se agrega un sufijo _1, _2, ...
+    """
+    candidato = destino
+    contador = 1
+    while True:
+        try:
+            os.link(temporal, candidato)
+            return candidato
+        except FileExistsError:
+            candidato = destino.with_name(f"{destino.stem}_{contador}{destino.suffix}")
+            contador += 1
+
+
+def _demasiado_grande():
+    return HTTPException(status_code=413, detail=f"El archivo supera el máximo de {TAMANO_MAXIMO // (1024 * 1024)} MB")
+
+
+class _PartesMultipart:
+    """Callbacks del parser multipart: ubica el campo 'file' y acumula sus datos hasta escribirlos."""
+
+    def __init__(self):
+        self.encabezados = {}
+        self._campo = b""
+        self._valor = b""
+        self.nombre_archivo = None  # filename del campo 'file' (None hasta leer sus encabezados)
+        self.en_archivo = False
+        self.archivo_terminado = False
+        self.datos = []  # bloques del archivo recibidos y aún no escritos
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self._inicio_parte,
+            "on_header_field": lambda datos, inicio, fin: self._agregar("_campo", datos[inicio:fin]),
+            "on_header_value": lambda datos, inicio, fin: self._agregar("_valor", datos[inicio:fin]),
+            "on_header_end": self._fin_encabezado,
+            "on_headers_finished": self._fin_encabezados,
+            "on_part_data": self._datos_parte,
+            "on_part_end": self._fin_parte,
+        }
+
+    def _agregar(self, atributo, datos):
+        setattr(self, atributo, getattr(self, atributo) + datos)
+
+    def _inicio_parte(self):
+        self.encabezados = {}
+
+    def _fin_encabezado(self):
+        self.encabezados[self._campo.lower()] = self._valor
+        self._campo = self._valor = b""
+
+    def _fin_encabezados(self):
+        _, opciones = parse_options_header(self.encabezados.get(b"content-disposition", b""))
+        if opciones.get(b"name") == b"file" and self.nombre_archivo is None:
+            self.nombre_archivo = opciones.get(b"filename", b"").decode("utf-8", "replace")
+            self.en_archivo = True
+
+    def _datos_parte(self, datos, inicio, fin):
+        if self.en_archivo:
+            self.datos.append(bytes(datos[inicio:fin]))
+
+    def _fin_parte(self):
+        if self.en_archivo:
+            self.en_archivo = False
+            self.archivo_terminado = True
+
+
+async def guardar_subida(request: Request, carpeta: Path):
+    """
+    Lee el cuerpo multipart de la petición a medida que llega y escribe el campo 'file'
+    directo en la carpeta (sin la copia temporal de UploadFile), con límite de tamaño
+    durante la recepción y sha256 incremental.
+
+    Returns:
+        (ruta_final, bytes, sha256)
+    """
+    tipo, opciones = parse_options_header(request.headers.get("content-type", ""))
+    if tipo != b"multipart/form-data" or b"boundary" not in opciones:
+        raise HTTPException(status_code=400, detail="Se espera un formulario multipart con el campo 'file'")
+    longitud = request.headers.get("content-length")
+    if longitud is not None and longitud.isdigit() and int(longitud) > TAMANO_MAXIMO + MARGEN_MULTIPART:
+        # Se rechaza antes de recibir el cuerpo
+        raise _demasiado_grande()
+    partes = _PartesMultipart()
+    parser = MultipartParser(opciones[b"boundary"], partes.callbacks())
+    resumen = hashlib.sha256()
+    total = 0
+    destino = temporal = archivo = None
     try:
-        with open(target_path, 'wb') as out:
-            shutil.copyfileobj(file.file, out)
-        print(f"[UPLOAD] Guardado en {target_path}")
+        async for fragmento in request.stream():
+            parser.write(fragmento)
+            if archivo is None and partes.nombre_archivo is not None:
+                print("[UPLOAD] Inicio subida archivo:", partes.nombre_archivo)
+                if not partes.nombre_archivo.lower().endswith('.csv'):
+                    raise HTTPException(status_code=400, detail="Solo se permiten archivos .csv")
+                # Solo el nombre: el cliente no decide la carpeta
+                destino = carpeta / Path(partes.nombre_archivo).name
+                # Nombre oculto (no empieza con el prefijo RecWay_) mientras se escribe
+                temporal = destino.with_name(f".{destino.name}.{uuid.uuid4().hex[:8]}.part")
+                archivo = await anyio.to_thread.run_sync(open, temporal, "wb")
+            if partes.datos:
+                bloque = b"".join(partes.datos)
+                partes.datos.clear()
+                total += len(bloque)
+                if total > TAMANO_MAXIMO:
+                    raise _demasiado_grande()
+                await anyio.to_thread.run_sync(_escribir_bloque, archivo, resumen, bloque)
+            if partes.archivo_terminado:
+                # El resto del formulario no interesa
+                break
+        if archivo is None or not partes.archivo_terminado:
+            raise HTTPException(status_code=400, detail="Falta el archivo (campo 'file') o llegó incompleto")
+        await anyio.to_thread.run_sync(archivo.close)
+        archivo = None
+        ruta_final = await anyio.to_thread.run_sync(_publicar, temporal, destino)
+    finally:
+        if archivo is not None:
+            await anyio.to_thread.run_sync(archivo.close)
+        if temporal is not None and temporal.exists():
+            temporal.unlink()
+    return ruta_final, total, resumen.hexdigest()
+
+
+def _csv_processor():
+    services_dir = Path(__file__).resolve().parent.parent.parent / 'services'
+    if str(services_dir) not in sys.path:
+        sys.path.insert(0, str(services_dir))
+    from app.services.csv_processor import csv_processor
+    return csv_processor
+
+
+async def run_process(nombre):
+    """
+    Procesa el archivo en un proceso del pool. El endpoint espera el Future del pool
+    sin ocupar un hilo, así varias subidas sync no agotan los hilos de los endpoints síncronos.
+    """
+    try:
+        print("[PROCESS] Iniciando procesamiento de:", nombre)
+        futuro = await anyio.to_thread.run_sync(_csv_processor().enviar_archivo_aislado, Path(nombre).name)
+        registro = (await asyncio.wrap_future(futuro))[0]
+        if registro["status"] != "success":
+            print(f"[PROCESS][ERROR] {registro['archivo']}: {registro['error']}")
+        print("[PROCESS] Resultado segmentos:", registro["segmentos"])
+        return registro
+    except Exception as e:
+        print("[PROCESS][ERROR]", e)
+        traceback.print_exc()
+        return None
+
+
+async def esperar_trabajo(id_trabajo):
+    """Consulta el trabajo hasta que termine (completado o fallido) o se agote ESPERA_MAXIMA_SYNC."""
+    csv_processor = _csv_processor()
+    limite = anyio.current_time() + ESPERA_MAXIMA_SYNC
+    espera = 0.2
+    while True:
+        trabajo = await anyio.to_thread.run_sync(csv_processor.obtener_trabajo, id_trabajo)
+        if trabajo["estado"] in ("completado", "fallido") or anyio.current_time() >= limite:
+            return trabajo
+        await anyio.sleep(espera)
+        espera = min(espera * 1.5, 2.0)
+
+
+# El cuerpo se lee en guardar_subida (no con UploadFile); el esquema queda documentado igual
+FORMULARIO_CSV = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"]
+                }
+            }
+        }
+    }
+}
+
+
+@router.post("/upload-csv", openapi_extra=FORMULARIO_CSV)
+async def upload_csv_file(request: Request, background_tasks: BackgroundTasks, sync: bool = False):
+    try:
+        target_path, tamano, sha256 = await guardar_subida(request, RAW_DIR)
+        print(f"[UPLOAD] Guardado en {target_path} ({tamano} bytes, sha256 {sha256})")
+    except HTTPException:
+        raise
+    except ValueError as e:
+        # Errores de python_multipart (cuerpo mal formado)
+        raise HTTPException(status_code=400, detail=f"Formulario multipart inválido: {e}")
     except Exception as e:
         print("[UPLOAD][ERROR] Falló guardado:", e)
         raise HTTPException(status_code=500, detail=f"Error guardando archivo: {e}")
 
-    def run_process(nombre):
+    respuesta = {"filename": target_path.name, "path": str(target_path), "bytes": tamano, "sha256": sha256}
+    csv_processor = _csv_processor()
+    trabajo = None
+    if csv_processor.cola_habilitada():
         try:
-            print("[PROCESS] Iniciando procesamiento de:", nombre)
-            services_dir = Path(__file__).resolve().parent.parent.parent / 'services'
-            if str(services_dir) not in sys.path:
-                sys.path.insert(0, str(services_dir))
-                print("[PROCESS] Añadido services al sys.path")
-            from app.services.csv_processor import csv_processor
-            resultado = csv_processor.procesar_archivo_especifico(Path(nombre).name)
-            print("[PROCESS] Resultado segmentos:", len(resultado) if isinstance(resultado, list) else resultado)
+            trabajo = await anyio.to_thread.run_sync(
+                csv_processor.encolar_archivo, target_path.name, PRIORIDAD_SYNC if sync else 0
+            )
         except Exception as e:
-            print("[PROCESS][ERROR]", e)
-            traceback.print_exc()
-
+            # PostgreSQL caído o sin la migración 005: el archivo ya está en raw, se procesa en el API
+            print("[UPLOAD][ERROR] No se pudo encolar; se procesa con el pool del API:", e)
+    if trabajo is not None:
+        respuesta["id_trabajo"] = trabajo["id_trabajo"]
+        if not sync:
+            return {"message": "Archivo subido y encolado", **respuesta, "estado": trabajo["estado"]}
+        # Lo procesa un proceso de trabajador_cola; el endpoint solo consulta el estado
+        trabajo = await esperar_trabajo(trabajo["id_trabajo"])
+        resultado = trabajo["resultado"] or {}
+        return {
+            "message": "Archivo subido y procesado (sync)" if trabajo["estado"] == "completado" else "Archivo subido (sync)",
+            **respuesta,
+            "status": {"completado": "success", "fallido": "error"}.get(trabajo["estado"], trabajo["estado"]),
+            "estado": trabajo["estado"],
+            "segmentos": resultado.get("segmentos", 0),
+            "duplicado_de": resultado.get("duplicado_de"),
+            "error": trabajo["error"]
+        }
+    # Sin cola (RECWAY_COLA_TRABAJOS=0 o no disponible): pool de procesos del API
     if sync:
-        run_process(target_path)
-        return {"message": "Archivo subido y procesado (sync)", "filename": target_path.name, "path": str(target_path)}
+        # El event loop queda libre mientras el pool procesa
+        registro = await run_process(target_path)
+        return {
+            "message": "Archivo subido y procesado (sync)",
+            **respuesta,
+            "status": registro["status"] if registro else "error",
+            "segmentos": registro["segmentos"] if registro else 0,
+            "duplicado_de": registro["duplicado_de"] if registro else None
+        }
     else:
         background_tasks.add_task(run_process, target_path)
-        return {"message": "Archivo subido", "filename": target_path.name, "path": str(target_path)}
+        return {"message": "Archivo subido", **respuesta}
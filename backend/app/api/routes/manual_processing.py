@@ -28,7 +28,7 @@ async def force_process_file(filename: str):
         result = csv_processor.procesar_archivo_especifico(filename)
         return {
             "message": f"Procesamiento de {filename} completado",
-            "result": result
+            "result": result.a_dicts()
         }
     except ValueError as e:
         # Error específico del algoritmo (como "La arista no existe en el grafo")
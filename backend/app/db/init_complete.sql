@@ -3,6 +3,9 @@
 -- Integra sistema de autenticación con la estructura de datos de RecWay
 -----------------------------------------------------------------------
 
+-- EXTENSIONES (PostGIS para la geometría de segmentos y posiciones GPS)
+CREATE EXTENSION IF NOT EXISTS postgis;
+
 -- ELIMINACIÓN DE TABLAS EN ORDEN CORRECTO
 DROP TABLE IF EXISTS registro_sensores;
 DROP TABLE IF EXISTS indices_muestra;
@@ -152,7 +155,9 @@ CREATE TABLE segmento (
     error_gps double precision,
     -- NUEVA COLUMNA: Asociar segmentos a usuarios/empresas
     created_by_user_id BIGINT REFERENCES users(id),
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    -- Línea del segmento (lon/lat) construida con los vértices de geometria
+    geom geometry(LineString, 4326)
 );
 
 -- GEOMETRÍA DEL SEGMENTO
@@ -161,7 +166,7 @@ CREATE TABLE geometria (
     orden integer NOT NULL,
     coordenada_x double precision NOT NULL,
     coordenada_y double precision NOT NULL,
-    id_segmento_seleccionado integer NOT NULL,
+    id_segmento_seleccionado bigint NOT NULL,
     FOREIGN KEY (id_segmento_seleccionado) REFERENCES segmento(id_segmento) ON DELETE CASCADE
 );
 
@@ -174,7 +179,7 @@ CREATE TABLE indicesSegmento (
     indice_primero double precision NOT NULL,
     indice_segundo double precision NOT NULL,
     iri_tercero double precision,
-    id_segmento_seleccionado integer NOT NULL,
+    id_segmento_seleccionado bigint NOT NULL,
     FOREIGN KEY (id_segmento_seleccionado) REFERENCES segmento(id_segmento) ON DELETE CASCADE
 );
 
@@ -187,7 +192,7 @@ CREATE TABLE huecoSegmento (
     velocidad double precision NOT NULL,
     ultima_fecha_muestra varchar(30),
     error_gps double precision,
-    id_segmento_seleccionado integer NOT NULL,
+    id_segmento_seleccionado bigint NOT NULL,
     FOREIGN KEY (id_segmento_seleccionado) REFERENCES segmento(id_segmento) ON DELETE CASCADE
 );
 
@@ -197,7 +202,7 @@ CREATE TABLE muestra (
     tipo_dispositivo varchar(30),
     identificador_dispositivo varchar(60),
     fecha_muestra varchar(40),
-    id_segmento_seleccionado integer NOT NULL,
+    id_segmento_seleccionado bigint NOT NULL,
     -- NUEVA COLUMNA: Asociar muestras a usuarios
     created_by_user_id BIGINT REFERENCES users(id),
     FOREIGN KEY (id_segmento_seleccionado) REFERENCES segmento(id_segmento) ON DELETE CASCADE
@@ -212,7 +217,7 @@ CREATE TABLE indices_muestra (
     indice_primero double precision NOT NULL,
     indice_segundo double precision NOT NULL,
     iri_tercero double precision,
-    id_muestra integer NOT NULL,
+    id_muestra bigint NOT NULL,
     FOREIGN KEY (id_muestra) REFERENCES muestra(id_muestra) ON DELETE CASCADE
 );
 
@@ -223,7 +228,7 @@ CREATE TABLE huecoMuestra (
     longitud double precision NOT NULL,
     magnitud double precision NOT NULL,
     velocidad double precision NOT NULL,
-    id_muestra_seleccionada integer NOT NULL,
+    id_muestra_seleccionada bigint NOT NULL,
     FOREIGN KEY (id_muestra_seleccionada) REFERENCES muestra(id_muestra) ON DELETE CASCADE
 );
 
@@ -257,8 +262,9 @@ CREATE TABLE fuente_datos_dispositivo (
 );
 
 -- REGISTRO DETALLADO DE CADA MUESTRA DE SENSOR
+-- Particionada por mes según timestamp (ms desde epoch, UTC); ver crear_particiones_registro
 CREATE TABLE registro_sensores (
-    id_registro bigserial PRIMARY KEY,
+    id_registro bigserial,
     timestamp bigint NOT NULL,
     acc_x double precision,
     acc_y double precision,
@@ -282,8 +288,95 @@ CREATE TABLE registro_sensores (
     device_orientation double precision,
     sample_rate double precision,
     gps_changed boolean DEFAULT false,
-    id_fuente integer NOT NULL,
+    posicion geometry(Point, 4326) GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(gps_lng, gps_lat), 4326)) STORED,
+    id_fuente bigint NOT NULL,
+    PRIMARY KEY (id_registro, timestamp),
     FOREIGN KEY (id_fuente) REFERENCES fuente_datos_dispositivo(id_fuente) ON DELETE CASCADE
+) PARTITION BY RANGE (timestamp);
+
+-- Filas fuera de las particiones mensuales (timestamps inválidos o meses sin partición)
+CREATE TABLE registro_sensores_default PARTITION OF registro_sensores DEFAULT;
+
+-- Crea las particiones mensuales que cubren [desde, hasta] (ms). No crea un mes si
+-- registro_sensores_default ya tiene filas de ese mes (PostgreSQL no lo permitiría).
+CREATE OR REPLACE FUNCTION crear_particiones_registro(desde bigint, hasta bigint) RETURNS integer AS $$
+DECLARE
+    mes date := date_trunc('month', to_timestamp(desde / 1000.0) AT TIME ZONE 'UTC')::date;
+    ultimo date := date_trunc('month', to_timestamp(hasta / 1000.0) AT TIME ZONE 'UTC')::date;
+    inicio bigint;
+    fin bigint;
+    nombre text;
+    creadas integer := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('registro_sensores_particiones'));
+    WHILE mes <= ultimo LOOP
+        nombre := 'registro_sensores_' || to_char(mes, 'YYYYMM');
+        inicio := (extract(epoch FROM mes::timestamp AT TIME ZONE 'UTC') * 1000)::bigint;
+        fin := (extract(epoch FROM (mes + interval '1 month')::timestamp AT TIME ZONE 'UTC') * 1000)::bigint;
+        IF to_regclass(nombre) IS NULL THEN
+            IF EXISTS (SELECT 1 FROM registro_sensores_default WHERE timestamp >= inicio AND timestamp < fin) THEN
+                RAISE NOTICE 'registro_sensores_default tiene filas de %; no se crea la partición', nombre;
+            ELSE
+                EXECUTE format('CREATE TABLE %I PARTITION OF registro_sensores FOR VALUES FROM (%s) TO (%s)',
+                               nombre, inicio, fin);
+                creadas := creadas + 1;
+            END IF;
+        END IF;
+        mes := (mes + interval '1 month')::date;
+    END LOOP;
+    RETURN creadas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Elimina las particiones mensuales anteriores a los últimos meses_retencion meses
+CREATE OR REPLACE FUNCTION eliminar_particiones_registro(meses_retencion integer) RETURNS integer AS $$
+DECLARE
+    limite text := to_char(date_trunc('month', now() AT TIME ZONE 'UTC') - make_interval(months => meses_retencion), 'YYYYMM');
+    particion record;
+    eliminadas integer := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('registro_sensores_particiones'));
+    FOR particion IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'registro_sensores'::regclass
+          AND c.relname ~ '^registro_sensores_[0-9]{6}$'
+          AND right(c.relname, 6) < limite
+    LOOP
+        EXECUTE format('ALTER TABLE registro_sensores DETACH PARTITION %I', particion.relname);
+        EXECUTE format('DROP TABLE %I', particion.relname);
+        eliminadas := eliminadas + 1;
+    END LOOP;
+    RETURN eliminadas;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT crear_particiones_registro(
+    (extract(epoch FROM now()) * 1000)::bigint,
+    (extract(epoch FROM now() + interval '1 month') * 1000)::bigint
+);
+
+-- Cola de trabajos de procesamiento (services/cola_trabajos.py): los trabajadores
+-- toman filas 'pendiente' con FOR UPDATE SKIP LOCKED
+CREATE TABLE trabajos_procesamiento (
+    id_trabajo bigserial PRIMARY KEY,
+    archivo varchar(255) NOT NULL,
+    estado varchar(20) NOT NULL DEFAULT 'pendiente'
+        CHECK (estado IN ('pendiente', 'en_proceso', 'completado', 'fallido')),
+    prioridad integer NOT NULL DEFAULT 0,
+    intentos integer NOT NULL DEFAULT 0,
+    max_intentos integer NOT NULL DEFAULT 3,
+    progreso real NOT NULL DEFAULT 0,
+    etapa varchar(50),
+    trabajador varchar(100),
+    resultado jsonb,
+    error text,
+    creado_en timestamptz NOT NULL DEFAULT now(),
+    disponible_en timestamptz NOT NULL DEFAULT now(),
+    iniciado_en timestamptz,
+    actualizado_en timestamptz NOT NULL DEFAULT now(),
+    terminado_en timestamptz
 );
 
 -----------------------------------------------------------------------
@@ -362,114 +455,6 @@ SELECT 1, sp.id, TRUE FROM subscription_plans sp WHERE sp.name = 'Enterprise';
 -- 3. Gestión de empresas y suscripciones
 -- 4. Análisis de datos viales (RecWay original)
 -- 5. Asociación de datos a usuarios específicos
-    iri_tercero double precision,
-    id_segmento_seleccionado integer NOT NULL,
-    FOREIGN KEY (id_segmento_seleccionado) REFERENCES segmento(id_segmento) ON DELETE CASCADE
-);
-
--- HUECOS ASOCIADOS AL SEGMENTO
-CREATE TABLE huecoSegmento (
-    id_hueco_segmento bigserial PRIMARY KEY,
-    latitud double precision NOT NULL,
-    longitud double precision NOT NULL,
-    magnitud double precision NOT NULL,
-    velocidad double precision NOT NULL,
-    ultima_fecha_muestra varchar(30),
-    error_gps double precision,
-    id_segmento_seleccionado integer NOT NULL,
-    FOREIGN KEY (id_segmento_seleccionado) REFERENCES segmento(id_segmento) ON DELETE CASCADE
-);
-
--- MUESTRAS (GRABACIONES DE UN USUARIO EN UN SEGMENTO)
-CREATE TABLE muestra (
-    id_muestra bigserial PRIMARY KEY,
-    tipo_dispositivo varchar(30),
-    identificador_dispositivo varchar(60),
-    fecha_muestra varchar(40),
-    id_segmento_seleccionado integer NOT NULL,
-    FOREIGN KEY (id_segmento_seleccionado) REFERENCES segmento(id_segmento) ON DELETE CASCADE
-);
-
--- ÍNDICES CALCULADOS POR MUESTRA
-CREATE TABLE indices_muestra (
-    id_indice_muestra bigserial PRIMARY KEY,
-    nota_general double precision NOT NULL,
-    iri_modificado double precision NOT NULL,
-    iri_estandar double precision NOT NULL,
-    indice_primero double precision NOT NULL,
-    indice_segundo double precision NOT NULL,
-    iri_tercero double precision,
-    id_muestra integer NOT NULL,
-    FOREIGN KEY (id_muestra) REFERENCES muestra(id_muestra) ON DELETE CASCADE
-);
-
--- HUECOS INDIVIDUALIZADOS POR MUESTRA
-CREATE TABLE huecoMuestra (
-    id_hueco_muestra bigserial PRIMARY KEY,
-    latitud double precision NOT NULL,
-    longitud double precision NOT NULL,
-    magnitud double precision NOT NULL,
-    velocidad double precision NOT NULL,
-    id_muestra_seleccionada integer NOT NULL,
-    FOREIGN KEY (id_muestra_seleccionada) REFERENCES muestra(id_muestra) ON DELETE CASCADE
-);
-
--- METAINFORMACIÓN DEL DISPOSITIVO QUE ENVÍA LA INFORMACIÓN
-CREATE TABLE fuente_datos_dispositivo (
-    id_fuente bigserial PRIMARY KEY,
-    device_id varchar(100),
-    session_id varchar(100),
-    platform varchar(50),
-    device_model varchar(100),
-    manufacturer varchar(100),
-    brand varchar(100),
-    os_version varchar(50),
-    app_version varchar(100),
-    company varchar(100),
-    android_id varchar(100),
-    battery_info varchar(100),
-    acc_available boolean,
-    acc_info varchar(100),
-    gyro_available boolean,
-    gyro_info varchar(100),
-    gps_available boolean,
-    gps_info varchar(100),
-    export_date timestamp,
-    total_records integer,
-    sampling_rate real,
-    recording_duration varchar(20),
-    average_sample_rate real
-);
-
--- REGISTRO DETALLADO DE CADA MUESTRA DE SENSOR
-CREATE TABLE registro_sensores (
-    id_registro bigserial PRIMARY KEY,
-    timestamp bigint NOT NULL,
-    acc_x double precision,
-    acc_y double precision,
-    acc_z double precision,
-    acc_magnitude double precision,
-    gyro_x double precision,
-    gyro_y double precision,
-    gyro_z double precision,
-    gyro_magnitude double precision,
-    gps_lat double precision,
-    gps_lng double precision,
-    gps_accuracy double precision,
-    gps_speed double precision,
-    gps_speed_accuracy double precision,
-    gps_altitude double precision,
-    gps_altitude_accuracy double precision,
-    gps_heading double precision,
-    gps_heading_accuracy double precision,
-    gps_timestamp bigint,
-    gps_provider varchar(50),
-    device_orientation double precision,
-    sample_rate double precision,
-    gps_changed boolean DEFAULT false,
-    id_fuente integer NOT NULL,
-    FOREIGN KEY (id_fuente) REFERENCES fuente_datos_dispositivo(id_fuente) ON DELETE CASCADE
-);
 
 -- CREAR ÍNDICES PARA MEJORAR EL RENDIMIENTO
 CREATE INDEX idx_geometria_segmento ON geometria(id_segmento_seleccionado);
@@ -479,9 +464,18 @@ CREATE INDEX idx_hueco_segmento ON huecoSegmento(id_segmento_seleccionado);
 CREATE INDEX idx_muestra_segmento ON muestra(id_segmento_seleccionado);
 CREATE INDEX idx_indices_muestra ON indices_muestra(id_muestra);
 CREATE INDEX idx_hueco_muestra ON huecoMuestra(id_muestra_seleccionada);
-CREATE INDEX idx_registro_fuente ON registro_sensores(id_fuente);
-CREATE INDEX idx_registro_timestamp ON registro_sensores(timestamp);
-CREATE INDEX idx_registro_gps ON registro_sensores(gps_lat, gps_lng);
+-- registro_sensores se carga en orden de llegada: timestamp e id_fuente crecen con la
+-- posición física de las filas y un BRIN (unos KB por partición) reemplaza a los B-tree
+CREATE INDEX idx_registro_fuente ON registro_sensores USING BRIN (id_fuente);
+CREATE INDEX idx_registro_timestamp ON registro_sensores USING BRIN (timestamp);
+-- Índices espaciales (consultas por caja con && o por distancia con geom::geography)
+CREATE INDEX idx_segmento_geom ON segmento USING GIST (geom);
+CREATE INDEX idx_registro_posicion ON registro_sensores USING GIST (posicion);
+-- Cola de trabajos: siguiente pendiente por prioridad y un solo trabajo activo por archivo
+CREATE INDEX idx_trabajos_pendientes ON trabajos_procesamiento (prioridad DESC, disponible_en, id_trabajo)
+    WHERE estado = 'pendiente';
+CREATE UNIQUE INDEX idx_trabajos_archivo_activo ON trabajos_procesamiento (archivo)
+    WHERE estado IN ('pendiente', 'en_proceso');
 
 -- COMENTARIOS PARA DOCUMENTACIÓN
 COMMENT ON TABLE segmento IS 'Tabla principal de segmentos de carretera con información geográfica y características';
@@ -493,6 +487,7 @@ COMMENT ON TABLE indices_muestra IS 'Índices de calidad calculados para cada mu
 COMMENT ON TABLE huecoMuestra IS 'Huecos individuales detectados en cada muestra';
 COMMENT ON TABLE fuente_datos_dispositivo IS 'Metainformación de dispositivos que recolectan datos';
 COMMENT ON TABLE registro_sensores IS 'Registros detallados de sensores (acelerómetro, giroscopio, GPS) por dispositivo';
+COMMENT ON TABLE trabajos_procesamiento IS 'Cola de trabajos de procesamiento de archivos CSV (estado, progreso, reintentos)';
 
 -- Mensaje de confirmación
 SELECT 'Database RecWay initialized successfully with all 9 tables!' as status;
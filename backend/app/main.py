@@ -9,6 +9,9 @@ from app.db.session import get_db
 import app.models
 from app.api.endpoints.upload import router as upload_router
 from app.api.endpoints.auto_processing import router as auto_processing_router
+from app.api.endpoints.segmentos import router as segmentos_router
+from app.api.endpoints.trabajos import router as trabajos_router
+from app.api.endpoints.streaming import router as streaming_router
 from app.services.file_watcher import start_file_watcher, stop_file_watcher
 try:
     from app.api.routes.manual_processing import router as manual_processing_router
@@ -42,6 +45,9 @@ app.add_middleware(
 app.include_router(auth_router)
 app.include_router(upload_router, prefix=settings.API_V1_STR + "/files", tags=["files"])
 app.include_router(auto_processing_router, prefix=settings.API_V1_STR + "/auto-process", tags=["auto-processing"])
+app.include_router(segmentos_router, prefix=settings.API_V1_STR + "/segments", tags=["segments"])
+app.include_router(trabajos_router, prefix=settings.API_V1_STR + "/jobs", tags=["jobs"])
+app.include_router(streaming_router, prefix=settings.API_V1_STR + "/stream", tags=["streaming"])
 if manual_processing_router:
     app.include_router(manual_processing_router, prefix=settings.API_V1_STR + "/manual-process", tags=["manual-processing"])
 
@@ -0,0 +1,224 @@
+"""
+Adyacencia precomputada entre aristas de una tesela y vecindarios memoizados.
+
+ubicar_muestra_grafo llamaba a ap.caminos_hasta_distanciav2 cada vez que la
+muestra salía del corredor de su arista: un BFS sobre ap.edges_conectados que
+copia listas de caminos, recorre cada camino para evitar ciclos y vuelve a
+consultar G.predecessors / G.successors. Aquí:
+- La adyacencia entre aristas (exactamente el orden de ap.edges_conectados) se
+  construye una vez por tesela como CSR: vecinos[puntero[e]:puntero[e + 1]]
+- El vecindario "aristas a menos de D metros de la arista e" con su nivel,
+  distancia acumulada y bandera 'valor' se calcula una vez por (u, v, D) con un
+  BFS sobre enteros y se guarda como arreglos; obtener los candidatos es un
+  slice de esos arreglos
+
+El resultado coincide con caminos_hasta_distanciav2 sobre el grafo de la tesela
+(TeselaGrafo.G), incluyendo el orden de los candidatos dentro de cada nivel.
+"""
+import threading
+import weakref
+from collections import defaultdict, deque
+
+import numpy as np
+
+
+class Vecindario:
+    """
+    Aristas alcanzables desde una arista, en el orden del BFS de caminos_hasta_distanciav2 (nivel >= 1).
+
+    - aristas: posición de cada arista (v1, v2, key) encontrada
+    - aristas_key0: posición de (v1, v2, 0), que es la que evalúa ubicar_muestra_grafo (-1 si no existe)
+    - niveles, distancias, valores: nivel, distancia acumulada y bandera 'valor' del BFS
+    - caminos: el mismo resultado en el formato de diccionario de caminos_hasta_distanciav2
+    """
+
+    __slots__ = ('aristas', 'aristas_key0', 'niveles', 'distancias', 'valores', 'caminos')
+
+    def __init__(self, aristas, aristas_key0, niveles, distancias, valores, caminos):
+        self.aristas = aristas
+        self.aristas_key0 = aristas_key0
+        self.niveles = niveles
+        self.distancias = distancias
+        self.valores = valores
+        self.caminos = caminos
+
+    def __len__(self):
+        return len(self.aristas)
+
+
+class AdyacenciaAristas:
+    """Adyacencia arista -> aristas conectadas (CSR) de una tesela."""
+
+    def __init__(self, tesela):
+        self.tesela = tesela
+        self.aristas = np.asarray(tesela.aristas)
+        self.aristas_nodos = np.asarray(tesela.aristas_nodos)
+        self.longitud = np.asarray(tesela.longitud)
+        self.puntero, self.vecinos = adyacencia_csr(self.aristas_nodos, len(tesela.nodos_id))
+        # Identificador del par no dirigido {u, v} de cada arista (para evitar ciclos y repetidos)
+        menor = self.aristas_nodos.min(axis=1)
+        mayor = self.aristas_nodos.max(axis=1)
+        _, self.par = np.unique(menor * len(tesela.nodos_id) + mayor, return_inverse=True)
+        self.par = self.par.reshape(-1)
+        self.posicion_nodo = {nodo: i for i, nodo in enumerate(np.asarray(tesela.nodos_id).tolist())}
+        # (posición de u, posición de v) -> posición de la arista (u, v, 0)
+        llaves = np.asarray(self.aristas[:, 2])
+        self.indice_key0 = {
+            (u, v): i for i, (u, v) in enumerate(self.aristas_nodos.tolist()) if llaves[i] == 0
+        }
+        self._vecindarios = {}
+        self._lock = threading.Lock()
+        # Listas de Python para el BFS (acceso por elemento mucho más rápido que en arreglos)
+        self._puntero = self.puntero.tolist()
+        self._vecinos = self.vecinos.tolist()
+        self._par = self.par.tolist()
+        self._nodos = self.aristas_nodos.tolist()
+        self._longitud = self.longitud.tolist()
+
+    def conectadas(self, indice):
+        """Aristas conectadas a la arista indicada (mismo orden que ap.edges_conectados)."""
+        return self.vecinos[self.puntero[indice]:self.puntero[indice + 1]]
+
+    def vecindario(self, u, v, distancia_maxima):
+        """
+        Vecindario memoizado de la arista (u, v) equivalente a ap.caminos_hasta_distanciav2(G, u, v, distancia_maxima).
+
+        Args:
+            u, v: Identificadores OSM de los nodos de la arista.
+            distancia_maxima (float): Distancia en metros hasta la que se expanden los caminos.
+
+        Returns:
+            Vecindario o None si (u, v) no es una arista de la tesela.
+        """
+        clave = (u, v, distancia_maxima)
+        vecindario = self._vecindarios.get(clave)
+        if vecindario is None:
+            pu, pv = self.posicion_nodo.get(u), self.posicion_nodo.get(v)
+            inicio = self._arista_de_nodos(pu, pv)
+            if inicio is None:
+                return None
+            vecindario = self._explorar(inicio, u, v, distancia_maxima)
+            with self._lock:
+                self._vecindarios[clave] = vecindario
+        return vecindario
+
+    def caminos(self, u, v, distancia_maxima):
+        """Mismo resultado (diccionario {nivel: [(v1, v2, key, length, distancia, valor)]}) que ap.caminos_hasta_distanciav2."""
+        vecindario = self.vecindario(u, v, distancia_maxima)
+        return vecindario.caminos if vecindario is not None else {0: [(u, v, 0, 0, 0, 0)]}
+
+    def _arista_de_nodos(self, pu, pv):
+        if pu is None or pv is None:
+            return None
+        indice = self.indice_key0.get((pu, pv))
+        if indice is None:
+            coincidencias = np.flatnonzero((self.aristas_nodos[:, 0] == pu) & (self.aristas_nodos[:, 1] == pv))
+            indice = int(coincidencias[0]) if len(coincidencias) else None
+        return indice
+
+    def _explorar(self, inicio, u, v, distancia_maxima):
+        # Mismo recorrido que caminos_hasta_distanciav2, sobre enteros y tuplas de pares
+        puntero, vecinos, par, nodos, longitud = self._puntero, self._vecinos, self._par, self._nodos, self._longitud
+        pu, pv = nodos[inicio]
+        vistos_por_nivel = defaultdict(set)
+        vistos_por_nivel[0].add(par[inicio])
+        registros = []
+        cola = deque()
+        cola.append(((par[inicio],), inicio, 0, None))  # pares del camino, arista, distancia, primera arista
+        while cola:
+            camino, actual, distancia_actual, primera = cola.popleft()
+            nivel_nuevo = len(camino)
+            vistos = vistos_por_nivel[nivel_nuevo]
+            for siguiente in vecinos[puntero[actual]:puntero[actual + 1]]:
+                par_siguiente = par[siguiente]
+                if par_siguiente in camino or par_siguiente in vistos:
+                    continue
+                nueva_distancia = distancia_actual + longitud[siguiente]
+                if nivel_nuevo == 1:
+                    primera_siguiente = siguiente
+                    valor = 0 if pu in nodos[siguiente] else (1 if pv in nodos[siguiente] else 0)
+                else:
+                    primera_siguiente = primera
+                    valor = 0 if pu in nodos[primera] else 1
+                registros.append((siguiente, nivel_nuevo, nueva_distancia, valor))
+                vistos.add(par_siguiente)
+                if nueva_distancia < distancia_maxima:
+                    cola.append((camino + (par_siguiente,), siguiente, nueva_distancia, primera_siguiente))
+
+        registros.sort(key=lambda registro: registro[1])  # estable: conserva el orden dentro de cada nivel
+        aristas = np.array([r[0] for r in registros], dtype=np.int64)
+        niveles = np.array([r[1] for r in registros], dtype=np.int64)
+        distancias = np.array([r[2] for r in registros], dtype=np.float64)
+        valores = np.array([r[3] for r in registros], dtype=np.int64)
+        aristas_key0 = np.array(
+            [self.indice_key0.get(tuple(nodos[arista]), -1) for arista in aristas.tolist()], dtype=np.int64
+        )
+        caminos = {0: [(u, v, 0, 0, 0, 0)]}
+        for (v1, v2, key), nivel, longitud_arista, distancia, valor in zip(
+            self.aristas[aristas].tolist(), niveles.tolist(), self.longitud[aristas].tolist(),
+            distancias.tolist(), valores.tolist()
+        ):
+            caminos.setdefault(nivel, []).append((v1, v2, key, longitud_arista, distancia, valor))
+        return Vecindario(aristas, aristas_key0, niveles, distancias, valores, caminos)
+
+
+def adyacencia_csr(aristas_nodos, cantidad_nodos):
+    """
+    Adyacencia entre aristas en formato CSR con el mismo orden que ap.edges_conectados:
+    entradas a u, salidas de u (sin v), salidas de v, entradas a v (sin u).
+
+    El orden de predecesores/sucesores de cada nodo es el de networkx para un grafo
+    construido agregando las aristas en el orden de la tesela: por primera aparición
+    del par de nodos y luego por posición de la arista.
+
+    Returns:
+        (puntero, vecinos): vecinos[puntero[e]:puntero[e + 1]] son las aristas conectadas a e.
+    """
+    cantidad = len(aristas_nodos)
+    if cantidad == 0:
+        return np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64)
+    origen, destino = aristas_nodos[:, 0], aristas_nodos[:, 1]
+    indices = np.arange(cantidad)
+    _, inverso = np.unique(origen * cantidad_nodos + destino, return_inverse=True)
+    primera_par = np.full(inverso.max() + 1, cantidad, dtype=np.int64)
+    np.minimum.at(primera_par, inverso.reshape(-1), indices)
+    primera = primera_par[inverso.reshape(-1)]
+
+    # CSR por nodo de las aristas salientes y entrantes, en orden de networkx
+    salientes = np.lexsort((indices, primera, origen))
+    entrantes = np.lexsort((indices, primera, destino))
+    puntero_sal = np.r_[0, np.cumsum(np.bincount(origen, minlength=cantidad_nodos))]
+    puntero_ent = np.r_[0, np.cumsum(np.bincount(destino, minlength=cantidad_nodos))]
+
+    partes = []
+    # (nodo cuyo listado se recorre, CSR, extremo del vecino a comparar, nodo excluido)
+    for orden_parte, (nodo, puntero, orden, extremo, excluido) in enumerate((
+        (origen, puntero_ent, entrantes, origen, destino),   # (p, u) con p != v
+        (origen, puntero_sal, salientes, destino, destino),  # (u, s) con s != v
+        (destino, puntero_sal, salientes, destino, origen),  # (v, s) con s != u
+        (destino, puntero_ent, entrantes, origen, origen),   # (p, v) con p != u
+    )):
+        conteo = puntero[nodo + 1] - puntero[nodo]
+        arista = np.repeat(indices, conteo)
+        local = np.arange(len(arista)) - np.repeat(np.cumsum(conteo) - conteo, conteo)
+        vecino = orden[np.repeat(puntero[nodo], conteo) + local]
+        valido = extremo[vecino] != excluido[arista]
+        partes.append((arista[valido], np.full(valido.sum(), orden_parte), local[valido], vecino[valido]))
+    arista, parte, local, vecino = (np.concatenate(columna) for columna in zip(*partes))
+    orden = np.lexsort((local, parte, arista))
+    puntero = np.r_[0, np.cumsum(np.bincount(arista, minlength=cantidad))].astype(np.int64)
+    return puntero, vecino[orden].astype(np.int64)
+
+
+_adyacencias = weakref.WeakKeyDictionary()
+_lock_adyacencias = threading.Lock()
+
+
+def adyacencia_grafo(tesela):
+    """Retorna (construyendo una sola vez) la AdyacenciaAristas de una tesela."""
+    with _lock_adyacencias:
+        adyacencia = _adyacencias.get(tesela)
+        if adyacencia is None:
+            adyacencia = AdyacenciaAristas(tesela)
+            _adyacencias[tesela] = adyacencia
+    return adyacencia
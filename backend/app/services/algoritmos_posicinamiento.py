@@ -2,11 +2,12 @@ import numpy as np
 import pandas as pd
 import os
 from shapely.geometry import Point, Polygon
-from geopy.distance import geodesic
 import osmnx as ox
 import networkx as nx
 import math
 from datetime import datetime
+import manifiesto_grafos as mg
+import distancias as dist
 
 
 def encontrar_area_latlon(lat1, lon1, lat2, lon2, L):
@@ -191,7 +192,7 @@ def obtener_coordenadas_segmento(G, id_segmento, info_segmento):
     return segmento_coordenadas
 
 
-def proyectar_segmento(segmento_coords, longitud, latitud):
+def proyectar_segmento(segmento_coords, longitud, latitud, modo_distancia=None):
     """
     Proyecta ortogonalmente un punto (longitud, latitud) sobre un segmento de carretera.
 
@@ -199,50 +200,20 @@ def proyectar_segmento(segmento_coords, longitud, latitud):
         segmento_coords (list): Lista de tuplas [(lon, lat), (lon, lat), ...] que representan el segmento.
         longitud (float): Longitud del punto a proyectar.
         latitud (float): Latitud del punto a proyectar.
+        modo_distancia (str): Modo de distancias.distancia usado para escoger el tramo más cercano.
 
     Returns:
         tuple: (latitud_proyectada, longitud_proyectada) el punto más cercano sobre el segmento.
     """
-
-    punto = (longitud, latitud)
-    distancia_min = float('inf')
-    punto_proyectado = None
-
-    # Recorremos cada tramo (par de puntos consecutivos)
-    for i in range(len(segmento_coords) - 1):
-        p1 = segmento_coords[i]
-        p2 = segmento_coords[i + 1]
-
-        # Proyección ortogonal usando fórmula vectorial en coordenadas planas
-        x1, y1 = p1
-        x2, y2 = p2
-        x0, y0 = punto
-
-        dx = x2 - x1
-        dy = y2 - y1
-
-        if dx == 0 and dy == 0:
-            # p1 y p2 son el mismo punto
-            proy_x, proy_y = x1, y1
-        else:
-            # Parámetro t para proyección sobre el segmento
-            t = ((x0 - x1) * dx + (y0 - y1) * dy) / (dx**2 + dy**2)
-            t = max(0, min(1, t))  # Limitar t entre 0 y 1
-
-            proy_x = x1 + t * dx
-            proy_y = y1 + t * dy
-
-        proy_punto = (proy_y, proy_x)
-        distancia = geodesic((latitud, longitud), (proy_y, proy_x)).meters
-
-        if distancia < distancia_min:
-            distancia_min = distancia
-            punto_proyectado = proy_punto
-
-    return punto_proyectado
+    if len(segmento_coords) < 2:
+        return None
+    # Proyección sobre todos los tramos a la vez (distancias vectorizadas en lugar de geodesic por tramo)
+    proy_x, proy_y, distancias = dist.distancias_a_tramos(segmento_coords, longitud, latitud, modo_distancia)
+    mas_cercano = int(np.argmin(distancias))
+    return (float(proy_y[mas_cercano]), float(proy_x[mas_cercano]))
 
 
-def distancia_segmento(segmento_coords, longitud, latitud):
+def distancia_segmento(segmento_coords, longitud, latitud, modo_distancia=None):
     """
     Proyecta ortogonalmente un punto (longitud, latitud) sobre un segmento de carretera y determinar su distancia.
 
@@ -250,47 +221,17 @@ def distancia_segmento(segmento_coords, longitud, latitud):
         segmento_coords (list): Lista de tuplas [(lon, lat), (lon, lat), ...] que representan el segmento.
         longitud (float): Longitud del punto a proyectar.
         latitud (float): Latitud del punto a proyectar.
+        modo_distancia (str): Modo de distancias.distancia.
 
     Returns:
         distancia: float que representa la distancia del punto más cercano sobre el segmento.
     """
-
-    punto = (longitud, latitud)
-    distancia_min = float('inf')
-    punto_proyectado = None
-
-    # Recorremos cada tramo (par de puntos consecutivos)
-    for i in range(len(segmento_coords) - 1):
-        p1 = segmento_coords[i]
-        p2 = segmento_coords[i + 1]
-
-        # Proyección ortogonal usando fórmula vectorial en coordenadas planas
-        x1, y1 = p1
-        x2, y2 = p2
-        x0, y0 = punto
-
-        dx = x2 - x1
-        dy = y2 - y1
-
-        if dx == 0 and dy == 0:
-            # p1 y p2 son el mismo punto
-            proy_x, proy_y = x1, y1
-        else:
-            # Parámetro t para proyección sobre el segmento
-            t = ((x0 - x1) * dx + (y0 - y1) * dy) / (dx**2 + dy**2)
-            t = max(0, min(1, t))  # Limitar t entre 0 y 1
-
-            proy_x = x1 + t * dx
-            proy_y = y1 + t * dy
-
-        proy_punto = (proy_y, proy_x)
-        distancia = geodesic((latitud, longitud), (proy_y, proy_x)).meters
-
-        if distancia < distancia_min:
-            distancia_min = distancia
-            punto_proyectado = proy_punto
-
-    return distancia
+    if len(segmento_coords) < 2:
+        return float('inf')
+    # Se conserva el comportamiento original: la distancia retornada es la del último tramo recorrido
+    segmento = np.asarray(segmento_coords, dtype=np.float64)
+    _, _, distancias = dist.distancias_a_tramos(segmento[-2:], longitud, latitud, modo_distancia)
+    return float(distancias[-1])
 
 
 def cargar_csv_con_metadatos(carpeta, nombre_csv):
@@ -394,6 +335,15 @@ def eliminar_muestras_gps_duplicadas(df):
 
     return df_invertido
 
+# Coordenadas de referencia para el primer grafo (esquina superior izquierda).
+LAT_ORIGEN_GRAFOS = 12.461201  # Latitud (Y)
+LON_ORIGEN_GRAFOS = -79.457520  # Longitud (X)
+
+# Tamaño de cada celda en términos de latitud y longitud, y cantidad de columnas de la grilla.
+INTERVALO_LON_GRAFOS = 0.309800875
+INTERVALO_LAT_GRAFOS = 0.4102147
+COLUMNAS_GRAFOS = 40
+
 def confirmar_grafo(latitud, longitud, numero_grafo,carpeta_grafo):
     """
     Confirma si un par de coordenadas está dentro del área de un grafo específico.
@@ -402,41 +352,18 @@ def confirmar_grafo(latitud, longitud, numero_grafo,carpeta_grafo):
     - latitud: Coordenada de latitud.
     - longitud: Coordenada de longitud.
     - numero_grafo: Número de grafo a confirmar.
+    - carpeta_grafo: Carpeta donde se almacenan los archivos de grafos.
 
     Devuelve:
     - 1 si el par de coordenadas está dentro del área del grafo, 0 en caso contrario.
     """
-    # Ruta del directorio donde se almacenan los archivos de grafos.
-    directorio_a_buscar = carpeta_grafo  # Reemplaza con la ruta de tu carpeta
-
-    # Prefijo que se busca en los nombres de archivo.
-    prefijo_a_buscar = 'segN' + str(numero_grafo) + 'pos'  # Reemplaza con el prefijo que deseas buscar
-
-    # Busca archivos en el directorio con el prefijo proporcionado.
-    archivos_encontrados = buscar_archivos_por_prefijo(directorio_a_buscar, prefijo_a_buscar)
-
-    # Extrae las coordenadas del nombre del archivo.
-    posicion_corte = str(archivos_encontrados).find('pos')
-    nombre_reducido = (str(archivos_encontrados)[posicion_corte + 3:-10])
-    posicion = [-1]
-    
-    # Encuentra las posiciones de los delimitadores '&' en el nombre del archivo.
-    for i in range(len(nombre_reducido)):
-        if nombre_reducido[i] == '&':
-            posicion.append(i)
-    posicion.append(-1)
-    
-    # Verifica si se encuentran las cinco coordenadas necesarias para definir el área.
-    if len(posicion) == 5:
-        lat_izquierda = float(nombre_reducido[posicion[0] + 1:posicion[1]])
-        lat_derecha = float(nombre_reducido[posicion[1] + 1:posicion[2]])
-        lon_izquierda = float(nombre_reducido[posicion[2] + 1:posicion[3]])
-        lon_derecha = float(nombre_reducido[posicion[3] + 1:posicion[4]])
-    else:
+    # El área de cada grafo se toma del manifiesto de la carpeta (consulta O(1), sin recorrer archivos)
+    entrada = mg.obtener_manifiesto(carpeta_grafo).obtener(numero_grafo)
+    if entrada is None:
         return 0
-    
+
     # Comprueba si las coordenadas dadas están dentro del área del grafo.
-    if ((lat_izquierda > latitud) and (lat_derecha < latitud) and (lon_izquierda < longitud) and (lon_derecha > longitud)):
+    if entrada.contiene(latitud, longitud):
         return 1
     else:
         return 0
@@ -452,23 +379,29 @@ def determinar_grafo(latitud, longitud):
     Devuelve:
     - Número de grafo asignado basado en la ubicación proporcionada.
     """
-    # Coordenadas de referencia para el primer grafo (esquina superior izquierda).
-    lat_original = 12.461201  # Latitud (Y)
-    lon_original = -79.457520  # Longitud (X)
-
-    # Tamaño de cada celda en términos de latitud y longitud.
-    intervalo_lon = 0.309800875
-    intervalo_lat = 0.4102147
-
     # Calcula la posición del grafo en términos de filas (latitud) y columnas (longitud).
-    posicion_grafo_y = int(abs(lat_original - latitud) / intervalo_lat)
-    posicion_grafo_x = int(abs(lon_original - longitud) / intervalo_lon)
+    posicion_grafo_y = int(abs(LAT_ORIGEN_GRAFOS - latitud) / INTERVALO_LAT_GRAFOS)
+    posicion_grafo_x = int(abs(LON_ORIGEN_GRAFOS - longitud) / INTERVALO_LON_GRAFOS)
 
     # Calcula el número de grafo basado en la posición.
-    numero_grafo = posicion_grafo_y * 40 + posicion_grafo_x
+    numero_grafo = posicion_grafo_y * COLUMNAS_GRAFOS + posicion_grafo_x
 
     return numero_grafo
 
+def determinar_grafos(latitudes, longitudes):
+    """
+    Versión vectorizada de determinar_grafo para arreglos de coordenadas.
+
+    Parámetros:
+    - latitudes, longitudes: arreglos NumPy de igual tamaño.
+
+    Devuelve:
+    - Arreglo int64 con el número de grafo de cada par de coordenadas.
+    """
+    posicion_grafo_y = (np.abs(LAT_ORIGEN_GRAFOS - latitudes) / INTERVALO_LAT_GRAFOS).astype(np.int64)
+    posicion_grafo_x = (np.abs(LON_ORIGEN_GRAFOS - longitudes) / INTERVALO_LON_GRAFOS).astype(np.int64)
+    return posicion_grafo_y * COLUMNAS_GRAFOS + posicion_grafo_x
+
 def buscar_archivos_por_prefijo(directorio, prefijo):
     """
     Busca archivos en un directorio con un prefijo específico.
@@ -794,6 +727,63 @@ def punto_en_recta_geografica_simple(lat1, lon1, lat2, lon2, distancia_m, distan
 
     return lon_interpolado,lat_interpolado 
 
+def dividir_segmento(coordenadas_segmento, longitud_segmento, segmento_maximo):
+    """
+    Divide un segmento en subsegmentos de igual longitud cuando supera segmento_maximo.
+
+    Parámetros:
+        coordenadas_segmento : list[tuple[float, float]]
+            Coordenadas (lon, lat) del segmento.
+        longitud_segmento : float
+            Longitud del segmento en metros (atributo 'length' de la arista).
+        segmento_maximo : float
+            Longitud máxima de cada subsegmento en metros.
+
+    Retorna:
+        (lista_total, longitud_subsegmento) : tuple[list[list[tuple]], float]
+            Lista de subsegmentos (cada uno una lista de coordenadas) y la longitud de cada uno.
+    """
+    if longitud_segmento <= segmento_maximo:
+        return [coordenadas_segmento], longitud_segmento
+
+    cantidad_divisiones = int(longitud_segmento / segmento_maximo)
+    posicion = 1
+    distancia_acumulada = distancia_euclidiana_acumulada(coordenadas_segmento)
+    longitud_subsegmento = distancia_acumulada[-1] / (cantidad_divisiones + 1)
+    lista_total = []
+    lista_base = [coordenadas_segmento[0]]
+    for i in range(1, len(distancia_acumulada)):
+        punto_cortado = coordenadas_segmento[i]
+        while distancia_acumulada[i] > (longitud_subsegmento * posicion):
+            longitud_faltante = (longitud_subsegmento * posicion) - distancia_acumulada[i - 1]
+            punto_cortado = punto_en_recta_geografica_simple(
+                coordenadas_segmento[i - 1][1],
+                coordenadas_segmento[i - 1][0],
+                coordenadas_segmento[i][1],
+                coordenadas_segmento[i][0],
+                longitud_faltante,
+                distancia_acumulada[i] - distancia_acumulada[i - 1]
+            )
+            lista_base.append(punto_cortado)
+            lista_total.append(lista_base)
+            lista_base = [punto_cortado]
+            punto_cortado = coordenadas_segmento[i]
+            posicion += 1
+        lista_base.append(punto_cortado)
+    lista_total.append(lista_base)
+    return lista_total, longitud_subsegmento
+
+def ubicar_subsegmento(lista_subsegmentos, L, longitud, latitud):
+    """
+    Retorna la posición del primer subsegmento cuyo polígono de ancho L contiene el punto,
+    o None si ninguno lo contiene.
+    """
+    for i in range(len(lista_subsegmentos)):
+        poligono = generar_poligono_segmento_lonlat(lista_subsegmentos[i], L)
+        if punto_en_poligono(poligono, longitud, latitud):
+            return i
+    return None
+
 def hash_segmento(u: int, v: int, key: int) -> int:
     """
     Hash de segmento que es insensible al orden de u y v (para vías bidireccionales).
@@ -802,6 +792,24 @@ def hash_segmento(u: int, v: int, key: int) -> int:
     h = (u_ * 2654435761) ^ (v_ * 40503) ^ (key * 97)
     return h % (2**64)
 
+def hash_segmentos(u, v, key):
+    """
+    Versión vectorizada de hash_segmento (arreglos de nodos no negativos).
+    La aritmética uint64 con desbordamiento equivale a tomar el resultado % 2**64.
+
+    Returns:
+        np.ndarray uint64
+    """
+    u = np.asarray(u, dtype=np.uint64)
+    v = np.asarray(v, dtype=np.uint64)
+    key = np.asarray(key, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        return (
+            (np.minimum(u, v) * np.uint64(2654435761))
+            ^ (np.maximum(u, v) * np.uint64(40503))
+            ^ (key * np.uint64(97))
+        )
+
 def timestamp_a_iso8601(timestamp):
     """
     Convierte un timestamp en milisegundos a una cadena con formato ISO 8601.
@@ -0,0 +1,247 @@
+"""
+Almacén columnar (Parquet) de las grabaciones de sensores ya procesadas.
+
+Los CSV procesados quedaban como texto en uploads/csv/processed y cualquier
+reprocesamiento los volvía a interpretar completos. Aquí cada CSV se convierte
+una sola vez a Parquet:
+- Columnas tipadas (timestamp int64, GPS float64, IMU float32) comprimidas con zstd
+- Grupos de filas de tamaño fijo (RECWAY_FILAS_GRUPO_PARQUET, defecto 100000);
+  Parquet guarda por grupo y columna el mínimo y el máximo, es decir el rango de
+  tiempo (timestamp) y la caja (gps_lat, gps_lng) de cada grupo
+- Los metadatos '#' del CSV se guardan en los metadatos del esquema
+
+La lectura usa memory map y solo las columnas pedidas; los filtros por tiempo
+o por caja descartan grupos completos con esas estadísticas sin leerlos.
+
+pyarrow es opcional: sin él DISPONIBLE es False, archivar_csv no hace nada y el
+resto del pipeline sigue trabajando con los CSV.
+
+Uso desde línea de comandos (convierte los CSV procesados que aún no tienen Parquet):
+    python almacen_columnar.py
+"""
+import os
+import json
+
+import numpy as np
+
+import lectura_csv as lc
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+DISPONIBLE = pa is not None
+EXTENSION = '.parquet'
+FILAS_GRUPO = int(os.getenv('RECWAY_FILAS_GRUPO_PARQUET', '100000'))
+COMPRESION = os.getenv('RECWAY_COMPRESION_PARQUET', 'zstd')
+CLAVE_METADATOS = b'recway'
+
+
+def _verificar_disponible():
+    if not DISPONIBLE:
+        raise RuntimeError('pyarrow no está instalado; el almacén columnar no está disponible')
+
+
+def es_archivo_columnar(nombre_archivo):
+    return nombre_archivo.endswith(EXTENSION)
+
+
+def nombre_columnar(nombre_csv):
+    """RecWay_x.csv -> RecWay_x.parquet"""
+    return os.path.splitext(nombre_csv)[0] + EXTENSION
+
+
+def _esquema(bloque, metadatos, nombre_csv):
+    campos = []
+    for columna, tipo in bloque.dtypes.items():
+        if columna in lc.TIPOS_COLUMNAS:
+            tipo_arrow = pa.from_numpy_dtype(lc.TIPOS_COLUMNAS[columna])
+        elif np.issubdtype(tipo, np.number):
+            # Columnas desconocidas: float64 para que un bloque posterior con NaN no cambie el tipo
+            tipo_arrow = pa.float64()
+        else:
+            tipo_arrow = pa.string()
+        campos.append(pa.field(columna, tipo_arrow))
+    info = {'metadatos': metadatos, 'archivo_origen': nombre_csv}
+    return pa.schema(campos, metadata={CLAVE_METADATOS: json.dumps(info, ensure_ascii=False).encode('utf-8')})
+
+
+def convertir_csv(ruta_csv, ruta_parquet, filas_grupo=None):
+    """
+    Convierte un CSV de RecWay a Parquet leyendo por bloques (memoria acotada).
+    El archivo se escribe con un nombre temporal y se renombra al terminar.
+
+    Returns:
+        int: filas escritas.
+    """
+    _verificar_disponible()
+    filas_grupo = filas_grupo or FILAS_GRUPO
+    ruta_temporal = ruta_parquet + '.tmp'
+    escritor = None
+    try:
+        with lc.LectorCSV(ruta_csv, columnas=None, tamano_bloque=filas_grupo) as lector:
+            for bloque in lector:
+                if escritor is None:
+                    esquema = _esquema(bloque, lector.metadatos, os.path.basename(ruta_csv))
+                    escritor = pq.ParquetWriter(ruta_temporal, esquema, compression=COMPRESION)
+                tabla = pa.Table.from_pandas(bloque, schema=esquema, preserve_index=False)
+                escritor.write_table(tabla, row_group_size=filas_grupo)
+            filas = lector.filas_leidas
+        if escritor is None:
+            raise ValueError(f'El archivo {os.path.basename(ruta_csv)} no tiene filas de datos')
+        escritor.close()
+        escritor = None
+        os.replace(ruta_temporal, ruta_parquet)
+        return filas
+    finally:
+        if escritor is not None:
+            escritor.close()
+        if os.path.exists(ruta_temporal):
+            os.remove(ruta_temporal)
+
+
+def archivar_csv(carpeta_csv, nombre_csv, carpeta_columnar):
+    """
+    Convierte un CSV procesado al almacén columnar (si pyarrow está disponible).
+
+    Con RECWAY_CONSERVAR_CSV=0 el CSV se elimina después de la conversión.
+
+    Returns:
+        str: ruta del Parquet, o None si no se convirtió.
+    """
+    if not DISPONIBLE:
+        return None
+    ruta_csv = os.path.join(carpeta_csv, nombre_csv)
+    ruta_parquet = os.path.join(carpeta_columnar, nombre_columnar(nombre_csv))
+    try:
+        os.makedirs(carpeta_columnar, exist_ok=True)
+        filas = convertir_csv(ruta_csv, ruta_parquet)
+    except Exception as e:
+        print(f'[almacen_columnar][ERROR] {nombre_csv}: {e}')
+        return None
+    print(f'[almacen_columnar] {nombre_csv} -> {ruta_parquet} ({filas} filas)')
+    if os.getenv('RECWAY_CONSERVAR_CSV', '1') == '0':
+        os.remove(ruta_csv)
+    return ruta_parquet
+
+
+def leer_metadatos(ruta_parquet):
+    """Metadatos '#' del CSV de origen."""
+    _verificar_disponible()
+    esquema = pq.read_schema(ruta_parquet, memory_map=True)
+    info = json.loads((esquema.metadata or {}).get(CLAVE_METADATOS, b'{}'))
+    return info.get('metadatos', {})
+
+
+def _filtros(desde=None, hasta=None, caja=None):
+    filtros = []
+    if desde is not None:
+        filtros.append(('timestamp', '>=', int(desde)))
+    if hasta is not None:
+        filtros.append(('timestamp', '<=', int(hasta)))
+    if caja is not None:
+        lat_min, lng_min, lat_max, lng_max = caja
+        filtros.extend([
+            ('gps_lat', '>=', lat_min), ('gps_lat', '<=', lat_max),
+            ('gps_lng', '>=', lng_min), ('gps_lng', '<=', lng_max),
+        ])
+    return filtros or None
+
+
+def leer_columnas(ruta_parquet, columnas=None, desde=None, hasta=None, caja=None):
+    """
+    Lee columnas de una grabación (memory map), opcionalmente filtradas.
+
+    Args:
+        columnas (list): Columnas a leer (None = todas).
+        desde, hasta (int): Rango de timestamp en ms (inclusive).
+        caja (tuple): (lat_min, lng_min, lat_max, lng_max).
+
+    Returns:
+        pyarrow.Table (usar .to_pandas() o .column(nombre).to_numpy()).
+    """
+    _verificar_disponible()
+    return pq.read_table(
+        ruta_parquet, columns=columnas, filters=_filtros(desde, hasta, caja), memory_map=True
+    )
+
+
+def resumen_grupos(ruta_parquet):
+    """
+    Rango de tiempo y caja de cada grupo de filas, a partir de las estadísticas del archivo.
+
+    Returns:
+        list: dicts con 'filas', 'timestamp' (min, max), 'gps_lat' (min, max) y 'gps_lng' (min, max).
+    """
+    _verificar_disponible()
+    metadata = pq.ParquetFile(ruta_parquet, memory_map=True).metadata
+    nombres = metadata.schema.names
+    resumen = []
+    for i in range(metadata.num_row_groups):
+        grupo = metadata.row_group(i)
+        registro = {'filas': grupo.num_rows}
+        for columna in ('timestamp', 'gps_lat', 'gps_lng'):
+            if columna not in nombres:
+                continue
+            estadisticas = grupo.column(nombres.index(columna)).statistics
+            if estadisticas is not None and estadisticas.has_min_max:
+                registro[columna] = (estadisticas.min, estadisticas.max)
+        resumen.append(registro)
+    return resumen
+
+
+def rango_timestamp(ruta_parquet):
+    """(mínimo, máximo) timestamp de la grabación, de las estadísticas de los grupos."""
+    rangos = [grupo['timestamp'] for grupo in resumen_grupos(ruta_parquet) if 'timestamp' in grupo]
+    return min(r[0] for r in rangos), max(r[1] for r in rangos)
+
+
+def cargar_trayectoria_gps(carpeta, nombre_parquet, tamano_bloque=None):
+    """
+    Equivalente a lectura_csv.cargar_trayectoria_gps leyendo del almacén columnar
+    (solo las columnas GPS, por lotes).
+
+    Returns:
+        (df_gps, metadatos)
+    """
+    df_gps, _, metadatos = cargar_trayectoria_y_senales(carpeta, nombre_parquet, (), tamano_bloque)
+    return df_gps, metadatos
+
+
+def cargar_trayectoria_y_senales(carpeta, nombre_parquet, columnas_senales=lc.COLUMNAS_SENALES, tamano_bloque=None):
+    """
+    Equivalente a lectura_csv.cargar_trayectoria_y_senales leyendo del almacén columnar.
+
+    Returns:
+        (df_gps, senales, metadatos)
+    """
+    _verificar_disponible()
+    ruta = os.path.join(carpeta, nombre_parquet)
+    if not os.path.isfile(ruta):
+        raise FileNotFoundError(f"No se encontró el archivo: {ruta}")
+    archivo = pq.ParquetFile(ruta, memory_map=True)
+    columnas_senales = [c for c in columnas_senales if c in archivo.schema_arrow.names]
+
+    def bloques():
+        inicio = 0
+        columnas = list(lc.COLUMNAS_GPS) + columnas_senales
+        for lote in archivo.iter_batches(batch_size=tamano_bloque or lc.TAMANO_BLOQUE, columns=columnas):
+            bloque = lote.to_pandas()
+            bloque.index = bloque.index + inicio
+            inicio += len(bloque)
+            yield bloque
+
+    partes, senales = lc.separar_bloques(bloques(), columnas_senales)
+    return lc.construir_trayectoria(partes, archivo.metadata.num_rows), senales, leer_metadatos(ruta)
+
+
+if __name__ == '__main__':
+    import main_procesamiento as mp
+    _verificar_disponible()
+    for nombre in sorted(os.listdir(mp.carpeta_almacenamiento_csv)):
+        if nombre.endswith('.csv') and not os.path.exists(
+                os.path.join(mp.carpeta_almacenamiento_columnar, nombre_columnar(nombre))):
+            archivar_csv(mp.carpeta_almacenamiento_csv, nombre, mp.carpeta_almacenamiento_columnar)
@@ -0,0 +1,184 @@
+"""
+Cache en memoria de los grafos (teselas) de OSM usados en el procesamiento.
+Los grafos se guardan como teselas_grafo.TeselaGrafo.
+
+Cada archivo CSV crea su propio DatosProcesamiento, por lo que sin este cache
+cada subida volvía a leer las mismas teselas GraphML de grafos_archivos5.
+Características:
+- Un único cache por proceso, compartido por todos los archivos e hilos
+- Llave: (carpeta de grafos, número de grafo) (ver algoritmos_posicinamiento.determinar_grafo);
+  la ruta de cada tesela se resuelve con manifiesto_grafos. La carpeta es parte de la
+  llave porque el emparejamiento y las sesiones de streaming aceptan otras carpetas
+- Presupuesto configurable por cantidad de grafos y por bytes. Los bytes de cada
+  tesela se vuelven a medir en cada acceso (TeselaGrafo.nbytes crece cuando se
+  construye su G bajo demanda, después de entrar al cache)
+- Desalojo LRU (el grafo usado hace más tiempo sale primero)
+- Contadores de aciertos, fallos, desalojos y tiempo total de carga
+- Una sola carga por grafo aunque varios hilos lo pidan a la vez
+
+Configuración por variables de entorno:
+- RECWAY_CACHE_GRAFOS_MAX: cantidad máxima de grafos en memoria (defecto 16)
+- RECWAY_CACHE_GRAFOS_MAX_MB: presupuesto aproximado en MB (defecto 2048)
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import manifiesto_grafos as mg
+import teselas_grafo as tg
+
+
+class CacheGrafos:
+    """Cache LRU de grafos indexado por una llave (en obtener_tesela, (carpeta, número de grafo))."""
+
+    def __init__(self, max_grafos=16, max_bytes=2048 * 1024 * 1024):
+        self.max_grafos = max_grafos
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()  # llave -> (grafo, bytes)
+        self._cargando = {}  # llave -> threading.Event de la carga en curso
+        self._lock = threading.Lock()
+        self._bytes_actuales = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.tiempo_carga_total = 0.0
+
+    def obtener(self, llave, cargador):
+        """
+        Retorna el grafo asociado a la llave, cargándolo si no está en memoria.
+
+        Args:
+            llave: Llave del grafo (hashable).
+            cargador (callable): Función sin argumentos que retorna (grafo, bytes_estimados).
+
+        Returns:
+            El grafo almacenado en el cache.
+        """
+        while True:
+            with self._lock:
+                entrada = self._entradas.get(llave)
+                if entrada is not None:
+                    self._entradas.move_to_end(llave)
+                    self.aciertos += 1
+                    self._desalojar()
+                    return entrada[0]
+                evento = self._cargando.get(llave)
+                if evento is None:
+                    # Este hilo se encarga de la carga
+                    evento = threading.Event()
+                    self._cargando[llave] = evento
+                    self.fallos += 1
+                    break
+            # Otro hilo está cargando el mismo grafo: esperar y reintentar
+            evento.wait()
+
+        inicio = time.perf_counter()
+        try:
+            grafo, bytes_estimados = cargador()
+        finally:
+            duracion = time.perf_counter() - inicio
+            with self._lock:
+                self.tiempo_carga_total += duracion
+                self._cargando.pop(llave, None)
+            evento.set()
+
+        with self._lock:
+            self._entradas[llave] = (grafo, bytes_estimados)
+            self._bytes_actuales += bytes_estimados
+            self._desalojar()
+        return grafo
+
+    def _medir(self):
+        # Los objetos con 'nbytes' (teselas) informan su tamaño actual; el resto conserva el estimado de carga
+        total = 0
+        for llave, (grafo, bytes_estimados) in list(self._entradas.items()):
+            bytes_estimados = getattr(grafo, 'nbytes', bytes_estimados)
+            self._entradas[llave] = (grafo, bytes_estimados)
+            total += bytes_estimados
+        self._bytes_actuales = total
+
+    def _desalojar(self):
+        self._medir()
+        # Siempre se conserva al menos el grafo más reciente aunque supere el presupuesto
+        while len(self._entradas) > 1 and (
+            len(self._entradas) > self.max_grafos or self._bytes_actuales > self.max_bytes
+        ):
+            _, (_, bytes_estimados) = self._entradas.popitem(last=False)
+            self._bytes_actuales -= bytes_estimados
+            self.desalojos += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes_actuales = 0
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            self._medir()
+            total = self.aciertos + self.fallos
+            return {
+                'grafos_en_memoria': list(self._entradas.keys()),
+                'cantidad': len(self._entradas),
+                'bytes_estimados': self._bytes_actuales,
+                'max_grafos': self.max_grafos,
+                'max_bytes': self.max_bytes,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'desalojos': self.desalojos,
+                'tasa_aciertos': (self.aciertos / total) if total else None,
+                'tiempo_carga_total': self.tiempo_carga_total
+            }
+
+
+def ruta_grafo(carpeta_grafos, numero_grafo):
+    """
+    Retorna la ruta del archivo GraphML de un número de grafo.
+
+    Raises:
+        FileNotFoundError: Si no existe un archivo 'segN<numero>pos...' en la carpeta.
+    """
+    entrada = mg.obtener_manifiesto(carpeta_grafos).obtener(numero_grafo)
+    if entrada is None:
+        raise FileNotFoundError(f"No existe grafo para el número {numero_grafo} en {carpeta_grafos}")
+    return entrada.ruta
+
+
+def _cargar_tesela(ruta):
+    # Usa la tesela compilada (.tesela) si existe; si no, el GraphML original
+    tesela = tg.cargar_tesela(ruta)
+    return tesela, tesela.nbytes
+
+
+cache_grafos = CacheGrafos(
+    max_grafos=int(os.getenv('RECWAY_CACHE_GRAFOS_MAX', '16')),
+    max_bytes=int(float(os.getenv('RECWAY_CACHE_GRAFOS_MAX_MB', '2048')) * 1024 * 1024)
+)
+
+
+def obtener_tesela(carpeta_grafos, numero_grafo):
+    """
+    Retorna la tesela (teselas_grafo.TeselaGrafo) del número indicado usando el cache global del proceso.
+
+    Args:
+        carpeta_grafos (str): Carpeta donde están los archivos GraphML.
+        numero_grafo (int): Número de grafo (ver ap.determinar_grafo).
+    """
+    return cache_grafos.obtener(
+        (os.path.abspath(carpeta_grafos), numero_grafo),
+        lambda: _cargar_tesela(ruta_grafo(carpeta_grafos, numero_grafo))
+    )
+
+
+def obtener_grafo(carpeta_grafos, numero_grafo):
+    """
+    Retorna el grafo de OSM del número indicado usando el cache global del proceso.
+
+    Returns:
+        networkx.MultiDiGraph: Grafo cargado.
+    """
+    return obtener_tesela(carpeta_grafos, numero_grafo).G
+
+
+def estadisticas_cache():
+    return cache_grafos.estadisticas()
@@ -0,0 +1,245 @@
+"""
+Cola persistente de trabajos de procesamiento en PostgreSQL.
+
+Los endpoints y el file watcher lanzaban el procesamiento con BackgroundTasks o
+hilos dentro del proceso web: sin límite de concurrencia, compitiendo con las
+peticiones y perdiéndose si el proceso se reiniciaba. Aquí cada archivo es una
+fila de trabajos_procesamiento (migración 005) y los procesos de
+trabajador_cola.py los toman:
+- Un trabajador toma el siguiente trabajo con SELECT ... FOR UPDATE SKIP LOCKED
+  (por prioridad y antigüedad); varios trabajadores no se bloquean entre sí
+- Un archivo tiene a lo sumo un trabajo activo (índice único parcial), así que
+  el file watcher y el upload pueden encolar el mismo archivo sin duplicarlo
+  (INSERT ... ON CONFLICT DO UPDATE siempre retorna la fila, también si ambos
+  encolan a la vez)
+- Si el trabajo falla se reintenta con espera exponencial (REINTENTO_BASE * 2^(intento-1) s)
+  hasta max_intentos; después queda 'fallido'
+- Mientras procesa, el trabajador actualiza progreso y etapa (latido). Un trabajo
+  'en_proceso' sin latido por más de LATIDO_MAXIMO segundos (trabajador caído)
+  vuelve a la cola en recuperar_abandonados
+- encolar envía NOTIFY para que los trabajadores no esperen al siguiente sondeo
+
+Configuración por variables de entorno:
+- RECWAY_COLA_TRABAJOS: '1' (defecto) usa la cola; '0' vuelve a BackgroundTasks
+- RECWAY_MAX_INTENTOS: intentos por trabajo (defecto 3)
+- RECWAY_REINTENTO_BASE: segundos de espera del primer reintento (defecto 30)
+- RECWAY_LATIDO_MAXIMO: segundos sin latido para considerar abandonado un trabajo (defecto 120)
+"""
+import os
+import socket
+
+import persistencia_bd as pb
+
+try:
+    import psycopg
+    from psycopg.rows import dict_row
+    from psycopg.types.json import Jsonb
+except ImportError:
+    psycopg = None
+
+DISPONIBLE = psycopg is not None
+CANAL = 'trabajos_procesamiento'
+ESTADOS = ('pendiente', 'en_proceso', 'completado', 'fallido')
+MAX_INTENTOS = int(os.getenv('RECWAY_MAX_INTENTOS', '3'))
+REINTENTO_BASE = float(os.getenv('RECWAY_REINTENTO_BASE', '30'))
+LATIDO_MAXIMO = float(os.getenv('RECWAY_LATIDO_MAXIMO', '120'))
+
+COLUMNAS = """
+    id_trabajo, archivo, estado, prioridad, intentos, max_intentos, progreso, etapa, trabajador,
+    resultado, error, creado_en, disponible_en, iniciado_en, actualizado_en, terminado_en,
+    EXTRACT(EPOCH FROM (COALESCE(iniciado_en, now()) - creado_en))::float8 AS segundos_en_cola,
+    EXTRACT(EPOCH FROM (COALESCE(terminado_en, now()) - iniciado_en))::float8 AS segundos_proceso
+"""
+
+# Si el archivo ya tiene un trabajo activo se devuelve ese (solo puede subirle la prioridad).
+# DO UPDATE y no DO NOTHING + SELECT: si otra transacción confirma el trabajo activo durante
+# la sentencia, el SELECT (con la instantánea de la sentencia) no lo vería y no habría fila
+SQL_ENCOLAR = f"""
+INSERT INTO trabajos_procesamiento (archivo, prioridad, max_intentos)
+VALUES (%(archivo)s, %(prioridad)s, %(max_intentos)s)
+ON CONFLICT (archivo) WHERE estado IN ('pendiente', 'en_proceso') DO UPDATE
+SET prioridad = GREATEST(trabajos_procesamiento.prioridad, EXCLUDED.prioridad)
+RETURNING {COLUMNAS}
+"""
+
+SQL_TOMAR = f"""
+UPDATE trabajos_procesamiento
+SET estado = 'en_proceso', intentos = intentos + 1, trabajador = %(trabajador)s, progreso = 0,
+    etapa = NULL, error = NULL, iniciado_en = now(), actualizado_en = now(), terminado_en = NULL
+WHERE id_trabajo = (
+    SELECT id_trabajo FROM trabajos_procesamiento
+    WHERE estado = 'pendiente' AND disponible_en <= now()
+    ORDER BY prioridad DESC, disponible_en, id_trabajo
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+)
+RETURNING {COLUMNAS}
+"""
+
+# Mismo cálculo de reintento para un error del trabajo y para un trabajo abandonado
+SQL_REINTENTO = """
+    estado = CASE WHEN intentos >= max_intentos THEN 'fallido' ELSE 'pendiente' END,
+    disponible_en = now() + make_interval(secs => %(reintento_base)s * power(2, intentos - 1)),
+    terminado_en = CASE WHEN intentos >= max_intentos THEN now() END,
+    actualizado_en = now()
+"""
+
+SQL_FALLAR = f"""
+UPDATE trabajos_procesamiento SET error = %(error)s, {SQL_REINTENTO}
+WHERE id_trabajo = %(id_trabajo)s AND estado = 'en_proceso'
+RETURNING estado, disponible_en
+"""
+
+SQL_RECUPERAR = f"""
+UPDATE trabajos_procesamiento
+SET error = 'Trabajador sin latido (' || coalesce(trabajador, '?') || ')', {SQL_REINTENTO}
+WHERE estado = 'en_proceso' AND actualizado_en < now() - make_interval(secs => %(latido_maximo)s)
+RETURNING id_trabajo
+"""
+
+
+def habilitada():
+    return DISPONIBLE and os.getenv('RECWAY_COLA_TRABAJOS', '1') == '1'
+
+
+def identificador_trabajador():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def conectar(autocommit=True):
+    if not DISPONIBLE:
+        raise RuntimeError('psycopg no está instalado; la cola de trabajos no está disponible')
+    return psycopg.connect(pb.uri_bd(), autocommit=autocommit, row_factory=dict_row)
+
+
+def _ejecutar(sql, parametros=None, conexion=None, todas=False):
+    propia = conexion is None
+    if propia:
+        conexion = conectar()
+    try:
+        cursor = conexion.execute(sql, parametros)
+        if cursor.description is None:
+            return None
+        return cursor.fetchall() if todas else cursor.fetchone()
+    finally:
+        if propia:
+            conexion.close()
+
+
+def encolar(archivo, prioridad=0, max_intentos=None, conexion=None):
+    """
+    Agrega un trabajo para el archivo (nombre dentro de la carpeta raw).
+
+    Returns:
+        dict: el trabajo nuevo o el trabajo activo que ya tenía el archivo (con la mayor de
+        las dos prioridades).
+    """
+    parametros = {'archivo': archivo, 'prioridad': prioridad, 'max_intentos': max_intentos or MAX_INTENTOS}
+    propia = conexion is None
+    if propia:
+        conexion = conectar()
+    try:
+        trabajo = _ejecutar(SQL_ENCOLAR, parametros, conexion)
+        conexion.execute(f'NOTIFY {CANAL}')
+        return trabajo
+    finally:
+        if propia:
+            conexion.close()
+
+
+def tomar(trabajador=None, conexion=None):
+    """Marca como 'en_proceso' el siguiente trabajo disponible y lo retorna (None si no hay)."""
+    return _ejecutar(SQL_TOMAR, {'trabajador': trabajador or identificador_trabajador()}, conexion)
+
+
+def segundos_hasta_siguiente(conexion=None):
+    """Segundos hasta que el próximo trabajo pendiente esté disponible (None si no hay pendientes)."""
+    fila = _ejecutar(
+        "SELECT EXTRACT(EPOCH FROM (min(disponible_en) - now()))::float8 AS segundos "
+        "FROM trabajos_procesamiento WHERE estado = 'pendiente'",
+        conexion=conexion
+    )
+    return None if fila['segundos'] is None else max(0.0, fila['segundos'])
+
+
+def actualizar_progreso(id_trabajo, progreso, etapa=None, conexion=None):
+    """Progreso (0 a 1) y etapa del trabajo; también sirve de latido."""
+    _ejecutar(
+        "UPDATE trabajos_procesamiento SET progreso = %s, etapa = COALESCE(%s, etapa), actualizado_en = now() "
+        "WHERE id_trabajo = %s AND estado = 'en_proceso'",
+        (progreso, etapa, id_trabajo), conexion
+    )
+
+
+def latido(id_trabajo, conexion=None):
+    _ejecutar(
+        "UPDATE trabajos_procesamiento SET actualizado_en = now() WHERE id_trabajo = %s AND estado = 'en_proceso'",
+        (id_trabajo,), conexion
+    )
+
+
+def completar(id_trabajo, resultado=None, conexion=None):
+    _ejecutar(
+        "UPDATE trabajos_procesamiento SET estado = 'completado', progreso = 1, etapa = 'completado', "
+        "resultado = %s, terminado_en = now(), actualizado_en = now() "
+        "WHERE id_trabajo = %s AND estado = 'en_proceso'",
+        (Jsonb(resultado) if resultado is not None else None, id_trabajo), conexion
+    )
+
+
+def fallar(id_trabajo, error, conexion=None):
+    """
+    Registra el error; el trabajo vuelve a 'pendiente' con espera exponencial o queda
+    'fallido' si agotó los intentos.
+
+    Returns:
+        dict: 'estado' y 'disponible_en' resultantes.
+    """
+    return _ejecutar(
+        SQL_FALLAR, {'id_trabajo': id_trabajo, 'error': str(error)[:2000], 'reintento_base': REINTENTO_BASE}, conexion
+    )
+
+
+def recuperar_abandonados(latido_maximo=None, conexion=None):
+    """Devuelve a la cola los trabajos 'en_proceso' sin latido reciente. Returns: cantidad."""
+    filas = _ejecutar(
+        SQL_RECUPERAR,
+        {'latido_maximo': latido_maximo or LATIDO_MAXIMO, 'reintento_base': REINTENTO_BASE},
+        conexion, todas=True
+    )
+    return len(filas)
+
+
+def reintentar(id_trabajo, conexion=None):
+    """Vuelve a encolar un trabajo 'fallido' con los intentos en cero."""
+    return _ejecutar(
+        f"UPDATE trabajos_procesamiento SET estado = 'pendiente', intentos = 0, disponible_en = now(), "
+        f"error = NULL, terminado_en = NULL, actualizado_en = now() "
+        f"WHERE id_trabajo = %s AND estado = 'fallido' RETURNING {COLUMNAS}",
+        (id_trabajo,), conexion
+    )
+
+
+def obtener(id_trabajo, conexion=None):
+    return _ejecutar(f"SELECT {COLUMNAS} FROM trabajos_procesamiento WHERE id_trabajo = %s", (id_trabajo,), conexion)
+
+
+def listar(estado=None, limite=100, conexion=None):
+    """Trabajos más recientes primero, opcionalmente filtrados por estado."""
+    if estado is not None and estado not in ESTADOS:
+        raise ValueError(f"Estado no válido: {estado} (opciones: {', '.join(ESTADOS)})")
+    return _ejecutar(
+        f"SELECT {COLUMNAS} FROM trabajos_procesamiento "
+        f"WHERE %(estado)s::text IS NULL OR estado = %(estado)s ORDER BY id_trabajo DESC LIMIT %(limite)s",
+        {'estado': estado, 'limite': limite}, conexion, todas=True
+    )
+
+
+def resumen(conexion=None):
+    """Cantidad de trabajos por estado."""
+    filas = _ejecutar(
+        "SELECT estado, count(*) AS cantidad FROM trabajos_procesamiento GROUP BY estado", conexion=conexion, todas=True
+    )
+    conteos = {estado: 0 for estado in ESTADOS}
+    conteos.update({fila['estado']: fila['cantidad'] for fila in filas})
+    return conteos
@@ -0,0 +1,53 @@
+"""
+Contexto de un viaje (trayectoria GPS de un archivo CSV) que recorre todas las etapas del pipeline.
+
+Antes la trayectoria se guardaba en la variable global df_gps de cada módulo de
+procesamiento, de modo que dos archivos procesados a la vez en hilos distintos
+(el file watcher lanza un hilo por archivo) leían la trayectoria del otro.
+Ahora cada archivo crea su propio ContextoViaje y lo pasa explícitamente.
+"""
+import numpy as np
+
+
+class ContextoViaje:
+    """
+    Arreglos de la trayectoria ya filtrada (en orden de procesamiento):
+    timestamp (ms), latitud, longitud, velocidad y heading (filtrado, [-180, 180)).
+
+    Opcionalmente las señales de sensores de todo el archivo (dict columna -> arreglo,
+    una muestra por fila) y, por cada fix, el rango de filas [muestra_inicial, muestra_final)
+    del archivo tomadas con ese fix.
+    """
+
+    def __init__(self, nombre_archivo, timestamp, latitud, longitud, velocidad, heading, metadatos=None,
+                 muestra_inicial=None, muestra_final=None, senales=None):
+        self.nombre_archivo = nombre_archivo
+        self.timestamp = np.asarray(timestamp, dtype=np.int64)
+        self.latitud = np.asarray(latitud, dtype=np.float64)
+        self.longitud = np.asarray(longitud, dtype=np.float64)
+        self.velocidad = np.asarray(velocidad, dtype=np.float64)
+        self.heading = np.asarray(heading, dtype=np.float64)
+        self.metadatos = metadatos or {}
+        self.muestra_inicial = None if muestra_inicial is None else np.asarray(muestra_inicial, dtype=np.int64)
+        self.muestra_final = None if muestra_final is None else np.asarray(muestra_final, dtype=np.int64)
+        self.senales = senales or {}
+
+    @classmethod
+    def desde_dataframe(cls, df_gps, nombre_archivo, metadatos=None, senales=None):
+        """Construye el contexto a partir del DataFrame resultante de los filtros GPS."""
+        rangos = 'index_original' in df_gps.columns and 'index_final' in df_gps.columns
+        return cls(
+            nombre_archivo,
+            df_gps['timestamp'].to_numpy(),
+            df_gps['gps_lat'].to_numpy(),
+            df_gps['gps_lng'].to_numpy(),
+            df_gps['gps_speed'].to_numpy(),
+            df_gps['gps_heading_filtrado'].to_numpy(),
+            metadatos,
+            df_gps['index_original'].to_numpy() if rangos else None,
+            df_gps['index_final'].to_numpy() if rangos else None,
+            senales
+        )
+
+    def __len__(self):
+        return len(self.timestamp)
@@ -2,11 +2,18 @@
 from filterpy.kalman import KalmanFilter
 import algoritmos_busqueda as ab
 import algoritmos_posicinamiento as ap
-import osmnx as ox
+import adyacencia_grafo as ag
+import almacen_columnar as ac
+import cache_grafos as cg
+import contexto_viaje as cv
+import indice_espacial as ie
+import lectura_csv as lc
+import pool_procesamiento as pp
+import procesamiento_senales as ps
+import serializacion as sr
 import pandas as pd
 import numpy as np
 import os
-import json
 #import algoritmos_senales as algs
 #from scipy.signal import filtfilt,firwin,lfilter,welch
 
@@ -17,13 +24,17 @@ carpeta_csv = str(base_path / "uploads" / "csv" / "raw") #carpeta donde se encue
 prefijo_busqueda = "RecWay_"#prefijo que todo archivo a procesar debe contener 
 carpeta_archivos_json = str(base_path / "uploads" / "json" / "output") #carpeta donde se generan los archivos json
 carpeta_almacenamiento_csv = str(base_path / "uploads" / "csv" / "processed") #carpeta donde se almacenan los csv
+carpeta_almacenamiento_columnar = str(base_path / "uploads" / "csv" / "columnar") #copia Parquet de los csv procesados
 carpeta_almacenamiento_json = str(base_path / "uploads" / "json" / "storage") #carpeta donde se almacenan los json
 
 #clase con los datos de procesamiento 
 class DatosProcesamiento:
-    def __init__(self):
-        # Variables globales o de contexto
+    def __init__(self, viaje=None):
+        # Variables de contexto del archivo en proceso
+        self.viaje = viaje  # contexto_viaje.ContextoViaje con la trayectoria
         self.G = None
+        self.indice_espacial = None
+        self.adyacencia = None
         self.latitud = None
         self.longitud = None
         self.numero_grafo = None
@@ -49,10 +60,18 @@ class DatosProcesamiento:
 #se extraen los puntos GPS del mapa
 def adquirir_latitud_longitud(datos,index_GPS):
     
-    datos.latitud = df_gps['gps_lat'].iloc[index_GPS]
-    datos.longitud = df_gps['gps_lng'].iloc[index_GPS]
-    datos.velocidad = df_gps['gps_speed'].iloc[index_GPS]
-    datos.heading = df_gps['gps_heading_filtrado'].iloc[index_GPS]
+    viaje = datos.viaje
+    datos.latitud = viaje.latitud[index_GPS]
+    datos.longitud = viaje.longitud[index_GPS]
+    datos.velocidad = viaje.velocidad[index_GPS]
+    datos.heading = viaje.heading[index_GPS]
+
+#carga el grafo del cache junto con el índice espacial de sus corredores
+def cargar_grafo(datos, numero_grafo):
+    tesela = cg.obtener_tesela(datos.carpeta_grafos, numero_grafo)
+    datos.G = tesela.G
+    datos.indice_espacial = ie.indice_espacial(tesela, datos.L)
+    datos.adyacencia = ag.adyacencia_grafo(tesela)
 
 #1. se va a extraer el grafo donde se encuentra el punto, en caso de ya tenerlo no hacer nada
 def procesamiento_mapa(datos):
@@ -65,27 +84,22 @@ def procesamiento_mapa(datos):
             datos.numero_grafo = ap.determinar_grafo(datos.latitud, datos.longitud)# se extrae el numero de grafo de la latitud y longitud
             if ap.confirmar_grafo(datos.latitud, datos.longitud, datos.numero_grafo,datos.carpeta_grafos):                
                 
-                #extraer el nombre de grafo del nombre
-                grafo_nombre = ap.buscar_archivos_por_prefijo(datos.carpeta_grafos, 'segN' + str(datos.numero_grafo) + 'pos')
-                #extraer el grafo del archivo 
-                datos.G = ox.load_graphml(filepath=str(grafo_nombre)[2:-2])
+                #extraer el grafo del cache (se carga del archivo solo la primera vez)
+                cargar_grafo(datos, datos.numero_grafo)
     else:
         datos.numero_grafo = ap.determinar_grafo(datos.latitud, datos.longitud)# se extrae el numero de grafo de la latitud y longitud
         if ap.confirmar_grafo(datos.latitud, datos.longitud, datos.numero_grafo,datos.carpeta_grafos):#se comprueba si el grafo existe y tiene datos
     
-            #extraer el nombre de grafo del nombre
-            grafo_nombre = ap.buscar_archivos_por_prefijo(datos.carpeta_grafos, 'segN' + str(datos.numero_grafo) + 'pos')
-            #extraer el grafo del archivo 
-            datos.G = ox.load_graphml(filepath=str(grafo_nombre)[2:-2])
+            #extraer el grafo del cache (se carga del archivo solo la primera vez)
+            cargar_grafo(datos, datos.numero_grafo)
             datos.G_exist = True
 
 def procesamiento_mapa_simple(datos):
     num_grafo = ap.determinar_grafo(datos.latitud, datos.longitud)
     if datos.numero_grafo != num_grafo:
 
-        grafo_nombre = ap.buscar_archivos_por_prefijo(datos.carpeta_grafos, 'segN' + str(num_grafo) + 'pos')
         datos.numero_grafo = num_grafo
-        datos.G = ox.load_graphml(filepath=str(grafo_nombre)[2:-2])
+        cargar_grafo(datos, num_grafo)
         datos.G_exist = True
 
 
@@ -93,7 +107,8 @@ def ubicar_muestra_grafo(datos):
     datos.segmento_encontrado = False
     try:
         if not datos.primera_muestra:
-            datos.id_edge = ox.nearest_edges(datos.G, X=datos.longitud, Y=datos.latitud)
+            posicion = datos.indice_espacial.arista_mas_cercana(datos.longitud, datos.latitud)
+            datos.id_edge = tuple(datos.indice_espacial.tesela.aristas[posicion].tolist())
             datos.info_edge = datos.G.edges[datos.id_edge]
             datos.coordenadas_segmento = ap.obtener_coordenadas_segmento(datos.G,datos.id_edge,datos.info_edge)
             datos.primera_muestra = True
@@ -101,12 +116,12 @@ def ubicar_muestra_grafo(datos):
             datos.cambio_segmento = True
         else:
             datos.coordenadas_segmento = ap.obtener_coordenadas_segmento(datos.G,datos.id_edge,datos.info_edge)
-            poligono = ap.generar_poligono_segmento_lonlat(datos.coordenadas_segmento,datos.L)
-            point_in_edge = ap.punto_en_poligono(poligono,datos.longitud,datos.latitud)
+            indice = datos.indice_espacial
+            point_in_edge = indice.contiene(indice.posicion(datos.id_edge),datos.longitud,datos.latitud)
             if not point_in_edge:
                 datos.cambio_segmento = True
                 try:
-                    segmentos_anexos = ap.caminos_hasta_distanciav2(datos.G,datos.id_edge[0],datos.id_edge[1],50)
+                    segmentos_anexos = datos.adyacencia.caminos(datos.id_edge[0],datos.id_edge[1],50)
                 except Exception as e:
                     print('[UBICAR] Error obteniendo segmentos anexos:', e)
                     return
@@ -135,8 +150,7 @@ def ubicar_muestra_grafo(datos):
                     except Exception:
                         distancia_segmento = 999999
                     try:
-                        poligono_prueba = ap.generar_poligono_segmento_lonlat(segmento_prueba,datos.L)
-                        point_in_edge_prueba = ap.punto_en_poligono(poligono_prueba,datos.longitud,datos.latitud)
+                        point_in_edge_prueba = indice.contiene(indice.posicion(segmentos_anexos[i]),datos.longitud,datos.latitud)
                     except Exception:
                         point_in_edge_prueba = False
                     peso_area = 1 if point_in_edge_prueba else 0
@@ -231,19 +245,15 @@ def segmentar_grafo(datos):
         datos.longitud_subsegmento = datos.info_edge['length']
         datos.posicion_subsegmento = 0
 
-def procesar_archivo_csv(nombre_archivo):
+def procesar_archivo_csv(nombre_archivo, propagar_errores=True):
+    # propagar_errores: misma firma que main_procesamiento.procesar_archivo_especifico para
+    # pool_procesamiento; aquí los errores siempre se propagan
     print(f"[PROC] procesar_archivo_csv -> {nombre_archivo}")
     """Función principal para procesar un archivo CSV individual"""
     
-    # Variables globales
-    global carpeta_csv, prefijo_busqueda, carpeta_archivos_json, carpeta_almacenamiento_csv, carpeta_almacenamiento_json
-    global df_gps
-    
-    contador_json = 1 
     #se extrae la metadata del dispositivo y su dataframe de los datos
-    df,metadatos =  ap.cargar_csv_con_metadatos(carpeta_csv,nombre_archivo)
-    print(f"[PROC] Filas DF original: {len(df)}")
-    df_gps = ap.eliminar_muestras_gps_duplicadas(df)
+    df_gps,senales,metadatos = lc.cargar_trayectoria_y_senales(carpeta_csv,nombre_archivo)
+    print(f"[PROC] Filas DF original: {df_gps.attrs['filas_leidas']}")
     print(f"[PROC] Filas tras eliminar duplicadas: {len(df_gps)}")
     df_gps = ap.ajustar_heading_y_filtrar(df_gps)
     print(f"[PROC] Filas tras ajustar heading: {len(df_gps)}")
@@ -254,25 +264,16 @@ def procesar_archivo_csv(nombre_archivo):
     posicion_recorte_velocidad = 0
     indice_segmento_previo = 0
     indice_anterior = 0
-    #se crea la estructura base para manejar el grafo
-    datos_mapa = DatosProcesamiento()
+    #se crea la estructura base para manejar el grafo (con la trayectoria propia de este archivo)
+    viaje = cv.ContextoViaje.desde_dataframe(df_gps, nombre_archivo, metadatos, senales)
+    datos_mapa = DatosProcesamiento(viaje)
     lista_recortes = []
 
-    # Coeficientes del numerador (b) y denominador (a)
-    #senal_pura_ax = df['acc_x'].to_numpy()
-    #senal_pura_wy = df['gyro_y'].to_numpy()
-    #senal_pura_az  = df['acc_z'].to_numpy()
-    #senal_pura_wx = df['gyro_x'].to_numpy()
-
-    #senal_wx = lfilter(filtro_6hz,1.0,senal_pura_wx)
-    #senal_ax = lfilter(filtro_10hz,1.0,senal_pura_ax)
-    #senal_ax = lfilter(filtro_pasaltos_1hz,1.0,senal_ax)
-    #senal_az = lfilter(filtro_3hz,1.0,senal_pura_az)
-
-    #df.to_csv('archivov2.csv', index=False)
+    # Los filtros de las señales (6 Hz wx, 10 Hz + pasa altos 1 Hz ax, 3 Hz az) se aplican
+    # al viaje completo en procesamiento_senales, después de segmentar
 
 
-    for i in range(len(df_gps)):
+    for i in range(len(viaje)):
         
         adquirir_latitud_longitud(datos_mapa,i)
         
@@ -298,8 +299,8 @@ def procesar_archivo_csv(nombre_archivo):
                 "longitud_via": datos_mapa.longitud_subsegmento,
                 "tipo_via": datos_mapa.info_edge.get('highway', 'unknown'),
                 "indice_inicial": i,
-                "indice_final": len(df_gps) - 1,  # Se actualizará después
-                "tiempo": ap.timestamp_a_iso8601(df_gps['timestamp'].iloc[i])
+                "indice_final": len(viaje) - 1,  # Se actualizará después
+                "tiempo": ap.timestamp_a_iso8601(int(viaje.timestamp[i]))
             }
             lista_recortes.append(nuevo_segmento)
             datos_mapa.cambio_segmento = False
@@ -312,6 +313,7 @@ def procesar_archivo_csv(nombre_archivo):
 
     #---------------------------------------------------------------------------#
     #-----------------AQUI SE PONE EL PROCESAMIENTO DE LOS ALGORITMOS-----------#
+    metricas = ps.metricas_segmentos(viaje, [recorte["indice_inicial"] for recorte in lista_recortes])
 
 
     #importante como esta es una versión prototipo para el sistema se tiene que tomar en cuenta que el recorte de velocidad
@@ -327,23 +329,7 @@ def procesar_archivo_csv(nombre_archivo):
             }
             lista_geometria.append(punto_geometria)
 
-        lista_huecos = []
-        hueco1 = {
-            "latitud":lista_geometria[0]["latitud"],
-            "longitud":lista_geometria[0]["longitud"],
-            "magnitud" : float(np.random.randint(0, 5000)/1000),
-            "velocidad" : float(np.random.randint(0, 5000)/1000),
-        }
-
-        hueco2 = {
-            "latitud":lista_geometria[-1]["latitud"],
-            "longitud":lista_geometria[-1]["longitud"],
-            "magnitud" : float(np.random.randint(0, 5000)/1000),
-            "velocidad" : float(np.random.randint(0, 5000)/1000),
-        }
-
-        lista_huecos.append(hueco1)
-        lista_huecos.append(hueco2)
+        valores_metricas = metricas.valores(i)
 
         datos_obtenidos = {
             "numero" : i,
@@ -357,13 +343,13 @@ def procesar_archivo_csv(nombre_archivo):
             "longitud_destino" : lista_geometria[-1]["longitud"],
             "geometria" : lista_geometria,
             "fecha" : lista_recortes[i]["tiempo"],
-            "IQR" : float(np.random.randint(0, 5000)/1000),
-            "iri" : float(np.random.randint(0, 20000)/1000),
-            "IRI_modificado" : float(np.random.randint(0, 5000)/1000),
-            "az" : float(np.random.randint(0, 5000)/1000),
-            "ax" : float(np.random.randint(0, 5000)/1000),
-            "wx" : float(np.random.randint(0, 5000)/1000),
-            "huecos" : lista_huecos
+            "IQR" : valores_metricas["IQR"],
+            "iri" : valores_metricas["iri"],
+            "IRI_modificado" : valores_metricas["IRI_modificado"],
+            "az" : valores_metricas["az"],
+            "ax" : valores_metricas["ax"],
+            "wx" : valores_metricas["wx"],
+            "huecos" : metricas.huecos(i)
         }
 
         resultado_json.append(datos_obtenidos)
@@ -371,37 +357,14 @@ def procesar_archivo_csv(nombre_archivo):
     if(len (resultado_json) > 0):
         print("guardando los datos")
         # Usar carpeta actual si está vacía
-        if carpeta_archivos_json == "":
-            carpeta = os.getcwd()
-        else:
-            carpeta = carpeta_archivos_json
-
-        # Crear carpeta si no existe
-        os.makedirs(carpeta, exist_ok=True)
+        carpeta_salida = carpeta_archivos_json if carpeta_archivos_json != "" else os.getcwd()
+        carpeta_almacenamiento = carpeta_almacenamiento_json if carpeta_almacenamiento_json != "" else os.getcwd()
 
-        # Construir ruta del archivo
-        ruta_archivo = os.path.join(carpeta, 'datos' + str(contador_json) + '.json')
-
-        # Guardar el archivo
-        with open(ruta_archivo, 'w', encoding='utf-8') as archivo:
-            json.dump(resultado_json, archivo, ensure_ascii=False, indent=2)
-
-        # Usar carpeta actual si está vacía
-        if carpeta_almacenamiento_json == "":
-            carpeta = os.getcwd()
-        else:
-            carpeta = carpeta_almacenamiento_json
-
-        # Crear carpeta si no existe
-        os.makedirs(carpeta, exist_ok=True)
-
-        # Construir ruta del archivo
-        ruta_archivo = os.path.join(carpeta, 'datos' + nombre_archivo[:-4] + 'save.json')
-        with open(ruta_archivo, 'w', encoding='utf-8') as archivo:
-            json.dump(resultado_json, archivo, ensure_ascii=False, indent=2)
-        contador_json +=1
+        # Guardar los archivos del viaje (nombres únicos, escritura atómica e índice; ver serializacion)
+        sr.guardar_viaje(resultado_json, nombre_archivo, carpeta_salida, carpeta_almacenamiento)
 
         ab.mover_archivo(carpeta_csv,carpeta_almacenamiento_csv,nombre_archivo)
+        ac.archivar_csv(carpeta_almacenamiento_csv,nombre_archivo,carpeta_almacenamiento_columnar)
         
     print(f"[PROC] Segmentos detectados: {len(lista_recortes)}")
     print(f"[PROC] Resultado JSON segmentos: {len(resultado_json)}")
@@ -418,6 +381,18 @@ def procesar_archivos_pendientes():
     listado_csv_encontrados = ab.buscar_archivos_por_nombre(carpeta_csv,prefijo_busqueda)
     print(f"[PROC] Archivos encontrados: {listado_csv_encontrados}")
     resultados = []
+
+    #con varios archivos se reparten entre los procesos trabajadores (ver pool_procesamiento)
+    if pp.cantidad_trabajadores() > 1 and len(listado_csv_encontrados) > 1:
+        registros = pp.obtener_pool().procesar_archivos(
+            listado_csv_encontrados, carpeta_csv, modulo='csv_processing_main', funcion='procesar_archivo_csv'
+        )
+        for registro in registros:
+            if registro["status"] == "success":
+                resultados.append({"archivo": registro["archivo"], "status": "success", "segmentos": registro["segmentos"]})
+            else:
+                resultados.append({"archivo": registro["archivo"], "status": registro["status"], "error": registro["error"]})
+        return resultados
     
     #se recorren la lista que tiene todas las condiciones
     for dato in listado_csv_encontrados:
@@ -9,6 +9,12 @@ if services_dir not in sys.path:
 # Se cambia a main_procesamiento como fuente primaria
 import main_procesamiento as procesamiento
 import algoritmos_busqueda as ab
+import cache_grafos as cg
+import cola_trabajos as ct
+import manifiesto_grafos as mg
+import pool_procesamiento as pp
+import registro_archivos as ra
+import serializacion as sr
 
 class CSVProcessor:
     def __init__(self):
@@ -20,9 +26,67 @@ class CSVProcessor:
     def procesar_archivo_especifico(self, nombre_archivo):
         return procesamiento.procesar_archivo_especifico(nombre_archivo)
     
+    def procesar_archivo_aislado(self, nombre_archivo):
+        # En un proceso del pool: el trabajo de CPU no compite por el GIL con el event loop del API
+        return pp.obtener_pool().procesar_archivos([nombre_archivo], procesamiento.carpeta_csv)[0]
+    
+    def enviar_archivo_aislado(self, nombre_archivo):
+        # Como procesar_archivo_aislado sin esperar: Future con la lista de un registro
+        return pp.obtener_pool().enviar_archivos([nombre_archivo], procesamiento.carpeta_csv)
+    
+    def cola_habilitada(self):
+        return ct.habilitada()
+    
+    def encolar_archivo(self, nombre_archivo, prioridad=0):
+        # Lo procesa un proceso de trabajador_cola; retorna el trabajo (o el que ya estaba activo)
+        return ct.encolar(nombre_archivo, prioridad)
+    
+    def encolar_archivos(self, nombres_archivos, prioridad=0):
+        with ct.conectar() as conexion:
+            return [ct.encolar(nombre, prioridad, conexion=conexion) for nombre in nombres_archivos]
+    
+    def encolar_pendientes(self, prioridad=0):
+        archivos = ab.buscar_archivos_por_nombre(procesamiento.carpeta_csv, procesamiento.prefijo_busqueda)
+        return self.encolar_archivos(archivos, prioridad)
+    
+    def obtener_trabajo(self, id_trabajo):
+        return ct.obtener(id_trabajo)
+    
+    def listar_trabajos(self, estado=None, limite=100):
+        return ct.listar(estado, limite)
+    
+    def reintentar_trabajo(self, id_trabajo):
+        return ct.reintentar(id_trabajo)
+    
+    def resumen_cola(self):
+        return ct.resumen()
+    
     def buscar_archivos_por_nombre(self, carpeta, prefijo):
         return ab.buscar_archivos_por_nombre(carpeta, prefijo)
     
+    def estadisticas_cache_grafos(self):
+        return cg.estadisticas_cache()
+    
+    def estadisticas_pool(self):
+        return pp.estadisticas_pool()
+    
+    def leer_indice_salida(self, desde=0, limite=None):
+        return sr.leer_indice(procesamiento.carpeta_archivos_json, desde, limite)
+
+    def listar_registro_archivos(self, estado=None, limite=100):
+        return ra.listar(procesamiento.ruta_registro_archivos, estado, limite)
+
+    def buscar_registro_archivo(self, sha256=None, nombre_archivo=None):
+        if sha256 is not None:
+            return ra.buscar(procesamiento.ruta_registro_archivos, sha256)
+        return ra.buscar_por_nombre(procesamiento.ruta_registro_archivos, nombre_archivo)
+
+    def limpiar_registro_archivos(self):
+        return ra.limpiar(procesamiento.ruta_registro_archivos)
+
+    def refrescar_manifiesto_grafos(self):
+        return mg.refrescar_manifiesto(procesamiento.carpeta_grafos)
+    
     @property
     def carpeta_csv(self):
         return procesamiento.carpeta_csv
@@ -31,6 +95,10 @@ class CSVProcessor:
     def carpeta_almacenamiento_csv(self):
         return procesamiento.carpeta_almacenamiento_csv
     
+    @property
+    def carpeta_almacenamiento_columnar(self):
+        return procesamiento.carpeta_almacenamiento_columnar
+    
     @property
     def prefijo_busqueda(self):
         return procesamiento.prefijo_busqueda
@@ -43,4 +111,8 @@ class CSVProcessor:
     def carpeta_almacenamiento_json(self):
         return procesamiento.carpeta_almacenamiento_json
 
+    @property
+    def carpeta_puntos_control(self):
+        return procesamiento.carpeta_puntos_control
+
 csv_processor = CSVProcessor()
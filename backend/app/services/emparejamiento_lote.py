@@ -0,0 +1,407 @@
+"""
+Emparejamiento en lote (map matching) de una trayectoria GPS completa.
+
+Reproduce la secuencia de segmentos de ubicar_muestra_grafo + segmentar_grafo
+(main_procesamiento) pero sin recorrer la trayectoria muestra por muestra:
+1. Número de grafo de todas las muestras con una operación vectorizada
+2. Consulta en lote del índice espacial de la tesela (indice_espacial) con los
+   corredores (polígonos de ancho L) de todas las aristas
+3. Rachas de muestras que permanecen en el corredor de la arista actual
+   resueltas con búsqueda binaria (sin tocar cada muestra)
+4. En cada cambio de arista, los candidatos vecinos se puntúan con aritmética
+   de arreglos (mismos pesos que ubicar_muestra_grafo)
+5. Proyección de todas las muestras sobre su arista en una sola pasada
+
+El bucle en Python solo itera sobre los cambios de arista, no sobre las muestras.
+Con un punto de control (puntos_control) los tramos se cortan además cada N
+muestras y al final de cada bloque se guarda el avance para continuar desde ahí
+si el proceso se interrumpe.
+EmparejadorIncremental usa el mismo recorrido para una trayectoria que llega
+por partes (streaming), conservando el estado entre llamadas.
+
+Diferencias intencionales respecto al procesamiento por muestra:
+- Al cruzar a otra tesela se conserva la arista actual si existe en la nueva
+  tesela; si no, se busca la arista más cercana (antes se producía una excepción)
+- Si el punto no cae en ningún subsegmento de la primera arista se usa la
+  posición 0 (antes se producía una excepción al calcular el hash)
+- Las muestras en teselas sin grafo quedan sin arista (indice_arista = -1)
+"""
+import threading
+import weakref
+
+import numpy as np
+
+import adyacencia_grafo as ag
+import algoritmos_posicinamiento as ap
+import cache_grafos as cg
+import distancias as dist
+import indice_espacial as ie
+import puntos_control as pc
+
+DISTANCIA_VECINOS = 50
+
+
+class EstructurasTesela:
+    """Estructuras derivadas de una tesela que usa el emparejamiento en lote (se construyen una vez)."""
+
+    def __init__(self, tesela, L):
+        self.tesela = tesela
+        self.L = L
+        self.espacial = ie.indice_espacial(tesela, L)
+        self.adyacencia = ag.adyacencia_grafo(tesela)
+        self.indice = self.espacial.posiciones
+        self.geom_offsets = self.espacial.geom_offsets
+        self.geom_coords = self.espacial.geom_coords
+        self.longitud = self.espacial.longitud
+        self.angulo_entrada, self.angulo_salida = self._angulos()
+        self._vecinos = {}
+        self._lock = threading.Lock()
+
+    def _angulos(self):
+        # Igual que ap.obtener_angulos_edge: primer y último tramo de la geometría
+        inicio = self.geom_offsets[:-1]
+        fin = self.geom_offsets[1:]
+        p1 = self.geom_coords[inicio][:, ::-1].tolist()
+        p2 = self.geom_coords[inicio + 1][:, ::-1].tolist()
+        p3 = self.geom_coords[fin - 2][:, ::-1].tolist()
+        p4 = self.geom_coords[fin - 1][:, ::-1].tolist()
+        entrada = np.array([ap.calcular_angulo(a, b) for a, b in zip(p1, p2)], dtype=np.float64)
+        salida = np.array([ap.calcular_angulo(a, b) for a, b in zip(p3, p4)], dtype=np.float64)
+        return entrada, salida
+
+    def coordenadas(self, indice):
+        return self.espacial.coordenadas(indice)
+
+    def vecinos(self, indice, distancia_maxima=DISTANCIA_VECINOS):
+        """
+        Candidatos de ubicar_muestra_grafo para la arista indicada.
+
+        Returns:
+            (indices, niveles, valores): arreglos en el mismo orden en que los recorre el algoritmo por muestra.
+        """
+        u, v = self.tesela.aristas[indice][:2].tolist()
+        clave = (u, v, distancia_maxima)
+        resultado = self._vecinos.get(clave)
+        if resultado is None:
+            vecindario = self.adyacencia.vecindario(u, v, distancia_maxima)
+            if vecindario is None:
+                resultado = (np.empty(0, dtype=np.int64),) * 3
+            else:
+                existe = vecindario.aristas_key0 >= 0
+                resultado = (vecindario.aristas_key0[existe], vecindario.niveles[existe], vecindario.valores[existe])
+            with self._lock:
+                self._vecinos[clave] = resultado
+        return resultado
+
+    def arista_mas_cercana(self, longitud, latitud):
+        return self.espacial.arista_mas_cercana(longitud, latitud)
+
+
+_estructuras = weakref.WeakKeyDictionary()
+_lock_estructuras = threading.Lock()
+
+
+def estructuras_tesela(tesela, L):
+    """Retorna (construyendo una sola vez) las EstructurasTesela de una tesela para el ancho L."""
+    with _lock_estructuras:
+        por_ancho = _estructuras.setdefault(tesela, {})
+        estructuras = por_ancho.get(L)
+        if estructuras is None:
+            estructuras = EstructurasTesela(tesela, L)
+            por_ancho[L] = estructuras
+    return estructuras
+
+
+class ResultadoEmparejamiento:
+    """
+    Resultado del emparejamiento en lote. Arreglos por muestra:
+    - numero_grafo, indice_arista (-1 si no hay arista), aristas (u, v, key)
+    - posicion_subsegmento, cambio (True en las muestras donde empieza un segmento)
+    - punto_proyectado (lon, lat) sobre la arista asignada
+    y para cada muestra con cambio: subsegmentos[i] = (coordenadas_subsegmento, longitud_subsegmento)
+    """
+
+    def __init__(self, cantidad):
+        self.numero_grafo = np.full(cantidad, -1, dtype=np.int64)
+        self.indice_arista = np.full(cantidad, -1, dtype=np.int64)
+        self.aristas = np.full((cantidad, 3), -1, dtype=np.int64)
+        self.posicion_subsegmento = np.zeros(cantidad, dtype=np.int64)
+        self.cambio = np.zeros(cantidad, dtype=bool)
+        self.punto_proyectado = np.full((cantidad, 2), np.nan, dtype=np.float64)
+        self.subsegmentos = {}
+        self.info_aristas = {}  # muestra con cambio -> info de la arista (highway, name, length)
+
+    def __len__(self):
+        return len(self.cambio)
+
+
+class _Estado:
+    def __init__(self):
+        self.tesela = None
+        self.numero = None  # número de grafo de la tesela (para restaurar el estado de un punto de control)
+        self.indice = -1
+        self.posicion = None
+        self.coordenadas_subsegmento = None
+        self.sin_grafo = None  # número de la tesela sin grafo en la que está la trayectoria (solo para el aviso)
+
+    def a_dict(self):
+        return {
+            'numero': self.numero,
+            'indice': self.indice,
+            'posicion': self.posicion,
+            'coordenadas_subsegmento': self.coordenadas_subsegmento,
+        }
+
+    @classmethod
+    def desde_dict(cls, datos, carpeta_grafos):
+        estado = cls()
+        estado.numero = datos['numero']
+        estado.indice = datos['indice']
+        estado.posicion = datos['posicion']
+        estado.coordenadas_subsegmento = datos['coordenadas_subsegmento']
+        if estado.numero is not None:
+            estado.tesela = cg.obtener_tesela(carpeta_grafos, estado.numero)
+        return estado
+
+
+def emparejar_trayectoria(latitudes, longitudes, headings, carpeta_grafos, L=0.0003, segmento_maximo=60,
+                          punto_control=None):
+    """
+    Empareja toda una trayectoria con la red vial.
+
+    Args:
+        latitudes, longitudes, headings: arreglos NumPy con las muestras en orden de procesamiento
+            (heading ya filtrado, en grados [-180, 180)).
+        carpeta_grafos (str): Carpeta de las teselas.
+        L (float): Ancho del corredor en grados.
+        segmento_maximo (float): Longitud máxima de subsegmento en metros.
+        punto_control (puntos_control.PuntoControl, opcional): continúa desde los bloques ya
+            guardados de la misma trayectoria y guarda uno cada punto_control.intervalo muestras.
+
+    Returns:
+        ResultadoEmparejamiento
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    headings = np.asarray(headings, dtype=np.float64)
+    resultado = ResultadoEmparejamiento(len(latitudes))
+    if len(latitudes) == 0:
+        return resultado
+    numeros = ap.determinar_grafos(latitudes, longitudes)
+    resultado.numero_grafo[:] = numeros
+    cortes = np.flatnonzero(np.diff(numeros)) + 1
+    estado = _Estado()
+    inicio = 0
+    if punto_control is not None:
+        huella = pc.huella_trayectoria(latitudes, longitudes, headings, L, segmento_maximo)
+        inicio, guardado = punto_control.restaurar(huella, resultado)
+        if guardado is not None:
+            estado = _Estado.desde_dict(guardado, carpeta_grafos)
+        # Cortar un tramo en cualquier muestra da el mismo resultado: las rachas y la
+        # proyección son por muestra y el estado pasa de un tramo al siguiente
+        intervalo = punto_control.intervalo
+        cortes = np.union1d(cortes, np.arange(intervalo, len(numeros), intervalo))
+        if inicio > 0:
+            cortes = np.union1d(cortes, [inicio])
+    ultimo_guardado = inicio
+    for a, b in zip(np.r_[0, cortes], np.r_[cortes, len(numeros)]):
+        if b <= inicio:
+            continue
+        _emparejar_bloque(carpeta_grafos, L, numeros, latitudes, longitudes, headings, a, b, estado, resultado,
+                          segmento_maximo)
+        if punto_control is not None and b < len(numeros) and b - ultimo_guardado >= punto_control.intervalo:
+            punto_control.guardar(resultado, estado.a_dict(), ultimo_guardado, b)
+            ultimo_guardado = b
+    return resultado
+
+
+class EmparejadorIncremental:
+    """
+    Emparejamiento de una trayectoria que llega por partes (sesiones_streaming).
+
+    Conserva el estado del emparejador entre llamadas: emparejar los bloques en orden da
+    el mismo resultado que emparejar_trayectoria con la trayectoria completa.
+    """
+
+    def __init__(self, carpeta_grafos, L=0.0003, segmento_maximo=60):
+        self.carpeta_grafos = carpeta_grafos
+        self.L = L
+        self.segmento_maximo = segmento_maximo
+        self.estado = _Estado()
+
+    def emparejar(self, latitudes, longitudes, headings):
+        """Empareja las muestras nuevas. Returns: ResultadoEmparejamiento solo de esas muestras."""
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        headings = np.asarray(headings, dtype=np.float64)
+        resultado = ResultadoEmparejamiento(len(latitudes))
+        if len(latitudes) == 0:
+            return resultado
+        numeros = ap.determinar_grafos(latitudes, longitudes)
+        resultado.numero_grafo[:] = numeros
+        cortes = np.flatnonzero(np.diff(numeros)) + 1
+        for a, b in zip(np.r_[0, cortes], np.r_[cortes, len(numeros)]):
+            _emparejar_bloque(self.carpeta_grafos, self.L, numeros, latitudes, longitudes, headings, a, b,
+                              self.estado, resultado, self.segmento_maximo)
+        return resultado
+
+
+def _emparejar_bloque(carpeta_grafos, L, numeros, latitudes, longitudes, headings, a, b, estado, resultado,
+                      segmento_maximo):
+    """Empareja las muestras [a, b), todas de la misma tesela."""
+    try:
+        tesela = cg.obtener_tesela(carpeta_grafos, int(numeros[a]))
+    except FileNotFoundError as e:
+        if estado.sin_grafo != int(numeros[a]):
+            # Una vez por zona sin grafo (un tramo cortado en bloques o en mensajes de streaming)
+            print(f'[emparejamiento_lote] muestras {a}-{b - 1} sin grafo: {e}')
+        estado.tesela, estado.numero, estado.indice = None, None, -1
+        estado.sin_grafo = int(numeros[a])
+        return
+    estado.sin_grafo = None
+    estructuras = estructuras_tesela(tesela, L)
+    if estado.tesela is not None and estado.tesela is not tesela and estado.indice >= 0:
+        # Conservar la arista actual si también existe en la nueva tesela
+        arista = tuple(estado.tesela.aristas[estado.indice].tolist())
+        estado.indice = estructuras.indice.get(arista, -1)
+    estado.tesela, estado.numero = tesela, int(numeros[a])
+    _emparejar_tramo(estructuras, latitudes, longitudes, headings, a, b, estado, resultado, segmento_maximo)
+    _proyectar(estructuras, latitudes[a:b], longitudes[a:b], resultado, a, b)
+
+
+def _emparejar_tramo(est, latitudes, longitudes, headings, a, b, estado, resultado, segmento_maximo):
+    m = b - a
+    # Pares (muestra, arista) cuyo corredor contiene la muestra
+    muestra_par, arista_par = est.espacial.consultar_lote(longitudes[a:b], latitudes[a:b])
+
+    # Rachas de muestras consecutivas dentro del corredor de una misma arista
+    claves = arista_par * (m + 1) + muestra_par
+    orden = np.argsort(claves, kind='stable')
+    claves = claves[orden]
+    muestras_ordenadas = muestra_par[orden]
+    nueva_racha = np.r_[True, np.diff(claves) != 1]
+    id_racha = np.cumsum(nueva_racha) - 1
+    fin_racha = muestras_ordenadas[np.r_[np.flatnonzero(nueva_racha)[1:] - 1, len(claves) - 1]][id_racha] \
+        if len(claves) else claves
+
+    # Aristas cuyo corredor contiene cada muestra (CSR por muestra)
+    orden_muestra = np.lexsort((arista_par, muestra_par))
+    aristas_por_muestra = arista_par[orden_muestra]
+    puntero = np.r_[0, np.cumsum(np.bincount(muestra_par, minlength=m))]
+
+    i = 0
+    while i < m:
+        k = a + i
+        if estado.indice >= 0:
+            clave = estado.indice * (m + 1) + i
+            posicion = np.searchsorted(claves, clave)
+            if posicion < len(claves) and claves[posicion] == clave:
+                # La muestra sigue en el corredor: se avanza hasta el final de la racha
+                fin = int(fin_racha[posicion])
+                _asignar(est, resultado, estado, k, a + fin + 1)
+                i = fin + 1
+                continue
+            contenidas = aristas_por_muestra[puntero[i]:puntero[i + 1]]
+            nuevo = _elegir_candidato(est, estado.indice, contenidas, longitudes[k], latitudes[k], headings[k])
+            if nuevo is None:
+                estado.indice = est.arista_mas_cercana(longitudes[k], latitudes[k])
+            else:
+                estado.indice = nuevo
+        else:
+            estado.indice = est.arista_mas_cercana(longitudes[k], latitudes[k])
+        resultado.cambio[k] = True
+        _segmentar(est, estado, resultado, k, longitudes[k], latitudes[k], segmento_maximo)
+        _asignar(est, resultado, estado, k, k + 1)
+        i += 1
+
+
+def _elegir_candidato(est, indice_actual, contenidas, longitud, latitud, heading):
+    """
+    Puntuación de ubicar_muestra_grafo sobre los vecinos cuyo corredor contiene la muestra.
+
+    Returns:
+        Índice de la arista elegida, el índice actual si hubo candidatos pero ninguno con peso
+        positivo, o None si ningún candidato contiene la muestra.
+    """
+    candidatos, niveles, valores = est.vecinos(indice_actual)
+    if len(candidatos) == 0 or len(contenidas) == 0:
+        return None
+    contiene = np.isin(candidatos, contenidas)
+    if not contiene.any():
+        return None
+    candidatos, niveles, valores = candidatos[contiene], niveles[contiene], valores[contiene]
+    u, v = est.tesela.aristas[indice_actual][:2].tolist()
+    original = est.indice.get((u, v, 0), indice_actual)
+    # Igual que ap.distancia_segmento: distancia a la proyección sobre el último tramo de cada candidato
+    fin = est.geom_offsets[candidatos + 1]
+    proy_x, proy_y = dist.proyectar_en_tramos(longitud, latitud, est.geom_coords[fin - 2], est.geom_coords[fin - 1])
+    distancias = dist.distancia(latitud, longitud, proy_y, proy_x)
+    direccion = est.angulo_entrada[candidatos]
+    referencia = np.where(valores != 0, est.angulo_entrada[original], est.angulo_salida[original])
+    diferencia = np.abs(direccion - referencia) % 360
+    diferencia = np.where(diferencia > 180, 360 - diferencia, diferencia)
+    peso_nivel = 1 / niveles
+    peso_distancia = 1 - (distancias / 300)
+    peso_direccion = 1 - (diferencia / 180)
+    angulo_180 = ((direccion + 180) % 360) - 180
+    peso_angulo = 1 - np.abs(angulo_180 - heading) / 180
+    peso_final = 0.8 * peso_direccion + 0.3 * peso_nivel + 0.1 * peso_distancia + 0.6 * peso_angulo
+    # Igual que el recorrido original: el primer candidato con el mayor peso estrictamente positivo
+    positivos = peso_final > 0
+    if not positivos.any():
+        return indice_actual
+    mayor = peso_final[positivos].max()
+    return int(candidatos[np.flatnonzero(positivos & (peso_final == mayor))[0]])
+
+
+def _segmentar(est, estado, resultado, k, longitud, latitud, segmento_maximo):
+    longitud_via = float(est.longitud[estado.indice])
+    lista_total, longitud_subsegmento, _ = est.espacial.subsegmentos(estado.indice, segmento_maximo)
+    if longitud_via > segmento_maximo:
+        posicion = est.espacial.ubicar_subsegmento(estado.indice, segmento_maximo, longitud, latitud)
+        if posicion is not None:
+            estado.posicion = posicion
+            estado.coordenadas_subsegmento = lista_total[posicion]
+        elif estado.posicion is None:
+            estado.posicion = 0
+            estado.coordenadas_subsegmento = lista_total[0]
+    else:
+        estado.posicion = 0
+        estado.coordenadas_subsegmento = lista_total[0]
+    resultado.subsegmentos[k] = (estado.coordenadas_subsegmento, longitud_subsegmento)
+    tesela = est.tesela
+    resultado.info_aristas[k] = {
+        'length': longitud_via,
+        'highway': tesela.atributo('vocab_highway', int(tesela.highway[estado.indice])),
+        'name': tesela.atributo('vocab_nombre', int(tesela.nombre[estado.indice])),
+    }
+
+
+def _asignar(est, resultado, estado, desde, hasta):
+    resultado.indice_arista[desde:hasta] = estado.indice
+    resultado.aristas[desde:hasta] = est.tesela.aristas[estado.indice]
+    resultado.posicion_subsegmento[desde:hasta] = estado.posicion if estado.posicion is not None else 0
+
+
+def _proyectar(est, latitudes, longitudes, resultado, a, b):
+    """Proyección ortogonal de cada muestra sobre la geometría de su arista (todas a la vez)."""
+    indices = resultado.indice_arista[a:b]
+    validas = np.flatnonzero(indices >= 0)
+    if len(validas) == 0:
+        return
+    aristas = indices[validas]
+    tramos = est.geom_offsets[aristas + 1] - est.geom_offsets[aristas] - 1
+    muestra = np.repeat(validas, tramos)
+    local = np.arange(len(muestra)) - np.repeat(np.cumsum(tramos) - tramos, tramos)
+    inicio = np.repeat(est.geom_offsets[aristas], tramos) + local
+    p1, p2 = est.geom_coords[inicio], est.geom_coords[inicio + 1]
+    x0, y0 = longitudes[muestra], latitudes[muestra]
+    proy_x, proy_y = dist.proyectar_en_tramos(x0, y0, p1, p2)
+    # Tramo más cercano de cada muestra (el primero en caso de empate, igual que ap.proyectar_segmento)
+    distancia = dist.distancia(y0, x0, proy_y, proy_x)
+    orden = np.lexsort((distancia, muestra))
+    _, primero = np.unique(muestra[orden], return_index=True)
+    elegido = orden[primero]
+    resultado.punto_proyectado[a + muestra[elegido], 0] = proy_x[elegido]
+    resultado.punto_proyectado[a + muestra[elegido], 1] = proy_y[elegido]
+
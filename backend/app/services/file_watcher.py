@@ -1,26 +1,143 @@
 """
-File Watcher simple para procesamiento automático de archivos CSV.
-Implementación basada en un hilo de polling (sin watchdog) para reducir complejidad.
+File Watcher para procesamiento automático de archivos CSV.
+Dos implementaciones:
+- InotifyCSVWatcher (por defecto en Linux con watchdog): reacciona a IN_CLOSE_WRITE
+  (el escritor cerró el archivo) e IN_MOVED_TO (archivo movido a la carpeta) en
+  milisegundos, sin recorrer la carpeta ni despertar mientras no hay eventos
+- SimpleCSVWatcher: hilo de polling, usado si watchdog/inotify no está disponible
+  o con RECWAY_FILE_WATCHER=polling
 Características:
-- Polling ligero cada pocos segundos (configurable)
+- Polling ligero cada pocos segundos (configurable) en SimpleCSVWatcher
 - Detección de nuevos archivos CSV en carpeta raw
-- Verifica que el archivo esté "estable" (sin crecer) antes de procesar
+- Verifica que el archivo esté "estable" (sin crecer) antes de procesar cuando no
+  hay un evento de cierre que indique que terminó de escribirse
 - Manejo seguro de múltiples archivos llegando casi simultáneamente
-- Evita reprocesar archivos ya procesados
+- Los archivos estables se encolan en la cola de trabajos (cola_trabajos) y los
+  procesa trabajador_cola; con RECWAY_COLA_TRABAJOS=0 los procesa un grupo acotado
+  de hilos (BoundedFileExecutor): RECWAY_WATCHER_CONCURRENCIA archivos a la vez
+  (defecto 2), el resto espera en una cola por orden de llegada o, con
+  RECWAY_WATCHER_PRIORIDAD=tamano, primero los archivos más pequeños
+- Evita reprocesar archivos ya procesados; la memoria del watcher se limita a los
+  archivos presentes en raw y los duplicados por contenido los detecta registro_archivos
 """
 import os
 import time
+import queue
+import itertools
 import threading
 import logging
 from typing import Dict, Set
 from pathlib import Path
 from app.services.csv_processor import csv_processor
 
+try:
+    from watchdog.version import VERSION_MAJOR as _VERSION_WATCHDOG
+    if _VERSION_WATCHDOG < 4:
+        # schedule(event_filter=...) y la máscara de eventos del emisor son de watchdog 4
+        raise ImportError(f"watchdog {_VERSION_WATCHDOG}.x no soportado (se requiere >=4,<7)")
+    from watchdog.events import (
+        FileSystemEventHandler, FileClosedEvent, FileCreatedEvent, FileDeletedEvent, FileMovedEvent
+    )
+    from watchdog.observers.api import BaseObserver
+    from watchdog.observers.inotify import InotifyFullEmitter, InotifyObserver
+    from watchdog.observers.inotify_buffer import InotifyBuffer
+except ImportError:  # sin watchdog (o fuera de Linux) se usa el polling
+    InotifyObserver = None
+    FileSystemEventHandler = object
+else:
+    class _InotifyBufferSinRetardo(InotifyBuffer):
+        # InotifyBuffer retiene cada IN_MOVED_FROM 0.5 s para emparejarlo con su IN_MOVED_TO,
+        # y los eventos que llegan detrás esperan también: cada CSV que el procesamiento saca
+        # de raw retrasaría el siguiente. Las dos mitades sueltas se manejan por separado
+        delay = 0
+
+    class _InotifyEmitterSinRetardo(InotifyFullEmitter):
+        def on_thread_start(self):
+            path = os.fsencode(self.watch.path)
+            self._inotify = _InotifyBufferSinRetardo(
+                path, recursive=self.watch.is_recursive, event_mask=self.get_event_mask_from_filter()
+            )
+
 logger = logging.getLogger(__name__)
 
+class BoundedFileExecutor:
+    """
+    Procesa archivos con un número fijo de hilos y una cola con prioridad (menor valor
+    primero; a igual prioridad, por orden de llegada). Una ráfaga de archivos queda en
+    la cola en vez de lanzar un hilo por archivo que compita por el GIL y por las teselas.
+    """
+
+    def __init__(self, funcion, max_workers: int = 2, name: str = "csv-watcher-worker"):
+        self.funcion = funcion
+        self.max_workers = max(1, max_workers)
+        self.name = name
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._running = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._max_depth = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last: float | None = None
+
+    def submit(self, item, priority: float = 0):
+        self._queue.put((priority, next(self._sequence), time.monotonic(), item))
+        with self._lock:
+            self._submitted += 1
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+            # Hilos creados a demanda hasta el límite; luego solo crece la cola
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._worker, name=f"{self.name}-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def _worker(self):
+        while True:
+            _, _, queued_at, item = self._queue.get()
+            wait = time.monotonic() - queued_at
+            with self._lock:
+                self._running += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                self._wait_last = wait
+            try:
+                self.funcion(item)
+                failed = False
+            except Exception as e:
+                logger.error(f"Error en {threading.current_thread().name}: {e}")
+                failed = True
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                self._failed += failed
+
+    def stats(self) -> dict:
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                'max_workers': self.max_workers,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_depth,
+                'running': self._running,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'wait_avg_seconds': self._wait_total / started if started else None,
+                'wait_max_seconds': self._wait_max if started else None,
+                'wait_last_seconds': self._wait_last
+            }
+
+
 class SimpleCSVWatcher:
     """Watcher basado en polling para una carpeta de archivos CSV."""
 
+    backend = "polling"
+
     def __init__(self, watch_folder: str = "uploads/csv/raw", poll_interval: float = 2.0, stable_seconds: float = 3.0):
         self.watch_folder = Path(watch_folder)
         self.poll_interval = poll_interval
@@ -33,6 +150,11 @@ class SimpleCSVWatcher:
         self._processed: Set[str] = set()
         self._processing: Set[str] = set()
         self._last_cycle_duration: float | None = None
+        # Solo sin cola de trabajos: con la cola la concurrencia la limitan los procesos de trabajador_cola
+        self._executor = BoundedFileExecutor(
+            self._process_file_safe, int(os.getenv("RECWAY_WATCHER_CONCURRENCIA", "2"))
+        )
+        self._priority_mode = os.getenv("RECWAY_WATCHER_PRIORIDAD", "fifo")
 
     def start(self):
         if self.is_running:
@@ -80,13 +202,22 @@ class SimpleCSVWatcher:
     def _scan_once(self):
         if not self.watch_folder.exists():
             return
-        now = time.time()
         try:
             current_files = [f for f in self.watch_folder.iterdir() if f.is_file() and f.suffix.lower() == '.csv']
         except Exception as e:
             logger.error(f"No se pudo listar archivos en {self.watch_folder}: {e}")
             return
+        with self._lock:
+            # Los archivos procesados salen de raw: solo se recuerdan los que siguen en la carpeta
+            # (sin segmentos o con error), así la memoria no crece con el historial. Tras un
+            # reinicio el registro persistente (registro_archivos) evita reprocesar el contenido
+            self._processed.intersection_update(str(p) for p in current_files)
+        self._dispatch(self._check_stable(current_files, prune_missing=True))
 
+    def _check_stable(self, current_files, prune_missing: bool = False):
+        """Actualiza la ventana de estabilidad de los archivos y retorna los que ya están estables."""
+        now = time.time()
+        stable_files = []
         with self._lock:
             for file_path in current_files:
                 path_str = str(file_path)
@@ -118,12 +249,49 @@ class SimpleCSVWatcher:
                 # Verificar si alcanzó estabilidad
                 if (now - entry['last_stable_since']) >= self.stable_seconds:
                     self._processing.add(path_str)
-                    threading.Thread(target=self._process_file_safe, args=(file_path,), daemon=True).start()
+                    stable_files.append(file_path)
             # Limpiar entradas de archivos desaparecidos
-            existing_set = {str(p) for p in current_files}
-            to_remove = [p for p in self._seen_files.keys() if p not in existing_set and p not in self._processing]
-            for p in to_remove:
-                self._seen_files.pop(p, None)
+            if prune_missing:
+                existing_set = {str(p) for p in current_files}
+                to_remove = [p for p in self._seen_files.keys() if p not in existing_set and p not in self._processing]
+                for p in to_remove:
+                    self._seen_files.pop(p, None)
+        return stable_files
+
+    def _dispatch(self, files):
+        if not files:
+            return
+        if csv_processor.cola_habilitada() and self._enqueue_files(files):
+            return
+        # Sin cola, o la cola no está disponible (PostgreSQL caído o sin la migración 005)
+        for file_path in files:
+            self._executor.submit(file_path, self._priority(file_path))
+
+    def _priority(self, file_path: Path) -> float:
+        if self._priority_mode == "tamano":
+            # Primero los archivos pequeños: en una ráfaga baja la espera promedio
+            try:
+                return file_path.stat().st_size
+            except OSError:
+                return 0
+        return 0
+
+    def _enqueue_files(self, files):
+        paths = [str(file_path) for file_path in files]
+        try:
+            # Una sola conexión para toda la ráfaga
+            trabajos = csv_processor.encolar_archivos([file_path.name for file_path in files])
+            for trabajo in trabajos:
+                logger.info(f"Archivo encolado para procesamiento: {trabajo['archivo']} (trabajo {trabajo['id_trabajo']})")
+        except Exception as e:
+            logger.error(f"❌ No se pudieron encolar {len(files)} archivos; se procesan en este proceso: {e}")
+            return False
+        with self._lock:
+            self._processing.difference_update(paths)
+            self._processed.update(paths)
+            for path in paths:
+                self._seen_files.pop(path, None)
+        return True
 
     def _process_file_safe(self, file_path: Path):
         path_str = str(file_path)
@@ -132,7 +300,9 @@ class SimpleCSVWatcher:
             logger.info(f"Iniciando procesamiento automático de: {filename}")
             if file_path.exists() and file_path.stat().st_size > 0:
                 result = csv_processor.procesar_archivo_especifico(filename)
-                if result:
+                if getattr(result, 'duplicado_de', None):
+                    logger.info(f"♻️ {filename} ya procesado como {result.duplicado_de['archivo']}; no se reprocesa")
+                elif result:
                     logger.info(f"✅ Procesamiento completado exitosamente: {filename}")
                 else:
                     logger.warning(f"⚠️ Procesamiento falló para: {filename}")
@@ -146,24 +316,208 @@ class SimpleCSVWatcher:
                 self._processed.add(path_str)
                 self._seen_files.pop(path_str, None)
 
+    def _observer_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
     def status(self) -> dict:
         with self._lock:
             return {
                 'is_running': self.is_running,
+                'backend': self.backend,
+                'observer_alive': self._observer_alive(),
                 'watch_folder': str(self.watch_folder.resolve()),
                 'poll_interval': self.poll_interval,
                 'stable_seconds': self.stable_seconds,
                 'queue_pending': len(self._seen_files),
                 'processing': len(self._processing),
                 'processed_count': len(self._processed),
-                'last_cycle_duration': self._last_cycle_duration
+                'last_cycle_duration': self._last_cycle_duration,
+                'executor': self._executor.stats()
             }
 
+
+class _CSVEventHandler(FileSystemEventHandler):
+    """Traduce los eventos de watchdog a llamadas del InotifyCSVWatcher."""
+
+    def __init__(self, watcher: "InotifyCSVWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_closed(self, event):
+        # IN_CLOSE_WRITE: el escritor terminó
+        self.watcher._on_file_ready(event.src_path)
+
+    def on_moved(self, event):
+        # Con eventos completos un IN_MOVED_TO desde otra carpeta llega con src_path vacío
+        if event.src_path:
+            self.watcher._on_file_gone(event.src_path)
+        if event.dest_path:
+            self.watcher._on_file_ready(event.dest_path)
+
+    def on_created(self, event):
+        self.watcher._on_file_created(event.src_path)
+
+    def on_deleted(self, event):
+        self.watcher._on_file_gone(event.src_path)
+
+
+class InotifyCSVWatcher(SimpleCSVWatcher):
+    """
+    Watcher por eventos de inotify (watchdog). Un archivo se despacha al cerrarse
+    después de escribirlo o al moverse a la carpeta. Un IN_CREATE sin cierre
+    posterior (por ejemplo un enlace duro) se da por terminado cuando su tamaño no
+    cambia durante settle_seconds; solo se revisan esos archivos, no la carpeta.
+    Cada rescan_interval segundos se recorre la carpeta como respaldo (eventos
+    perdidos por desbordamiento de la cola de inotify).
+    """
+
+    backend = "inotify"
+
+    def __init__(self, watch_folder: str = "uploads/csv/raw", settle_seconds: float = 1.0,
+                 settle_interval: float = 0.25, rescan_interval: float = 300.0):
+        super().__init__(watch_folder, poll_interval=rescan_interval, stable_seconds=settle_seconds)
+        self.settle_interval = settle_interval
+        self.rescan_interval = rescan_interval
+        self._observer = None
+        self._wake = threading.Event()
+        self._ready: list[Path] = []  # listos según inotify, pendientes de despachar
+
+    def start(self):
+        if self.is_running:
+            logger.warning("File watcher ya está corriendo")
+            return True
+        try:
+            self.watch_folder.mkdir(parents=True, exist_ok=True)
+            self._stop_event.clear()
+            # Solo los eventos que se usan: los IN_MODIFY de cada write() no despiertan al observer
+            self._observer = BaseObserver(_InotifyEmitterSinRetardo)
+            self._observer.schedule(
+                _CSVEventHandler(self), str(self.watch_folder), recursive=False,
+                event_filter=[FileClosedEvent, FileCreatedEvent, FileDeletedEvent, FileMovedEvent]
+            )
+            self._observer.start()
+            self._thread = threading.Thread(target=self._run_loop, name="csv-watcher-settle", daemon=True)
+            self._thread.start()
+            logger.info(f"🔍 File watcher (inotify) iniciado - monitoreando: {self.watch_folder.resolve()}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ No se pudo iniciar el file watcher con inotify: {e}")
+            self._stop_observer()
+            return False
+
+    def stop(self):
+        if not self.is_running:
+            logger.warning("File watcher no está activo")
+            return
+        self._stop_event.set()
+        self._wake.set()
+        self._stop_observer()
+        if self._thread:
+            self._thread.join(timeout=5)
+        logger.info("🛑 File watcher detenido")
+
+    def _stop_observer(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+
+    @property
+    def is_running(self) -> bool:
+        return super().is_running and self._observer_alive()
+
+    def _observer_alive(self) -> bool:
+        return self._observer is not None and self._observer.is_alive()
+
+    def _run_loop(self):
+        # Archivos que ya estaban en la carpeta al iniciar
+        self._scan_once()
+        last_rescan = time.monotonic()
+        while not self._stop_event.is_set():
+            with self._lock:
+                settling = list(self._seen_files)
+                pending_ready = bool(self._ready)
+            # Sin archivos por estabilizar el hilo duerme hasta un evento o el siguiente respaldo
+            if not pending_ready:
+                self._wake.wait(self.settle_interval if settling else max(0.0, last_rescan + self.rescan_interval - time.monotonic()))
+            self._wake.clear()
+            if self._stop_event.is_set():
+                break
+            cycle_start = time.time()
+            try:
+                with self._lock:
+                    ready, self._ready = self._ready, []
+                # Los archivos de una ráfaga se despachan juntos (una conexión para encolarlos)
+                self._dispatch(ready)
+                if time.monotonic() - last_rescan >= self.rescan_interval:
+                    last_rescan = time.monotonic()
+                    self._scan_once()
+                elif settling:
+                    self._dispatch(self._check_stable([Path(p) for p in settling if os.path.exists(p)], prune_missing=True))
+            except Exception as e:
+                logger.error(f"Error en ciclo de watcher: {e}")
+            self._last_cycle_duration = time.time() - cycle_start
+
+    def _is_candidate(self, path: str) -> bool:
+        file_path = Path(path)
+        return file_path.suffix.lower() == '.csv' and file_path.parent == self.watch_folder
+
+    def _on_file_ready(self, path: str):
+        if not self._is_candidate(path):
+            return
+        with self._lock:
+            if path in self._processing:
+                return
+            # Un cierre de escritura o un movimiento es contenido nuevo aunque el nombre ya se haya procesado
+            self._processed.discard(path)
+            self._seen_files.pop(path, None)
+            self._processing.add(path)
+            self._ready.append(Path(path))
+        logger.info(f"Archivo CSV listo: {path}")
+        self._wake.set()
+
+    def _on_file_created(self, path: str):
+        if not self._is_candidate(path):
+            return
+        with self._lock:
+            if path in self._processing:
+                return
+            self._processed.discard(path)
+        # Se sigue con la ventana de estabilidad hasta que llegue IN_CLOSE_WRITE
+        self._check_stable([Path(path)])
+        self._wake.set()
+
+    def _on_file_gone(self, path: str):
+        with self._lock:
+            self._processed.discard(path)
+            self._seen_files.pop(path, None)
+
+
+def crear_file_watcher(watch_folder: str = "uploads/csv/raw", backend: str | None = None) -> SimpleCSVWatcher:
+    """
+    backend: 'inotify', 'polling' o 'auto' (defecto: RECWAY_FILE_WATCHER o 'auto', que
+    usa inotify si watchdog está instalado)
+    """
+    backend = backend or os.getenv("RECWAY_FILE_WATCHER", "auto")
+    if backend in ("auto", "inotify") and InotifyObserver is not None:
+        return InotifyCSVWatcher(watch_folder)
+    if backend == "inotify":
+        logger.warning("watchdog (>=4,<7) no está disponible; el file watcher usa polling")
+    return SimpleCSVWatcher(watch_folder)
+
 # Instancia global y funciones de fachada para mantener API previa
-_file_watcher = SimpleCSVWatcher()
+_file_watcher = crear_file_watcher()
 
 def start_file_watcher():
-    return _file_watcher.start()
+    global _file_watcher
+    if _file_watcher.start():
+        return True
+    if isinstance(_file_watcher, InotifyCSVWatcher):
+        # Sin inotify (límite de watches, sistema sin soporte): polling como respaldo
+        logger.warning("⚠️ inotify no disponible; el file watcher usa polling")
+        _file_watcher = SimpleCSVWatcher(str(_file_watcher.watch_folder))
+        return _file_watcher.start()
+    return False
 
 def stop_file_watcher():
     return _file_watcher.stop()
@@ -0,0 +1,181 @@
+"""
+Índice espacial de los corredores de aristas de una tesela de grafo.
+
+ubicar_muestra_grafo construía con generar_poligono_segmento_lonlat el polígono
+de la arista actual y de cada arista candidata en cada muestra, y
+ubicar_subsegmento hacía lo mismo con cada subsegmento. Este módulo construye
+esos polígonos una sola vez por tesela y ancho L:
+- Corredores de todas las aristas en un STRtree (consultas punto-en-corredor
+  individuales o en lote)
+- STRtree de las geometrías de las aristas para la arista más cercana (mismo
+  criterio que ox.nearest_edges)
+- Corredores de los subsegmentos de cada arista, construidos la primera vez que
+  se pide la arista y reutilizados después
+
+El índice se guarda junto a la tesela (se libera cuando el cache de grafos la desaloja).
+"""
+import threading
+import weakref
+
+import numpy as np
+import shapely
+from shapely import STRtree
+
+import algoritmos_posicinamiento as ap
+
+
+class IndiceEspacial:
+    """Corredores (polígonos de ancho L) de las aristas de una tesela y sus índices STRtree."""
+
+    def __init__(self, tesela, L):
+        self.tesela = tesela
+        self.L = L
+        aristas = np.asarray(tesela.aristas)
+        self.posiciones = {arista: i for i, arista in enumerate(map(tuple, aristas.tolist()))}
+        self.geom_offsets = np.asarray(tesela.geom_offsets)
+        self.geom_coords = np.asarray(tesela.geom_coords)
+        self.longitud = np.asarray(tesela.longitud)
+        self.corredores = poligonos_corredor(self.geom_coords, self.geom_offsets, L)
+        shapely.prepare(self.corredores)
+        self.arbol_corredores = STRtree(self.corredores)
+        indices = np.repeat(np.arange(len(aristas)), np.diff(self.geom_offsets))
+        self.arbol_lineas = STRtree(shapely.linestrings(self.geom_coords, indices=indices))
+        self._subsegmentos = {}
+        self._lock = threading.Lock()
+
+    def posicion(self, arista):
+        """Posición de la arista (u, v, key) en la tesela, o -1 si no existe."""
+        try:
+            return self.posiciones.get(tuple(arista), -1)
+        except TypeError:
+            return -1
+
+    def coordenadas(self, indice):
+        inicio, fin = self.geom_offsets[indice], self.geom_offsets[indice + 1]
+        return [tuple(p) for p in self.geom_coords[inicio:fin].tolist()]
+
+    def contiene(self, indice, longitud, latitud):
+        """True si el corredor de la arista contiene el punto (False si la arista no existe, indice < 0)."""
+        if indice < 0:
+            return False
+        corredor = self.corredores[indice]
+        return corredor is not None and bool(shapely.contains_xy(corredor, longitud, latitud))
+
+    def aristas_en_punto(self, longitud, latitud):
+        """Posiciones (ordenadas) de las aristas cuyo corredor contiene el punto."""
+        return np.sort(self.arbol_corredores.query(shapely.Point(longitud, latitud), predicate='within'))
+
+    def consultar_lote(self, longitudes, latitudes):
+        """
+        Pares (muestra, arista) cuyo corredor contiene la muestra, para muchas muestras a la vez.
+
+        Returns:
+            (muestras, aristas): arreglos de posiciones.
+        """
+        puntos = shapely.points(longitudes, latitudes)
+        pares = self.arbol_corredores.query(puntos, predicate='within')
+        return pares[0], pares[1]
+
+    def arista_mas_cercana(self, longitud, latitud):
+        # Mismo criterio que ox.nearest_edges: STRtree sobre las geometrías en el orden de G.edges
+        return int(self.arbol_lineas.query_nearest(shapely.Point(longitud, latitud), all_matches=False)[0])
+
+    def subsegmentos(self, indice, segmento_maximo):
+        """
+        Subsegmentos de la arista (ap.dividir_segmento) y sus corredores.
+
+        Returns:
+            (lista_total, longitud_subsegmento, corredores)
+        """
+        clave = (indice, segmento_maximo)
+        resultado = self._subsegmentos.get(clave)
+        if resultado is None:
+            lista_total, longitud_subsegmento = ap.dividir_segmento(
+                self.coordenadas(indice), float(self.longitud[indice]), segmento_maximo
+            )
+            coords = np.array([p for sub in lista_total for p in sub], dtype=np.float64).reshape(-1, 2)
+            offsets = np.r_[0, np.cumsum([len(sub) for sub in lista_total])].astype(np.int64)
+            corredores = poligonos_corredor(coords, offsets, self.L)
+            shapely.prepare(corredores)
+            resultado = (lista_total, longitud_subsegmento, corredores)
+            with self._lock:
+                self._subsegmentos[clave] = resultado
+        return resultado
+
+    def ubicar_subsegmento(self, indice, segmento_maximo, longitud, latitud):
+        """Igual que ap.ubicar_subsegmento pero con los corredores ya construidos."""
+        _, _, corredores = self.subsegmentos(indice, segmento_maximo)
+        validos = corredores != None  # noqa: E711 (comparación elemento a elemento)
+        dentro = np.zeros(len(corredores), dtype=bool)
+        dentro[validos] = shapely.contains_xy(corredores[validos], longitud, latitud)
+        posiciones = np.flatnonzero(dentro)
+        return int(posiciones[0]) if len(posiciones) else None
+
+
+_indices = weakref.WeakKeyDictionary()
+_lock_indices = threading.Lock()
+
+
+def indice_espacial(tesela, L):
+    """Retorna (construyendo una sola vez) el IndiceEspacial de una tesela para el ancho L."""
+    with _lock_indices:
+        por_ancho = _indices.setdefault(tesela, {})
+        indice = por_ancho.get(L)
+        if indice is None:
+            indice = IndiceEspacial(tesela, L)
+            por_ancho[L] = indice
+    return indice
+
+
+def poligonos_corredor(geom_coords, geom_offsets, L):
+    """
+    Versión vectorizada de ap.generar_poligono_segmento_lonlat para muchas polilíneas a la vez.
+
+    Produce exactamente las mismas coordenadas que la función original. Las polilíneas
+    cuyo polígono tendría menos de tres vértices quedan como None.
+    """
+    cantidad = len(geom_offsets) - 1
+    if cantidad == 0:
+        return np.empty(0, dtype=object)
+    # Tramos (pares de vértices consecutivos) de todas las aristas
+    tramos_por_arista = np.diff(geom_offsets) - 1
+    arista_tramo = np.repeat(np.arange(cantidad), tramos_por_arista)
+    local = np.arange(len(arista_tramo)) - np.repeat(np.cumsum(tramos_por_arista) - tramos_por_arista, tramos_por_arista)
+    p1 = geom_coords[geom_offsets[:-1][arista_tramo] + local]
+    p2 = geom_coords[geom_offsets[:-1][arista_tramo] + local + 1]
+    dx = p2[:, 0] - p1[:, 0]
+    dy = p2[:, 1] - p1[:, 1]
+    longitud = np.hypot(dx, dy)
+    valido = longitud != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nx = -dy / longitud
+        ny = dx / longitud
+    normal = np.column_stack((nx, ny)) * L
+
+    # Puntos de cada lado: el primer vértice si el tramo 0 es válido y el final de cada tramo válido
+    inicio = valido & (local == 0)
+    arista_punto = np.concatenate((arista_tramo[inicio], arista_tramo[valido]))
+    orden_punto = np.concatenate((np.zeros(inicio.sum(), dtype=np.int64), local[valido] + 1))
+    superior = np.concatenate((p1[inicio] + normal[inicio], p2[valido] + normal[valido]))
+    inferior = np.concatenate((p1[inicio] - normal[inicio], p2[valido] - normal[valido]))
+    orden = np.lexsort((orden_punto, arista_punto))
+    arista_punto, superior, inferior = arista_punto[orden], superior[orden], inferior[orden]
+
+    # Anillo de cada arista: superiores en orden y luego inferiores en orden inverso
+    conteo = np.bincount(arista_punto, minlength=cantidad)
+    inicio_grupo = np.cumsum(conteo) - conteo
+    posicion = np.arange(len(arista_punto)) - inicio_grupo[arista_punto]
+    destino_sup = 2 * inicio_grupo[arista_punto] + posicion
+    destino_inf = 2 * inicio_grupo[arista_punto] + 2 * conteo[arista_punto] - 1 - posicion
+    anillos = np.empty((2 * len(arista_punto), 2), dtype=np.float64)
+    anillos[destino_sup] = superior
+    anillos[destino_inf] = inferior
+
+    poligonos = np.full(cantidad, None, dtype=object)
+    completas = conteo >= 2
+    if completas.any():
+        usar = np.repeat(completas, 2 * conteo)
+        indices = np.repeat(np.arange(cantidad), 2 * conteo)[usar]
+        _, indices = np.unique(indices, return_inverse=True)
+        poligonos[completas] = shapely.polygons(shapely.linearrings(anillos[usar], indices=indices))
+    return poligonos
@@ -0,0 +1,225 @@
+"""
+Lectura por bloques de los CSV de RecWay con memoria acotada.
+
+cargar_csv_con_metadatos abre el archivo dos veces (metadatos '#' y luego
+pd.read_csv) y carga todas las columnas de acelerómetro y giroscopio de toda
+la grabación, aunque el emparejamiento con el mapa solo usa timestamp, gps_lat,
+gps_lng, gps_speed y gps_heading. Una grabación de varias horas a 100 Hz
+(millones de filas) podía agotar la memoria del contenedor.
+
+Aquí el archivo se abre una sola vez:
+- Se leen los metadatos y el encabezado
+- pandas lee solo las columnas pedidas, con tipos explícitos, en bloques de
+  tamano_bloque filas
+- Las muestras GPS repetidas (el GPS reporta a ~1 Hz mientras los sensores
+  van a 100 Hz) se eliminan bloque a bloque, así que en memoria solo quedan los
+  fixes distintos
+
+La latitud y la longitud se mantienen en float64: en float32 la resolución a
+longitudes de -74° es de ~4e-6 grados (~0.5 m), suficiente para cambiar el
+resultado de la eliminación de duplicados y del emparejamiento.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+COLUMNAS_GPS = ('timestamp', 'gps_lat', 'gps_lng', 'gps_speed', 'gps_heading')
+COLUMNAS_SENALES = ('acc_x', 'acc_z', 'gyro_x')
+TIPOS_COLUMNAS = {
+    'timestamp': np.int64,
+    'gps_lat': np.float64,
+    'gps_lng': np.float64,
+    'gps_speed': np.float64,
+    'gps_heading': np.float64,
+    'gps_accuracy': np.float32,
+    'acc_x': np.float32, 'acc_y': np.float32, 'acc_z': np.float32,
+    'gyro_x': np.float32, 'gyro_y': np.float32, 'gyro_z': np.float32,
+}
+TAMANO_BLOQUE = int(os.getenv('RECWAY_TAMANO_BLOQUE_CSV', '200000'))
+
+
+class LectorCSV:
+    """
+    Lector por bloques de un CSV de RecWay.
+
+    columnas=None lee todas las columnas del archivo; las columnas de 'opcionales'
+    se leen solo si el archivo las tiene.
+
+    Uso:
+        with LectorCSV(ruta, columnas=COLUMNAS_GPS) as lector:
+            lector.metadatos
+            for bloque in lector:
+                ...
+    """
+
+    def __init__(self, ruta_csv, columnas=COLUMNAS_GPS, tamano_bloque=None, opcionales=()):
+        if not os.path.isfile(ruta_csv):
+            raise FileNotFoundError(f"No se encontró el archivo: {ruta_csv}")
+        self.ruta_csv = ruta_csv
+        self.tamano_bloque = tamano_bloque or TAMANO_BLOQUE
+        self.metadatos = {}
+        self._archivo = open(ruta_csv, 'r', encoding='utf-8')
+        self.columnas_archivo = self._leer_encabezado()
+        if columnas is None:
+            columnas = self.columnas_archivo
+        faltantes = [c for c in columnas if c not in self.columnas_archivo]
+        if faltantes:
+            self.cerrar()
+            raise ValueError(f"El archivo {os.path.basename(ruta_csv)} no contiene las columnas: {faltantes}")
+        self.columnas = list(columnas) + [c for c in opcionales if c in self.columnas_archivo and c not in columnas]
+        self.filas_leidas = 0
+
+    def _leer_encabezado(self):
+        # Mismo criterio que ap.cargar_csv_con_metadatos: todo lo anterior a la línea 'timestamp...'
+        for linea in self._archivo:
+            linea = linea.strip()
+            if linea.startswith('timestamp'):
+                return linea.split(',')
+            if linea.startswith('#') and ':' in linea:
+                try:
+                    clave, valor = linea.strip('# ').split(':', 1)
+                    self.metadatos[clave.strip()] = valor.strip()
+                except ValueError:
+                    pass
+        raise ValueError(f"No se encontró el encabezado 'timestamp,...' en {self.ruta_csv}")
+
+    def __iter__(self):
+        bloques = pd.read_csv(
+            self._archivo,
+            header=None,
+            names=self.columnas_archivo,
+            usecols=self.columnas,
+            dtype={c: TIPOS_COLUMNAS[c] for c in self.columnas if c in TIPOS_COLUMNAS},
+            chunksize=self.tamano_bloque
+        )
+        for bloque in bloques:
+            bloque.index = pd.RangeIndex(self.filas_leidas, self.filas_leidas + len(bloque))
+            self.filas_leidas += len(bloque)
+            yield bloque[self.columnas]
+
+    def cerrar(self):
+        self._archivo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cerrar()
+
+
+def rango_timestamp(ruta_csv):
+    """
+    (primer, último) timestamp de la grabación sin leerla completa: la primera fila
+    de datos y la última línea del archivo (las filas están en orden de tiempo).
+    """
+    with LectorCSV(ruta_csv, columnas=('timestamp',)) as lector:
+        primera = lector._archivo.readline()
+    with open(ruta_csv, 'rb') as archivo:
+        archivo.seek(0, os.SEEK_END)
+        archivo.seek(max(0, archivo.tell() - 4096))
+        ultima = next(linea for linea in reversed(archivo.read().splitlines()) if linea.strip())
+    return int(float(primera.split(',')[0])), int(float(ultima.split(b',')[0]))
+
+
+def eliminar_duplicados_por_bloques(bloques):
+    """
+    Versión incremental de la detección de ap.eliminar_muestras_gps_duplicadas:
+    conserva las filas cuya latitud o longitud cambia respecto a la fila anterior
+    (la comparación continúa entre bloques) y agrega 'index_original'.
+
+    Yields:
+        DataFrame de cada bloque solo con las filas conservadas (en el orden del archivo).
+    """
+    anterior = None
+    for bloque in bloques:
+        if len(bloque) == 0:
+            continue
+        latitud = bloque['gps_lat'].to_numpy()
+        longitud = bloque['gps_lng'].to_numpy()
+        lat_previa = np.empty_like(latitud)
+        lng_previa = np.empty_like(longitud)
+        lat_previa[1:], lng_previa[1:] = latitud[:-1], longitud[:-1]
+        if anterior is None:
+            lat_previa[0], lng_previa[0] = np.nan, np.nan  # la primera fila siempre se conserva
+        else:
+            lat_previa[0], lng_previa[0] = anterior
+        cambio = (latitud != lat_previa) | (longitud != lng_previa)
+        anterior = (latitud[-1], longitud[-1])
+        filtrado = bloque[cambio].copy()
+        filtrado['index_original'] = filtrado.index
+        yield filtrado
+
+
+def cargar_trayectoria_gps(carpeta, nombre_csv, tamano_bloque=None):
+    """
+    Equivalente a ap.eliminar_muestras_gps_duplicadas(ap.cargar_csv_con_metadatos(...)[0])
+    pero leyendo por bloques solo las columnas GPS.
+
+    Returns:
+        (df_gps, metadatos): df_gps con los fixes distintos en orden invertido (igual que
+        eliminar_muestras_gps_duplicadas) y las columnas 'index_original' e 'index_final'.
+    """
+    df_gps, _, metadatos = cargar_trayectoria_y_senales(carpeta, nombre_csv, (), tamano_bloque)
+    return df_gps, metadatos
+
+
+def cargar_trayectoria_y_senales(carpeta, nombre_csv, columnas_senales=COLUMNAS_SENALES, tamano_bloque=None):
+    """
+    Igual que cargar_trayectoria_gps y, en la misma pasada, las señales de los sensores
+    completas (una muestra por fila del archivo, float32) para procesamiento_senales.
+
+    Las columnas de señales que no estén en el archivo se omiten.
+
+    Returns:
+        (df_gps, senales, metadatos): senales es un dict columna -> np.ndarray.
+    """
+    ruta = os.path.join(carpeta, nombre_csv)
+    with LectorCSV(ruta, COLUMNAS_GPS, tamano_bloque, opcionales=columnas_senales) as lector:
+        partes, senales = separar_bloques(lector, lector.columnas[len(COLUMNAS_GPS):])
+        return construir_trayectoria(partes, lector.filas_leidas), senales, lector.metadatos
+
+
+def separar_bloques(bloques, columnas_senales):
+    """
+    Elimina los duplicados GPS bloque a bloque y acumula las columnas de señales.
+
+    Returns:
+        (partes, senales): bloques GPS sin duplicados y dict columna -> np.ndarray float32.
+    """
+    acumuladas = {c: [] for c in columnas_senales}
+
+    def bloques_gps():
+        for bloque in bloques:
+            for columna in columnas_senales:
+                acumuladas[columna].append(bloque[columna].to_numpy(dtype=np.float32))
+            yield bloque[list(COLUMNAS_GPS)]
+
+    partes = list(eliminar_duplicados_por_bloques(bloques_gps()))
+    senales = {
+        c: np.concatenate(valores) if valores else np.empty(0, dtype=np.float32)
+        for c, valores in acumuladas.items()
+    }
+    return partes, senales
+
+
+def construir_trayectoria(partes, filas_leidas):
+    """
+    Une los bloques sin duplicados e invierte el orden (como eliminar_muestras_gps_duplicadas).
+
+    Agrega 'index_final': primera fila del archivo que ya no pertenece al fix (la fila del
+    siguiente fix distinto, o filas_leidas para el último). Las filas
+    [index_original, index_final) son las muestras de sensores tomadas con ese fix.
+    """
+    if partes:
+        df = pd.concat(partes)
+    else:
+        df = pd.DataFrame({c: pd.Series(dtype=TIPOS_COLUMNAS[c]) for c in COLUMNAS_GPS})
+        df['index_original'] = pd.Series(dtype=np.int64)
+    indice_final = np.empty(len(df), dtype=np.int64)
+    indice_final[:-1] = df['index_original'].to_numpy()[1:]
+    indice_final[-1:] = filas_leidas
+    df['index_final'] = indice_final
+    df_gps = df.iloc[::-1].reset_index(drop=True)
+    df_gps.attrs['filas_leidas'] = filas_leidas
+    return df_gps
@@ -3,10 +3,22 @@ import numpy as np
 import pandas as pd
 import os
 from filterpy.kalman import KalmanFilter  # noqa: F401 (no se usa aún pero se conserva como en original)
-import osmnx as ox
 import algoritmos_posicinamiento as ap
 import algoritmos_busqueda as ab
-import json
+import adyacencia_grafo as ag
+import almacen_columnar as ac
+import cache_grafos as cg
+import contexto_viaje as cv
+import emparejamiento_lote as el
+import indice_espacial as ie
+import lectura_csv as lc
+import persistencia_bd as pb
+import pool_procesamiento as pp
+import procesamiento_senales as ps
+import puntos_control as pc
+import registro_archivos as ra
+import resultado_viaje as rv
+import serializacion as sr
 import pathlib
 
 # Ajuste de rutas para integrarse al backend actual
@@ -16,18 +28,25 @@ carpeta_csv = str(base_path / 'uploads' / 'csv' / 'raw')  # carpeta donde se enc
 prefijo_busqueda = 'RecWay_'
 carpeta_archivos_json = str(base_path / 'uploads' / 'json' / 'output')
 carpeta_almacenamiento_csv = str(base_path / 'uploads' / 'csv' / 'processed')
+carpeta_almacenamiento_columnar = str(base_path / 'uploads' / 'csv' / 'columnar')  # Parquet de los CSV procesados (almacen_columnar)
 carpeta_almacenamiento_json = str(base_path / 'uploads' / 'json' / 'storage')
+carpeta_grafos = str(base_path / 'grafos_archivos5')
+carpeta_puntos_control = str(base_path / 'uploads' / 'puntos_control')  # avance del emparejamiento para reanudar (puntos_control)
+ruta_registro_archivos = str(base_path / 'uploads' / 'registro_archivos.sqlite3')  # archivos procesados por contenido (registro_archivos)
 
 #clase con los datos de procesamiento 
 class DatosProcesamiento:
-    def __init__(self):
+    def __init__(self, viaje=None):
+        self.viaje = viaje  # contexto_viaje.ContextoViaje del archivo en proceso
         self.G = None
+        self.indice_espacial = None
+        self.adyacencia = None
         self.latitud = None
         self.longitud = None
         self.numero_grafo = None
         self.G_exist = False
         # carpeta grafos ajustada
-        self.carpeta_grafos = str(base_path / 'grafos_archivos5')
+        self.carpeta_grafos = carpeta_grafos
         self.L = 0.0003
         self.id_edge = None
         self.info_edge = None
@@ -45,38 +64,46 @@ class DatosProcesamiento:
 #-----------------SUB FUNCIONES MAIN -------------------------#
 
 def adquirir_latitud_longitud(datos,index_GPS):
-    datos.latitud = df_gps['gps_lat'].iloc[index_GPS]
-    datos.longitud = df_gps['gps_lng'].iloc[index_GPS]
-    datos.velocidad = df_gps['gps_speed'].iloc[index_GPS]
-    datos.heading = df_gps['gps_heading_filtrado'].iloc[index_GPS]
+    viaje = datos.viaje
+    datos.latitud = viaje.latitud[index_GPS]
+    datos.longitud = viaje.longitud[index_GPS]
+    datos.velocidad = viaje.velocidad[index_GPS]
+    datos.heading = viaje.heading[index_GPS]
+
+def cargar_grafo(datos, numero_grafo):
+    tesela = cg.obtener_tesela(datos.carpeta_grafos, numero_grafo)
+    datos.G = tesela.G
+    datos.indice_espacial = ie.indice_espacial(tesela, datos.L)
+    datos.adyacencia = ag.adyacencia_grafo(tesela)
 
 def procesamiento_mapa(datos):
     if datos.G_exist:
         if not ap.confirmar_grafo(datos.latitud, datos.longitud, datos.numero_grafo, datos.carpeta_grafos):
             datos.numero_grafo = ap.determinar_grafo(datos.latitud, datos.longitud)
             if ap.confirmar_grafo(datos.latitud, datos.longitud, datos.numero_grafo, datos.carpeta_grafos):
-                grafo_nombre = ap.buscar_archivos_por_prefijo(datos.carpeta_grafos, 'segN' + str(datos.numero_grafo) + 'pos')
-                datos.G = ox.load_graphml(filepath=str(grafo_nombre)[2:-2])
+                cargar_grafo(datos, datos.numero_grafo)
                 datos.G_exist = True
     else:
         datos.numero_grafo = ap.determinar_grafo(datos.latitud, datos.longitud)
         if ap.confirmar_grafo(datos.latitud, datos.longitud, datos.numero_grafo, datos.carpeta_grafos):
-            grafo_nombre = ap.buscar_archivos_por_prefijo(datos.carpeta_grafos, 'segN' + str(datos.numero_grafo) + 'pos')
-            datos.G = ox.load_graphml(filepath=str(grafo_nombre)[2:-2])
+            cargar_grafo(datos, datos.numero_grafo)
             datos.G_exist = True
 
 def procesamiento_mapa_simple(datos):
     num_grafo = ap.determinar_grafo(datos.latitud, datos.longitud)
     if datos.numero_grafo != num_grafo:
-        grafo_nombre = ap.buscar_archivos_por_prefijo(datos.carpeta_grafos, 'segN' + str(num_grafo) + 'pos')
         datos.numero_grafo = num_grafo
-        datos.G = ox.load_graphml(filepath=str(grafo_nombre)[2:-2])
+        cargar_grafo(datos, num_grafo)
         datos.G_exist = True
 
+def arista_mas_cercana(datos):
+    indice = datos.indice_espacial.arista_mas_cercana(datos.longitud, datos.latitud)
+    return tuple(datos.indice_espacial.tesela.aristas[indice].tolist())
+
 def ubicar_muestra_grafo(datos):
     datos.segmento_encontrado = False
     if not datos.primera_muestra:
-        datos.id_edge = ox.nearest_edges(datos.G, X=datos.longitud, Y=datos.latitud)
+        datos.id_edge = arista_mas_cercana(datos)
         datos.info_edge = datos.G.edges[datos.id_edge]
         datos.coordenadas_segmento = ap.obtener_coordenadas_segmento(datos.G, datos.id_edge, datos.info_edge)
         datos.primera_muestra = True
@@ -84,32 +111,32 @@ def ubicar_muestra_grafo(datos):
         datos.cambio_segmento = True
     else:
         datos.coordenadas_segmento = ap.obtener_coordenadas_segmento(datos.G, datos.id_edge, datos.info_edge)
-        poligono = ap.generar_poligono_segmento_lonlat(datos.coordenadas_segmento, datos.L)
-        point_in_edge = ap.punto_en_poligono(poligono, datos.longitud, datos.latitud)
+        indice = datos.indice_espacial
+        point_in_edge = indice.contiene(indice.posicion(datos.id_edge), datos.longitud, datos.latitud)
         if not point_in_edge:
             datos.cambio_segmento = True
-            segmentos_anexos = ap.caminos_hasta_distanciav2(datos.G, datos.id_edge[0], datos.id_edge[1], 50)
+            # Vecindario de 50 m precomputado (mismo orden que caminos_hasta_distanciav2)
+            segmentos_anexos = datos.adyacencia.vecindario(datos.id_edge[0], datos.id_edge[1], 50)
             angulos_segmento_original = ap.obtener_angulos_edge(datos.G, datos.id_edge[0], datos.id_edge[1])
+            # Candidatos cuyo corredor contiene la muestra (una sola consulta al índice espacial)
+            aristas_en_punto = indice.aristas_en_punto(datos.longitud, datos.latitud)
+            contenidas = np.flatnonzero(np.isin(segmentos_anexos.aristas_key0, aristas_en_punto))
             posibilidades_segmento = []
-            for i in range(1, len(segmentos_anexos)):
-                for j in range(len(segmentos_anexos[i])):
-                    id_segmento = (segmentos_anexos[i][j][0], segmentos_anexos[i][j][1], 0)
-                    info_segmento = datos.G.edges[id_segmento]
-                    coordenadas_edge = ap.obtener_coordenadas_segmento(datos.G, id_segmento, info_segmento)
-                    poligono2 = ap.generar_poligono_segmento_lonlat(coordenadas_edge, datos.L)
-                    point_in_edge2 = ap.punto_en_poligono(poligono2, datos.longitud, datos.latitud)
-                    if point_in_edge2:
-                        datos.segmento_encontrado = True
-                        registro = {
-                            'nivel': i,
-                            'id': id_segmento,
-                            'info': info_segmento,
-                            'coordenadas': coordenadas_edge,
-                            'distancia': ap.distancia_segmento(coordenadas_edge, datos.longitud, datos.latitud),
-                            'direccion': ap.obtener_angulos_edge(datos.G, id_segmento[0], id_segmento[1]),
-                            'nodo_origen': segmentos_anexos[i][j][5]
-                        }
-                        posibilidades_segmento.append(registro)
+            for k in contenidas.tolist():
+                id_segmento = tuple(indice.tesela.aristas[segmentos_anexos.aristas_key0[k]].tolist())
+                info_segmento = datos.G.edges[id_segmento]
+                coordenadas_edge = ap.obtener_coordenadas_segmento(datos.G, id_segmento, info_segmento)
+                datos.segmento_encontrado = True
+                registro = {
+                    'nivel': int(segmentos_anexos.niveles[k]),
+                    'id': id_segmento,
+                    'info': info_segmento,
+                    'coordenadas': coordenadas_edge,
+                    'distancia': ap.distancia_segmento(coordenadas_edge, datos.longitud, datos.latitud),
+                    'direccion': ap.obtener_angulos_edge(datos.G, id_segmento[0], id_segmento[1]),
+                    'nodo_origen': int(segmentos_anexos.valores[k])
+                }
+                posibilidades_segmento.append(registro)
             mayor_peso = 0
             if len(posibilidades_segmento) > 0:
                 for i in range(len(posibilidades_segmento)):
@@ -133,8 +160,7 @@ def ubicar_muestra_grafo(datos):
             datos.segmento_encontrado = True
             datos.cambio_segmento = False
         if not datos.segmento_encontrado:
-            segmento = ox.nearest_edges(datos.G, X=datos.longitud, Y=datos.latitud)
-            datos.id_edge = segmento
+            datos.id_edge = arista_mas_cercana(datos)
             datos.info_edge = datos.G.edges[datos.id_edge]
             datos.coordenadas_segmento = ap.obtener_coordenadas_segmento(datos.G, datos.id_edge, datos.info_edge)
             datos.primera_muestra = True
@@ -145,145 +171,159 @@ def colocar_puntos_grafo(datos):
 
 def segmentar_grafo(datos):
     if datos.cambio_segmento:
+        # Subsegmentos y sus corredores quedan guardados en el índice espacial de la tesela
+        posicion_arista = datos.indice_espacial.posicion(datos.id_edge)
+        lista_total, datos.longitud_subsegmento, _ = datos.indice_espacial.subsegmentos(
+            posicion_arista, datos.segmento_maximo
+        )
         if datos.info_edge['length'] > datos.segmento_maximo:
-            cantidad_divisiones = int(datos.info_edge['length'] / datos.segmento_maximo)
-            posicion = 1
-            distancia_acumulada = ap.distancia_euclidiana_acumulada(datos.coordenadas_segmento)
-            datos.longitud_subsegmento = distancia_acumulada[-1] / (cantidad_divisiones + 1)
-            lista_total = []
-            lista_base = [datos.coordenadas_segmento[0]]
-            for i in range(1, len(distancia_acumulada)):
-                punto_cortado = datos.coordenadas_segmento[i]
-                while distancia_acumulada[i] > (datos.longitud_subsegmento * posicion):
-                    longitud_faltante = (datos.longitud_subsegmento * posicion) - distancia_acumulada[i - 1]
-                    punto_cortado = ap.punto_en_recta_geografica_simple(
-                        datos.coordenadas_segmento[i - 1][1],
-                        datos.coordenadas_segmento[i - 1][0],
-                        datos.coordenadas_segmento[i][1],
-                        datos.coordenadas_segmento[i][0],
-                        longitud_faltante,
-                        distancia_acumulada[i] - distancia_acumulada[i - 1]
-                    )
-                    lista_base.append(punto_cortado)
-                    lista_total.append(lista_base)
-                    lista_base = [punto_cortado]
-                    punto_cortado = datos.coordenadas_segmento[i]
-                    posicion += 1
-                lista_base.append(punto_cortado)
-            lista_total.append(lista_base)
-            for i in range(len(lista_total)):
-                poligono = ap.generar_poligono_segmento_lonlat(lista_total[i], datos.L)
-                point_in_edge = ap.punto_en_poligono(poligono, datos.longitud, datos.latitud)
-                if point_in_edge:
-                    datos.posicion_subsegmento = i
-                    datos.coordenadas_subsegmento = lista_total[i]
-                    break
+            posicion = datos.indice_espacial.ubicar_subsegmento(
+                posicion_arista, datos.segmento_maximo, datos.longitud, datos.latitud
+            )
+            if posicion is not None:
+                datos.posicion_subsegmento = posicion
+                datos.coordenadas_subsegmento = lista_total[posicion]
         else:
             datos.coordenadas_subsegmento = datos.coordenadas_segmento
-            datos.longitud_subsegmento = datos.info_edge['length']
             datos.posicion_subsegmento = 0
 
 # Ejecución principal encapsulada en función para reuso
 
-# NUEVA: procesar un archivo específico y devolver lista de segmentos
+# NUEVA: procesar un archivo específico y devolver sus segmentos (resultado_viaje.ResultadoViaje)
 # Extraído de la lógica original del bucle dentro de procesar()
-def procesar_archivo_especifico(nombre_archivo: str):
-    global df_gps  # usado por funciones auxiliares
+def _reclamar_contenido(nombre_archivo):
+    """
+    Consulta el registro de archivos procesados (registro_archivos) por el sha256 del CSV.
+
+    Returns:
+        (sha256, registro): registro es None si este proceso debe procesar el archivo,
+        o el registro del mismo contenido ya procesado (o en proceso en otro proceso).
+    """
+    sha256, tamano = ra.huella_archivo(os.path.join(carpeta_csv, nombre_archivo))
+    registro = ra.reclamar(ruta_registro_archivos, sha256, nombre_archivo, tamano)
+    return sha256, registro
+
+
+def procesar_archivo_especifico(nombre_archivo: str, progreso=None, propagar_errores=False):
+    """
+    progreso: función opcional progreso(fraccion, etapa) que se llama al empezar cada etapa
+    (la usa trabajador_cola para reportar el avance del trabajo).
+    propagar_errores: si es True el error se relanza en vez de retornar un resultado vacío
+    (la cola de trabajos lo necesita para reintentar).
+
+    Un CSV con el mismo contenido que otro ya procesado (por ejemplo el mismo viaje subido
+    otra vez como RecWay_x_1.csv) no se procesa: se mueve a processed y se retorna un
+    resultado vacío con duplicado_de = registro del contenido original.
+    """
+    avance = progreso or (lambda fraccion, etapa: None)
+    sha256 = None
+    latido = None
     try:
-        contador_json = 1
-        df, _ = ap.cargar_csv_con_metadatos(carpeta_csv, nombre_archivo)
-        df_gps = ap.eliminar_muestras_gps_duplicadas(df)
+        avance(0.0, 'lectura')
+        if ac.es_archivo_columnar(nombre_archivo):
+            # Reprocesamiento de una grabación ya archivada en el almacén columnar
+            df_gps, senales, metadatos = ac.cargar_trayectoria_y_senales(carpeta_almacenamiento_columnar, nombre_archivo)
+        else:
+            if ra.habilitado():
+                huella, registro = _reclamar_contenido(nombre_archivo)
+                if registro is not None:
+                    return _resultado_duplicado(nombre_archivo, registro, avance)
+                sha256 = huella  # reclamado: el resultado o el error se registran al final
+                # Mientras dure el procesamiento otro proceso no lo da por abandonado
+                latido = ra.Latido(ruta_registro_archivos, sha256)
+                latido.start()
+            # Lectura por bloques de las columnas GPS (sin duplicados) y de las señales de sensores
+            df_gps, senales, metadatos = lc.cargar_trayectoria_y_senales(carpeta_csv, nombre_archivo)
         df_gps = ap.ajustar_heading_y_filtrar(df_gps)
         df_gps = ap.filtrar_muestras_por_velocidad(df_gps, 3)
-        datos_mapa = DatosProcesamiento()
-        lista_recortes = []
-        for i in range(len(df_gps)):
-            adquirir_latitud_longitud(datos_mapa, i)
-            procesamiento_mapa_simple(datos_mapa)
-            ubicar_muestra_grafo(datos_mapa)
-            segmentar_grafo(datos_mapa)
-            hash_segmento = ap.hash_segmento(
-                datos_mapa.id_edge[0],
-                datos_mapa.id_edge[1],
-                (datos_mapa.posicion_subsegmento * 1000) + datos_mapa.id_edge[2]
-            )
-            if datos_mapa.cambio_segmento:
-                nombre = datos_mapa.info_edge['name'] if 'name' in datos_mapa.info_edge else 'Undefined'
-                segmento = {
-                    'id': hash_segmento,
-                    'nombre': nombre,
-                    'tipo_via': datos_mapa.info_edge.get('highway', 'unknown'),
-                    'longitud_via': datos_mapa.longitud_subsegmento,
-                    'punto_inicial': i,
-                    'tiempo': ap.timestamp_a_iso8601(int(df_gps['timestamp'].iloc[i])),
-                    'coordenadas_segmento': datos_mapa.coordenadas_subsegmento
-                }
-                lista_recortes.append(segmento)
-        # Construcción JSON (idéntico a procesar())
-        resultado_json = []
-        for i in range(len(lista_recortes)):
-            lista_geometria = []
-            for j in range(len(lista_recortes[i]['coordenadas_segmento'])):
-                puntos = {
-                    'orden': j,
-                    'longitud': lista_recortes[i]['coordenadas_segmento'][j][0],
-                    'latitud': lista_recortes[i]['coordenadas_segmento'][j][1]
-                }
-                lista_geometria.append(puntos)
-            lista_huecos = []
-            hueco1 = {
-                'latitud': lista_geometria[0]['latitud'],
-                'longitud': lista_geometria[0]['longitud'],
-                'magnitud': float(np.random.randint(0, 5000) / 1000),
-                'velocidad': float(np.random.randint(0, 5000) / 1000),
-            }
-            hueco2 = {
-                'latitud': lista_geometria[-1]['latitud'],
-                'longitud': lista_geometria[-1]['longitud'],
-                'magnitud': float(np.random.randint(0, 5000) / 1000),
-                'velocidad': float(np.random.randint(0, 5000) / 1000),
-            }
-            lista_huecos.extend([hueco1, hueco2])
-            datos_obtenidos = {
-                'numero': i,
-                'id': lista_recortes[i]['id'],
-                'nombre': lista_recortes[i]['nombre'],
-                'longitud': lista_recortes[i]['longitud_via'],
-                'tipo': lista_recortes[i]['tipo_via'],
-                'latitud_origen': lista_geometria[0]['latitud'],
-                'latitud_destino': lista_geometria[-1]['latitud'],
-                'longitud_origen': lista_geometria[0]['longitud'],
-                'longitud_destino': lista_geometria[-1]['longitud'],
-                'geometria': lista_geometria,
-                'fecha': lista_recortes[i]['tiempo'],
-                'IQR': float(np.random.randint(0, 5000) / 1000),
-                'iri': float(np.random.randint(0, 20000) / 1000),
-                'IRI_modificado': float(np.random.randint(0, 5000) / 1000),
-                'az': float(np.random.randint(0, 5000) / 1000),
-                'ax': float(np.random.randint(0, 5000) / 1000),
-                'wx': float(np.random.randint(0, 5000) / 1000),
-                'huecos': lista_huecos
-            }
-            resultado_json.append(datos_obtenidos)
-        if len(resultado_json) > 0:
+        viaje = cv.ContextoViaje.desde_dataframe(df_gps, nombre_archivo, metadatos, senales)
+        datos_mapa = DatosProcesamiento(viaje)
+        avance(0.2, 'emparejamiento')
+        # Si un intento anterior se interrumpió, el emparejamiento continúa desde su último bloque guardado
+        punto_control = pc.PuntoControl(carpeta_puntos_control, nombre_archivo) if pc.habilitado() else None
+        # Emparejamiento de toda la trayectoria en lote (equivalente a ubicar_muestra_grafo + segmentar_grafo)
+        emparejamiento = el.emparejar_trayectoria(
+            viaje.latitud,
+            viaje.longitud,
+            viaje.heading,
+            datos_mapa.carpeta_grafos,
+            L=datos_mapa.L,
+            segmento_maximo=datos_mapa.segmento_maximo,
+            punto_control=punto_control
+        )
+        avance(0.6, 'metricas')
+        # IRI, IQR, RMS y huecos de todos los segmentos a la vez (ver procesamiento_senales)
+        metricas = ps.metricas_segmentos(viaje, np.flatnonzero(emparejamiento.cambio))
+        resultado = rv.ResultadoViaje.desde_emparejamiento(viaje, emparejamiento, metricas)
+        indice = {}
+        if len(resultado) > 0:
             print(f'[main_procesamiento] guardando datos archivo: {nombre_archivo}')
-            os.makedirs(carpeta_archivos_json, exist_ok=True)
-            ruta_archivo = os.path.join(carpeta_archivos_json, 'datos' + str(contador_json) + '.json')
-            with open(ruta_archivo, 'w', encoding='utf-8') as archivo:
-                json.dump(resultado_json, archivo, ensure_ascii=False, indent=2)
-            os.makedirs(carpeta_almacenamiento_json, exist_ok=True)
-            ruta_archivo2 = os.path.join(carpeta_almacenamiento_json, 'datos' + nombre_archivo[:-4] + 'save.json')
-            with open(ruta_archivo2, 'w', encoding='utf-8') as archivo:
-                json.dump(resultado_json, archivo, ensure_ascii=False, indent=2)
-            ab.mover_archivo(carpeta_csv, carpeta_almacenamiento_csv, nombre_archivo)
-        return resultado_json
+            avance(0.8, 'guardado')
+            # Los dicts del JSON se crean solo aquí; se serializan una vez para los dos archivos,
+            # con nombres propios del viaje y escritura atómica (un reintento los reemplaza)
+            indice = sr.guardar_viaje(
+                resultado.a_dicts(), nombre_archivo, carpeta_archivos_json, carpeta_almacenamiento_json, registrar=False
+            )
+            if not ac.es_archivo_columnar(nombre_archivo) and pb.habilitada():
+                avance(0.85, 'persistencia')
+                # Segmentos, muestras y registros del viaje con COPY en una transacción;
+                # si falla el CSV queda en raw para reintentarlo
+                pb.persistir_viaje(resultado, metadatos, os.path.join(carpeta_csv, nombre_archivo))
+            # La línea de output/index.jsonl va cuando el viaje quedó completo: si la carga en la
+            # base falla, el reintento no deja un registro repetido del mismo viaje
+            indice = sr.registrar_en_indice(carpeta_archivos_json, indice)
+            if not ac.es_archivo_columnar(nombre_archivo):
+                ab.mover_archivo(carpeta_csv, carpeta_almacenamiento_csv, nombre_archivo)
+                ac.archivar_csv(carpeta_almacenamiento_csv, nombre_archivo, carpeta_almacenamiento_columnar)
+        if sha256 is not None:
+            ra.completar(
+                ruta_registro_archivos, sha256, len(resultado), indice.get('salida'), indice.get('almacenamiento'),
+                os.path.join(carpeta_almacenamiento_csv, nombre_archivo) if indice else None
+            )
+        if punto_control is not None:
+            punto_control.descartar()
+        return resultado
     except Exception as e:
         print('[main_procesamiento][ERROR] procesar_archivo_especifico:', e)
-        return []
+        if sha256 is not None:
+            try:
+                ra.fallar(ruta_registro_archivos, sha256, e)
+            except Exception as error_registro:
+                print('[main_procesamiento][ERROR] registro_archivos:', error_registro)
+        if propagar_errores:
+            raise
+        return rv.ResultadoViaje.vacio(nombre_archivo)
+    finally:
+        if latido is not None:
+            latido.detener()
+
+
+def _resultado_duplicado(nombre_archivo, registro, avance):
+    if registro['estado'] != 'completado':
+        # Otro proceso tiene el mismo contenido en curso: el CSV queda en raw y la cola lo
+        # reintentará (entonces ya estará completado o, si falló, este lo reclamará)
+        raise RuntimeError(f"{nombre_archivo}: el mismo contenido se está procesando como {registro['archivo']}")
+    avance(1.0, 'duplicado')
+    if registro['archivo'] == nombre_archivo:
+        # El mismo archivo visto otra vez (p. ej. un viaje sin segmentos que quedó en raw)
+        print(f'[main_procesamiento] {nombre_archivo} ya estaba procesado; no se reprocesa')
+    else:
+        print(f"[main_procesamiento] {nombre_archivo}: mismo contenido que {registro['archivo']} "
+              f"(ya procesado, {registro['segmentos']} segmentos); no se reprocesa")
+        ab.mover_archivo(carpeta_csv, carpeta_almacenamiento_csv, nombre_archivo)
+    resultado = rv.ResultadoViaje.vacio(nombre_archivo)
+    resultado.duplicado_de = registro
+    return resultado
 
 # Ajustado: procesar todos usando la función nueva
 def procesar():
     listado_csv_encontrados = ab.buscar_archivos_por_nombre(carpeta_csv, prefijo_busqueda)
+    if pp.cantidad_trabajadores() > 1 and len(listado_csv_encontrados) > 1:
+        # Varios archivos: se reparten entre los procesos trabajadores (ver pool_procesamiento)
+        for registro in pp.obtener_pool().procesar_archivos(listado_csv_encontrados, carpeta_csv):
+            if registro['status'] != 'success':
+                print(f"[main_procesamiento][ERROR] {registro['archivo']}: {registro['error']}")
+        return True
     for dato in listado_csv_encontrados:
         procesar_archivo_especifico(dato)
     return True
@@ -0,0 +1,165 @@
+"""
+Manifiesto de las teselas de grafos disponibles en grafos_archivos5.
+
+Reemplaza el recorrido con os.walk de toda la carpeta (y el recorte del nombre
+del archivo) que se hacía en cada cambio de tesela. El manifiesto se construye
+una sola vez por carpeta y luego cada consulta es una búsqueda O(1) en un
+diccionario numero_grafo -> EntradaGrafo (ruta y área de la tesela).
+
+- Si la carpeta contiene 'manifiesto_grafos.json' se usa directamente
+  (se puede generar con: python manifiesto_grafos.py <carpeta_grafos>)
+- Si no existe, se construye escaneando la carpeta una vez
+- refrescar() vuelve a leer la carpeta; una consulta por un número que no está
+  en el manifiesto también lo refresca, como máximo una vez cada
+  RECWAY_MANIFIESTO_REFRESCO segundos (defecto 60)
+"""
+import os
+import re
+import sys
+import json
+import time
+import threading
+
+NOMBRE_MANIFIESTO = 'manifiesto_grafos.json'
+PATRON_TESELA = re.compile(r'^segN(\d+)pos(.+)\.graphml$')
+
+
+class EntradaGrafo:
+    """Ruta y área (tomada del nombre del archivo) de una tesela."""
+
+    __slots__ = ('numero', 'ruta', 'lat_izquierda', 'lat_derecha', 'lon_izquierda', 'lon_derecha')
+
+    def __init__(self, numero, ruta, lat_izquierda, lat_derecha, lon_izquierda, lon_derecha):
+        self.numero = numero
+        self.ruta = ruta
+        self.lat_izquierda = lat_izquierda
+        self.lat_derecha = lat_derecha
+        self.lon_izquierda = lon_izquierda
+        self.lon_derecha = lon_derecha
+
+    def contiene(self, latitud, longitud):
+        return (self.lat_izquierda > latitud) and (self.lat_derecha < latitud) and \
+            (self.lon_izquierda < longitud) and (self.lon_derecha > longitud)
+
+    def a_dict(self, carpeta):
+        return {
+            'numero': self.numero,
+            'archivo': os.path.relpath(self.ruta, carpeta),
+            'area': [self.lat_izquierda, self.lat_derecha, self.lon_izquierda, self.lon_derecha]
+        }
+
+
+def interpretar_nombre_tesela(ruta):
+    """
+    Extrae número y área de un archivo 'segN<k>pos<lat_izq>&<lat_der>&<lon_izq>&<lon_der>.graphml'.
+
+    Returns:
+        EntradaGrafo o None si el nombre no tiene el formato esperado.
+    """
+    coincidencia = PATRON_TESELA.match(os.path.basename(ruta))
+    if coincidencia is None:
+        return None
+    partes = coincidencia.group(2).split('&')
+    if len(partes) != 4:
+        return None
+    try:
+        area = [float(valor) for valor in partes]
+    except ValueError:
+        return None
+    return EntradaGrafo(int(coincidencia.group(1)), ruta, *area)
+
+
+class ManifiestoGrafos:
+    """Índice numero_grafo -> EntradaGrafo de una carpeta de teselas."""
+
+    def __init__(self, carpeta_grafos, intervalo_refresco=60.0):
+        self.carpeta_grafos = carpeta_grafos
+        self.intervalo_refresco = intervalo_refresco
+        self._entradas = {}
+        self._lock = threading.Lock()
+        self._ultimo_refresco = 0.0
+        ruta_manifiesto = os.path.join(carpeta_grafos, NOMBRE_MANIFIESTO)
+        if os.path.isfile(ruta_manifiesto):
+            self._cargar_archivo(ruta_manifiesto)
+        else:
+            self.refrescar()
+
+    def _cargar_archivo(self, ruta_manifiesto):
+        with open(ruta_manifiesto, 'r', encoding='utf-8') as archivo:
+            datos = json.load(archivo)
+        entradas = {}
+        for registro in datos.get('grafos', []):
+            ruta = os.path.join(self.carpeta_grafos, registro['archivo'])
+            entradas[registro['numero']] = EntradaGrafo(registro['numero'], ruta, *registro['area'])
+        with self._lock:
+            self._entradas = entradas
+            self._ultimo_refresco = time.monotonic()
+
+    def refrescar(self):
+        """Vuelve a escanear la carpeta de grafos y reemplaza el manifiesto en memoria."""
+        entradas = {}
+        for root, dirs, files in os.walk(self.carpeta_grafos):
+            # Las carpetas .tesela contienen arreglos compilados, no GraphML
+            dirs[:] = [d for d in dirs if not d.endswith('.tesela')]
+            for file in files:
+                entrada = interpretar_nombre_tesela(os.path.join(root, file))
+                if entrada is not None and entrada.numero not in entradas:
+                    entradas[entrada.numero] = entrada
+        with self._lock:
+            self._entradas = entradas
+            self._ultimo_refresco = time.monotonic()
+        return len(entradas)
+
+    def obtener(self, numero_grafo):
+        """Retorna la EntradaGrafo del número indicado o None si no existe la tesela."""
+        entrada = self._entradas.get(numero_grafo)
+        if entrada is None and time.monotonic() - self._ultimo_refresco >= self.intervalo_refresco:
+            self.refrescar()
+            entrada = self._entradas.get(numero_grafo)
+        return entrada
+
+    def guardar(self):
+        """Escribe el manifiesto en la carpeta para que los siguientes arranques no escaneen."""
+        with self._lock:
+            registros = [entrada.a_dict(self.carpeta_grafos) for entrada in self._entradas.values()]
+        ruta_manifiesto = os.path.join(self.carpeta_grafos, NOMBRE_MANIFIESTO)
+        temporal = ruta_manifiesto + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump({'version': 1, 'grafos': registros}, archivo)
+        os.replace(temporal, ruta_manifiesto)
+        return ruta_manifiesto
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+_manifiestos = {}
+_lock_manifiestos = threading.Lock()
+
+
+def obtener_manifiesto(carpeta_grafos):
+    """Retorna el manifiesto (construido una sola vez por proceso) de una carpeta de grafos."""
+    clave = os.path.abspath(carpeta_grafos)
+    manifiesto = _manifiestos.get(clave)
+    if manifiesto is None:
+        with _lock_manifiestos:
+            manifiesto = _manifiestos.get(clave)
+            if manifiesto is None:
+                manifiesto = ManifiestoGrafos(
+                    carpeta_grafos, float(os.getenv('RECWAY_MANIFIESTO_REFRESCO', '60'))
+                )
+                _manifiestos[clave] = manifiesto
+    return manifiesto
+
+
+def refrescar_manifiesto(carpeta_grafos):
+    return obtener_manifiesto(carpeta_grafos).refrescar()
+
+
+if __name__ == '__main__':
+    carpeta = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', '..', 'grafos_archivos5'
+    )
+    manifiesto = ManifiestoGrafos(carpeta)
+    manifiesto.refrescar()
+    print(f'{len(manifiesto)} teselas -> {manifiesto.guardar()}')
@@ -0,0 +1,447 @@
+"""
+Persistencia de los viajes procesados en PostgreSQL (tablas de init_complete.sql).
+
+El pipeline solo generaba archivos JSON; las tablas segmento, geometria,
+indicesSegmento, huecoSegmento, muestra, indices_muestra, huecoMuestra,
+fuente_datos_dispositivo y registro_sensores no se llenaban. Con millones de
+filas de registro_sensores por día, insertar fila por fila (ORM o INSERT por
+registro) no alcanza, así que aquí cada viaje se carga en una sola transacción
+con COPY FROM STDIN (psycopg 3):
+- fuente_datos_dispositivo: una fila con los metadatos '#' del archivo
+- registro_sensores: todas las filas del archivo, por bloques (memoria acotada)
+- segmento: los segmentos del viaje se copian a una tabla temporal y se hace
+  un solo upsert agrupado por id (cantidad_muestras += pasadas del viaje,
+  ultima_fecha_muestra = la mayor); la geometría se inserta solo para los
+  segmentos nuevos
+- muestra (una por pasada por un segmento), indices_muestra, huecoMuestra y
+  huecoSegmento con COPY; los ids de muestra se reservan de la secuencia antes
+- indicesSegmento se recalcula con un INSERT ... SELECT agregado para los
+  segmentos del viaje
+
+registro_sensores está particionada por mes (migración 004). Antes de la
+transacción de carga se crean las particiones del rango de tiempo del archivo y
+se eliminan las que superan la retención (mantener_particiones). El rango se
+limita a la ventana de ventana_particiones: un timestamp fuera de lugar (0, o en
+segundos en vez de ms) no crea cientos de particiones; esas filas van a
+registro_sensores_default.
+
+El id de segmento es ap.hash_segmento (uint64); se guarda en bigint con el
+mismo patrón de bits (ver ids_bigint). Requiere las migraciones 002 (llaves de
+segmento y muestra en bigint), 003 (PostGIS: segmento.geom y
+registro_sensores.posicion) y 004 (particiones de registro_sensores).
+
+Configuración por variables de entorno:
+- RECWAY_PERSISTIR_BD: '1' para activar la carga (defecto '0')
+- RECWAY_RETENCION_REGISTROS_MESES: meses de registro_sensores que se conservan
+  (defecto 0 = sin límite)
+- RECWAY_PARTICIONES_MESES_ATRAS: meses antes del actual para los que se crean
+  particiones (defecto 24, o la retención si es menor)
+- DATABASE_URI: cadena de conexión (defecto app.core.config.settings.DATABASE_URI)
+
+psycopg es opcional: sin él (o sin RECWAY_PERSISTIR_BD=1) habilitada() es False
+y el pipeline solo escribe los JSON.
+"""
+import os
+import io
+
+import numpy as np
+import pandas as pd
+
+import lectura_csv as lc
+import almacen_columnar as ac
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+    pa_csv = None
+
+DISPONIBLE = psycopg is not None
+LARGO_NOMBRE = 50  # varchar(50) de segmento.nombre y segmento.tipo
+FILAS_COPY = int(os.getenv('RECWAY_FILAS_COPY', '100000'))
+RETENCION_MESES = int(os.getenv('RECWAY_RETENCION_REGISTROS_MESES', '0'))
+PARTICIONES_MESES_ATRAS = int(os.getenv('RECWAY_PARTICIONES_MESES_ATRAS', '24'))
+
+COLUMNAS_FUENTE = (
+    'device_id', 'session_id', 'platform', 'device_model', 'manufacturer', 'brand', 'os_version',
+    'app_version', 'company', 'android_id', 'battery_info', 'acc_available', 'acc_info',
+    'gyro_available', 'gyro_info', 'gps_available', 'gps_info', 'export_date', 'total_records',
+    'sampling_rate', 'recording_duration', 'average_sample_rate',
+)
+COLUMNAS_REGISTRO = (
+    'timestamp', 'acc_x', 'acc_y', 'acc_z', 'acc_magnitude', 'gyro_x', 'gyro_y', 'gyro_z',
+    'gyro_magnitude', 'gps_lat', 'gps_lng', 'gps_accuracy', 'gps_speed', 'gps_speed_accuracy',
+    'gps_altitude', 'gps_altitude_accuracy', 'gps_heading', 'gps_heading_accuracy', 'gps_timestamp',
+    'gps_provider', 'device_orientation', 'sample_rate',
+)
+# Columna de la tabla de índices <- métrica de procesamiento_senales
+CAMPOS_INDICES = {
+    'nota_general': 'IQR',
+    'iri_modificado': 'IRI_modificado',
+    'iri_estandar': 'iri',
+    'indice_primero': 'az',
+    'indice_segundo': 'ax',
+    'iri_tercero': 'wx',
+}
+INDICES_OBLIGATORIOS = ('nota_general', 'iri_modificado', 'iri_estandar', 'indice_primero', 'indice_segundo')
+
+SQL_CARGA_TEMPORAL = """
+CREATE TEMP TABLE segmento_carga (
+    id_segmento bigint, nombre varchar(50), tipo varchar(50),
+    nodo_inicial_x double precision, nodo_final_x double precision,
+    nodo_inicial_y double precision, nodo_final_y double precision,
+    longitud double precision, fecha varchar(30)
+) ON COMMIT DROP;
+CREATE TEMP TABLE geometria_carga (
+    id_segmento bigint, orden integer, coordenada_x double precision, coordenada_y double precision
+) ON COMMIT DROP;
+"""
+
+# Un solo upsert por viaje. Las filas se agrupan por id (un segmento puede recorrerse
+# varias veces en el mismo viaje) y se insertan ordenadas por id para que viajes
+# concurrentes tomen los bloqueos de fila en el mismo orden. xmax = 0 identifica las
+# filas insertadas (no actualizadas), las únicas que necesitan las filas de geometria;
+# segmento.geom (PostGIS) se arma con los mismos vértices.
+SQL_UPSERT_SEGMENTOS = """
+WITH lineas AS (
+    SELECT id_segmento,
+           ST_MakeLine(ST_SetSRID(ST_MakePoint(coordenada_x, coordenada_y), 4326) ORDER BY orden) AS geom
+    FROM geometria_carga
+    GROUP BY id_segmento
+    HAVING count(*) > 1
+), agregado AS (
+    SELECT id_segmento, min(nombre) AS nombre, min(tipo) AS tipo,
+           min(nodo_inicial_x) AS nodo_inicial_x, min(nodo_final_x) AS nodo_final_x,
+           min(nodo_inicial_y) AS nodo_inicial_y, min(nodo_final_y) AS nodo_final_y,
+           min(longitud) AS longitud, count(*) AS cantidad, max(fecha) AS fecha
+    FROM segmento_carga
+    GROUP BY id_segmento
+), upsert AS (
+    INSERT INTO segmento (id_segmento, nombre, tipo, nodo_inicial_x, nodo_final_x, nodo_inicial_y,
+                          nodo_final_y, cantidad_muestras, ultima_fecha_muestra, longitud,
+                          created_by_user_id, geom)
+    SELECT a.id_segmento, a.nombre, a.tipo, a.nodo_inicial_x, a.nodo_final_x, a.nodo_inicial_y,
+           a.nodo_final_y, a.cantidad, a.fecha, a.longitud, %(id_usuario)s, l.geom
+    FROM agregado a
+    LEFT JOIN lineas l ON l.id_segmento = a.id_segmento
+    ORDER BY a.id_segmento
+    ON CONFLICT (id_segmento) DO UPDATE SET
+        cantidad_muestras = segmento.cantidad_muestras + EXCLUDED.cantidad_muestras,
+        ultima_fecha_muestra = GREATEST(segmento.ultima_fecha_muestra, EXCLUDED.ultima_fecha_muestra),
+        geom = COALESCE(segmento.geom, EXCLUDED.geom)
+    RETURNING id_segmento, (xmax = 0) AS nuevo
+)
+INSERT INTO geometria (orden, coordenada_x, coordenada_y, id_segmento_seleccionado)
+SELECT g.orden, g.coordenada_x, g.coordenada_y, g.id_segmento
+FROM geometria_carga g
+JOIN upsert u ON u.id_segmento = g.id_segmento AND u.nuevo
+"""
+
+SQL_INDICES_SEGMENTO = """
+DELETE FROM indicesSegmento
+WHERE id_segmento_seleccionado IN (SELECT DISTINCT id_segmento FROM segmento_carga);
+INSERT INTO indicesSegmento (nota_general, iri_modificado, iri_estandar, indice_primero,
+                             indice_segundo, iri_tercero, id_segmento_seleccionado)
+SELECT avg(i.nota_general), avg(i.iri_modificado), avg(i.iri_estandar), avg(i.indice_primero),
+       avg(i.indice_segundo), avg(i.iri_tercero), m.id_segmento_seleccionado
+FROM indices_muestra i
+JOIN muestra m ON m.id_muestra = i.id_muestra
+WHERE m.id_segmento_seleccionado IN (SELECT DISTINCT id_segmento FROM segmento_carga)
+GROUP BY m.id_segmento_seleccionado;
+"""
+
+
+def habilitada():
+    return DISPONIBLE and os.getenv('RECWAY_PERSISTIR_BD', '0') == '1'
+
+
+def uri_bd():
+    uri = os.getenv('DATABASE_URI')
+    if not uri:
+        from app.core.config import settings
+        uri = settings.DATABASE_URI
+    # psycopg no entiende el sufijo de driver de SQLAlchemy (postgresql+psycopg2://)
+    esquema, separador, resto = uri.partition('://')
+    return esquema.split('+')[0] + separador + resto
+
+
+def ids_bigint(ids):
+    """uint64 (ap.hash_segmento) -> int64 con los mismos bits (bigint de PostgreSQL)."""
+    return np.asarray(ids, dtype=np.uint64).view(np.int64)
+
+
+def _texto(valor):
+    # OSM puede dar listas de nombres o tipos
+    if isinstance(valor, (list, tuple)):
+        valor = ', '.join(str(v) for v in valor)
+    return str(valor)[:LARGO_NOMBRE]
+
+
+def _a_csv(df):
+    # El escritor CSV de pyarrow es ~8 veces más rápido que DataFrame.to_csv
+    if pa_csv is not None:
+        buffer = io.BytesIO()
+        tabla = pa.Table.from_pandas(df, preserve_index=False)
+        pa_csv.write_csv(tabla, buffer, pa_csv.WriteOptions(include_header=False))
+        return buffer.getvalue()
+    return df.to_csv(header=False, index=False).encode('utf-8')
+
+
+def copiar(cursor, tabla, df):
+    """COPY FROM STDIN (formato csv) de un DataFrame; NaN/None se cargan como NULL."""
+    if len(df) == 0:
+        return 0
+    with cursor.copy(f"COPY {tabla} ({', '.join(df.columns)}) FROM STDIN (FORMAT csv)") as copy:
+        for inicio in range(0, len(df), FILAS_COPY):
+            copy.write(_a_csv(df.iloc[inicio:inicio + FILAS_COPY]))
+    return len(df)
+
+
+def _bloques_registros(ruta_archivo):
+    """Bloques del archivo (CSV o Parquet) con las columnas de registro_sensores que tenga."""
+    if ac.es_archivo_columnar(ruta_archivo):
+        archivo = ac.pq.ParquetFile(ruta_archivo, memory_map=True)
+        columnas = [c for c in COLUMNAS_REGISTRO if c in archivo.schema_arrow.names]
+        for lote in archivo.iter_batches(batch_size=lc.TAMANO_BLOQUE, columns=columnas):
+            yield lote.to_pandas()
+        return
+    with lc.LectorCSV(ruta_archivo, columnas=None) as lector:
+        columnas = [c for c in COLUMNAS_REGISTRO if c in lector.columnas_archivo]
+        for bloque in lector:
+            yield bloque[columnas]
+
+
+def copiar_registros(cursor, ruta_archivo, id_fuente):
+    """
+    Copia las filas del archivo a registro_sensores. gps_changed se marca en las filas
+    donde cambia la posición GPS respecto a la fila anterior (mismo criterio que
+    lc.eliminar_duplicados_por_bloques).
+
+    Returns:
+        int: filas copiadas.
+    """
+    filas = 0
+    anterior = None
+    for bloque in _bloques_registros(ruta_archivo):
+        bloque = bloque.copy()
+        if 'gps_lat' in bloque and 'gps_lng' in bloque:
+            posicion = bloque[['gps_lat', 'gps_lng']]
+            previa = posicion.shift(1)
+            if anterior is not None:
+                previa.iloc[0] = anterior
+            bloque['gps_changed'] = (posicion != previa).any(axis=1)
+            anterior = posicion.iloc[-1].to_numpy()
+        bloque['id_fuente'] = id_fuente
+        filas += copiar(cursor, 'registro_sensores', bloque)
+    return filas
+
+
+def rango_timestamp(ruta_archivo):
+    if ac.es_archivo_columnar(ruta_archivo):
+        return ac.rango_timestamp(ruta_archivo)
+    return lc.rango_timestamp(ruta_archivo)
+
+
+def ventana_particiones(desde, hasta, meses_atras=None, ahora=None):
+    """
+    Recorta [desde, hasta] (ms) a los meses en que se crean particiones: desde
+    meses_atras antes del mes actual hasta el mes siguiente.
+
+    Returns:
+        (desde, hasta) recortados, o None si el rango queda fuera de la ventana.
+    """
+    meses_atras = PARTICIONES_MESES_ATRAS if meses_atras is None else meses_atras
+    if RETENCION_MESES > 0:
+        meses_atras = min(meses_atras, RETENCION_MESES)
+    mes_actual = pd.Timestamp(ahora if ahora is not None else pd.Timestamp.now(tz='UTC')).tz_convert('UTC')
+    mes_actual = mes_actual.tz_localize(None).to_period('M').to_timestamp()
+    minimo = int((mes_actual - pd.DateOffset(months=meses_atras)).value // 1_000_000)
+    maximo = int((mes_actual + pd.DateOffset(months=2)).value // 1_000_000) - 1
+    desde, hasta = max(int(desde), minimo), min(int(hasta), maximo)
+    return (desde, hasta) if desde <= hasta else None
+
+
+def mantener_particiones(conexion, desde, hasta, meses_retencion=None):
+    """
+    Crea las particiones mensuales de registro_sensores que cubren [desde, hasta] (ms),
+    dentro de ventana_particiones, y elimina las anteriores a la retención. Se ejecuta en su propia transacción, antes
+    de la carga: CREATE TABLE ... PARTITION OF bloquea la tabla padre y dentro de la
+    transacción de carga esperaría a las cargas concurrentes (y ellas a esta).
+
+    Returns:
+        (creadas, eliminadas)
+    """
+    meses_retencion = RETENCION_MESES if meses_retencion is None else meses_retencion
+    ventana = ventana_particiones(desde, hasta)
+    with conexion.transaction(), conexion.cursor() as cursor:
+        creadas = 0
+        if ventana is not None:
+            cursor.execute("SELECT crear_particiones_registro(%s, %s)", ventana)
+            creadas = cursor.fetchone()[0]
+        eliminadas = 0
+        if meses_retencion > 0:
+            cursor.execute("SELECT eliminar_particiones_registro(%s)", (meses_retencion,))
+            eliminadas = cursor.fetchone()[0]
+    if creadas or eliminadas:
+        print(f'[persistencia_bd] particiones de registro_sensores: {creadas} creadas, {eliminadas} eliminadas')
+    return creadas, eliminadas
+
+
+def insertar_fuente(cursor, metadatos, id_usuario=None):
+    """Fila de fuente_datos_dispositivo con los metadatos del archivo que correspondan a columnas."""
+    valores = {c: metadatos[c] for c in COLUMNAS_FUENTE if metadatos.get(c) not in (None, '')}
+    valores['created_by_user_id'] = id_usuario
+    columnas = ', '.join(valores)
+    marcadores = ', '.join(['%s'] * len(valores))
+    cursor.execute(
+        f"INSERT INTO fuente_datos_dispositivo ({columnas}) VALUES ({marcadores}) RETURNING id_fuente",
+        list(valores.values())
+    )
+    return cursor.fetchone()[0]
+
+
+def _reservar_ids(cursor, tabla, columna, cantidad):
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+        (tabla, columna, cantidad)
+    )
+    return np.array([fila[0] for fila in cursor.fetchall()], dtype=np.int64)
+
+
+def _tablas_segmentos(resultado):
+    """DataFrames de carga de segmentos y geometría (la geometría de la primera pasada por cada id)."""
+    ids = ids_bigint(resultado.ids)
+    fechas = resultado.fechas()
+    desplazamientos = resultado.desplazamientos_vertices
+    inicio, fin = resultado.vertices[desplazamientos[:-1]], resultado.vertices[desplazamientos[1:] - 1]
+    segmentos = pd.DataFrame({
+        'id_segmento': ids,
+        'nombre': [_texto(n) for n in resultado.nombres],
+        'tipo': [_texto(t) for t in resultado.tipos],
+        'nodo_inicial_x': inicio[:, 0], 'nodo_final_x': fin[:, 0],
+        'nodo_inicial_y': inicio[:, 1], 'nodo_final_y': fin[:, 1],
+        'longitud': resultado.longitudes,
+        'fecha': fechas,
+    })
+    _, primeros = np.unique(ids, return_index=True)
+    largos = np.diff(desplazamientos)[primeros]
+    vertices = np.concatenate([resultado.geometria(i) for i in primeros]) if len(primeros) else np.empty((0, 2))
+    geometria = pd.DataFrame({
+        'id_segmento': np.repeat(ids[primeros], largos),
+        'orden': np.concatenate([np.arange(n) for n in largos]) if len(largos) else np.empty(0, np.int64),
+        'coordenada_x': vertices[:, 0],
+        'coordenada_y': vertices[:, 1],
+    })
+    return segmentos, geometria, fechas
+
+
+def crear_fuente(metadatos, id_usuario=None, conexion=None):
+    """Fila de fuente_datos_dispositivo sin segmentos (sesiones_streaming: una por sesión). Returns: id_fuente."""
+    if not DISPONIBLE:
+        raise RuntimeError('psycopg no está instalado; la persistencia en base de datos no está disponible')
+    propia = conexion is None
+    if propia:
+        conexion = psycopg.connect(uri_bd())
+    try:
+        with conexion.transaction(), conexion.cursor() as cursor:
+            return insertar_fuente(cursor, metadatos or {}, id_usuario)
+    finally:
+        if propia:
+            conexion.close()
+
+
+def persistir_viaje(resultado, metadatos, ruta_archivo=None, id_usuario=None, conexion=None, id_fuente=None):
+    """
+    Carga un viaje procesado en la base de datos en una transacción.
+
+    Args:
+        resultado (rv.ResultadoViaje): Segmentos y métricas del viaje.
+        metadatos (dict): Metadatos '#' del archivo (fuente_datos_dispositivo).
+        ruta_archivo (str): CSV o Parquet de origen para registro_sensores (None = no se copian).
+        id_usuario (int): created_by_user_id de las filas nuevas.
+        conexion: Conexión psycopg existente (por defecto se abre una con uri_bd()).
+        id_fuente (int): fuente_datos_dispositivo existente (crear_fuente); por defecto se inserta una.
+
+    Returns:
+        dict: filas cargadas por tabla.
+    """
+    if not DISPONIBLE:
+        raise RuntimeError('psycopg no está instalado; la persistencia en base de datos no está disponible')
+    propia = conexion is None
+    if propia:
+        conexion = psycopg.connect(uri_bd())
+    try:
+        if ruta_archivo is not None:
+            mantener_particiones(conexion, *rango_timestamp(ruta_archivo))
+        with conexion.transaction(), conexion.cursor() as cursor:
+            cargado = _persistir(cursor, resultado, metadatos, ruta_archivo, id_usuario, id_fuente)
+    finally:
+        if propia:
+            conexion.close()
+    print(f'[persistencia_bd] {resultado.nombre_archivo}: {cargado}')
+    return cargado
+
+
+def _persistir(cursor, resultado, metadatos, ruta_archivo, id_usuario, id_fuente=None):
+    metadatos = metadatos or {}
+    cargado = {}
+    if id_fuente is None:
+        id_fuente = insertar_fuente(cursor, metadatos, id_usuario)
+    if ruta_archivo is not None:
+        cargado['registro_sensores'] = copiar_registros(cursor, ruta_archivo, id_fuente)
+        cursor.execute(
+            "UPDATE fuente_datos_dispositivo SET total_records = COALESCE(total_records, %s) WHERE id_fuente = %s",
+            (cargado['registro_sensores'], id_fuente)
+        )
+    cantidad = len(resultado)
+    if cantidad == 0:
+        return cargado
+
+    segmentos, geometria, fechas = _tablas_segmentos(resultado)
+    cursor.execute(SQL_CARGA_TEMPORAL)
+    copiar(cursor, 'segmento_carga', segmentos)
+    copiar(cursor, 'geometria_carga', geometria)
+    cursor.execute(SQL_UPSERT_SEGMENTOS, {'id_usuario': id_usuario})
+    cargado['segmento'] = cantidad
+    cargado['geometria'] = max(cursor.rowcount, 0)
+
+    # Una muestra por pasada por un segmento; los ids se reservan para enlazar índices y huecos
+    ids_muestra = _reservar_ids(cursor, 'muestra', 'id_muestra', cantidad)
+    cargado['muestra'] = copiar(cursor, 'muestra', pd.DataFrame({
+        'id_muestra': ids_muestra,
+        'tipo_dispositivo': metadatos.get('platform'),
+        'identificador_dispositivo': metadatos.get('device_id'),
+        'fecha_muestra': fechas,
+        'id_segmento_seleccionado': segmentos['id_segmento'].to_numpy(),
+        'created_by_user_id': id_usuario,
+    }))
+
+    metricas = resultado.metricas
+    indices = pd.DataFrame({columna: metricas.metricas[nombre] for columna, nombre in CAMPOS_INDICES.items()})
+    indices['id_muestra'] = ids_muestra
+    indices = indices[np.isfinite(indices[list(INDICES_OBLIGATORIOS)]).all(axis=1)]
+    cargado['indices_muestra'] = copiar(cursor, 'indices_muestra', indices)
+
+    por_segmento = np.diff(metricas.desplazamientos_huecos)
+    huecos = pd.DataFrame({
+        'latitud': metricas.huecos_latitud,
+        'longitud': metricas.huecos_longitud,
+        'magnitud': metricas.huecos_magnitud,
+        'velocidad': metricas.huecos_velocidad,
+    })
+    cargado['huecoMuestra'] = copiar(
+        cursor, 'huecoMuestra', huecos.assign(id_muestra_seleccionada=np.repeat(ids_muestra, por_segmento))
+    )
+    cargado['huecoSegmento'] = copiar(cursor, 'huecoSegmento', huecos.assign(
+        ultima_fecha_muestra=np.repeat(np.asarray(fechas, dtype=object), por_segmento),
+        id_segmento_seleccionado=np.repeat(segmentos['id_segmento'].to_numpy(), por_segmento),
+    ))
+
+    cursor.execute(SQL_INDICES_SEGMENTO)
+    return cargado
@@ -0,0 +1,401 @@
+"""
+Procesamiento de varios archivos CSV en paralelo con procesos (no hilos).
+
+El pipeline es Python puro limitado por CPU, así que los hilos no ayudan (GIL).
+Este módulo mantiene un grupo de procesos trabajadores:
+- Cada trabajador es un proceso 'spawn' con su propio cache_grafos, que queda
+  caliente entre archivos y entre llamadas (el grupo se reutiliza)
+- Afinidad por tesela: los archivos cuyo primer fix GPS cae en la misma tesela
+  se asignan al mismo trabajador; si ese trabajador tiene muchos más archivos
+  pendientes que el menos cargado, el archivo va al menos cargado (y un
+  trabajador desocupado toma archivos de la cola más larga), para que un lote
+  de una sola ciudad también se reparta entre todos
+- Timeout por archivo (opcional): el trabajador que lo supera se termina y se
+  reemplaza; un trabajador que muere también se reemplaza y su archivo se reporta
+- Los resultados se recogen en el proceso padre con un hilo recolector; cada
+  llamada recibe los suyos en un Future, así varias llamadas concurrentes (una por
+  upload) comparten el grupo sin esperarse entre sí
+
+Configuración por variables de entorno:
+- RECWAY_TRABAJADORES: cantidad de procesos (defecto: número de CPUs; 1 = procesamiento serial)
+- RECWAY_TIMEOUT_ARCHIVO: segundos máximos por archivo (defecto 0 = sin límite; un viaje
+  de varias horas puede tardar bastante más que uno corto)
+"""
+import os
+import sys
+import time
+import queue
+import atexit
+import threading
+import importlib
+import traceback
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future
+
+import algoritmos_posicinamiento as ap
+
+TOLERANCIA_AFINIDAD = 2  # archivos pendientes de más que se aceptan para conservar la afinidad
+
+
+def cantidad_trabajadores():
+    return max(1, int(os.getenv('RECWAY_TRABAJADORES', str(os.cpu_count() or 1))))
+
+
+def timeout_archivo():
+    """Segundos máximos por archivo; 0 (defecto) es sin límite."""
+    return float(os.getenv('RECWAY_TIMEOUT_ARCHIVO', '0'))
+
+
+def primer_fix_gps(ruta_csv):
+    """
+    Lee solo hasta el primer fix GPS válido de un CSV de RecWay.
+
+    Returns:
+        (latitud, longitud) o None si no se encuentra.
+    """
+    columnas = None
+    try:
+        with open(ruta_csv, 'r', encoding='utf-8') as archivo:
+            for linea in archivo:
+                linea = linea.strip()
+                if not linea or linea.startswith('#'):
+                    continue
+                valores = linea.split(',')
+                if columnas is None:
+                    columnas = {nombre: i for i, nombre in enumerate(valores)}
+                    if 'gps_lat' not in columnas or 'gps_lng' not in columnas:
+                        return None
+                    continue
+                try:
+                    latitud = float(valores[columnas['gps_lat']])
+                    longitud = float(valores[columnas['gps_lng']])
+                except (ValueError, IndexError):
+                    continue
+                if latitud == latitud and longitud == longitud:  # descarta NaN
+                    return latitud, longitud
+    except OSError:
+        return None
+    return None
+
+
+def tesela_archivo(carpeta_csv, nombre_archivo):
+    """Número de tesela del primer fix GPS del archivo (None si no se puede determinar)."""
+    fix = primer_fix_gps(os.path.join(carpeta_csv, nombre_archivo))
+    return ap.determinar_grafo(*fix) if fix is not None else None
+
+
+def _trabajador(indice, tareas, resultados):
+    """
+    Bucle de un proceso trabajador: recibe (id, modulo, funcion, nombre_archivo), ejecuta
+    modulo.funcion(nombre_archivo, propagar_errores=True) y reporta el resultado.
+    """
+    while True:
+        tarea = tareas.get()
+        if tarea is None:
+            break
+        id_tarea, modulo, funcion, nombre_archivo = tarea
+        inicio = time.perf_counter()
+        try:
+            funcion_tarea = getattr(importlib.import_module(modulo), funcion)
+            # El timeout corre desde aquí: el arranque del proceso y los imports no cuentan
+            resultados.put((indice, id_tarea, 'inicio', None, None, 0.0))
+            inicio = time.perf_counter()
+            # Con propagar_errores el fallo llega como 'error' con su mensaje, no como un resultado vacío
+            resultado = funcion_tarea(nombre_archivo, propagar_errores=True)
+            resultados.put((indice, id_tarea, 'success', resultado, None, time.perf_counter() - inicio))
+        except Exception as e:
+            traceback.print_exc()
+            resultados.put((indice, id_tarea, 'error', None, str(e), time.perf_counter() - inicio))
+
+
+class _Trabajador:
+    def __init__(self, contexto, indice, resultados):
+        self.indice = indice
+        self.tareas = contexto.Queue()
+        self.pendientes = deque()  # tareas asignadas aún no enviadas
+        self.actual = None  # (id_tarea, inicio); inicio es None hasta que el trabajador empieza la tarea
+        self.proceso = contexto.Process(
+            target=_trabajador, args=(indice, self.tareas, resultados),
+            name=f'recway-trabajador-{indice}', daemon=True
+        )
+        self.proceso.start()
+
+    @property
+    def carga(self):
+        return len(self.pendientes) + (1 if self.actual is not None else 0)
+
+
+class _Llamada:
+    """Archivos de una llamada a enviar_archivos y sus resultados."""
+
+    def __init__(self, tareas):
+        self.tareas = tareas  # id_tarea -> nombre_archivo, en el orden de entrada
+        self.salida = {}
+        self.futuro = Future()
+        # En ejecución desde ya: quien espera no puede cancelarlo (el archivo ya está asignado)
+        self.futuro.set_running_or_notify_cancel()
+
+    @property
+    def completa(self):
+        return len(self.salida) == len(self.tareas)
+
+
+class PoolProcesamiento:
+    """Grupo de procesos trabajadores con afinidad por tesela y timeout por archivo."""
+
+    def __init__(self, trabajadores=None, timeout=None):
+        self.cantidad = trabajadores or cantidad_trabajadores()
+        self.timeout = timeout if timeout is not None else timeout_archivo()
+        self._contexto = multiprocessing.get_context('spawn')
+        self._resultados = self._contexto.Queue()
+        self._trabajadores = [_Trabajador(self._contexto, i, self._resultados) for i in range(self.cantidad)]
+        self._afinidad = {}  # tesela -> índices de trabajadores que la tienen en cache
+        self._lock = threading.Lock()
+        self._siguiente_id = 0
+        self._llamadas = {}  # id_tarea -> _Llamada, hasta que llega su resultado
+        self._recolector = None
+        self._cerrado = False
+        self.timeouts = 0
+        self.reinicios = 0
+
+    def procesar_archivos(self, nombres_archivos, carpeta_csv, modulo='main_procesamiento',
+                          funcion='procesar_archivo_especifico'):
+        """
+        Procesa una lista de archivos y espera a que terminen todos.
+
+        Args:
+            nombres_archivos (list): Nombres de los CSV dentro de carpeta_csv.
+            carpeta_csv (str): Carpeta de los CSV (para leer el primer fix GPS).
+            modulo, funcion: Función modulo.funcion(nombre_archivo, propagar_errores) que ejecuta cada trabajador.
+
+        Returns:
+            list: Un dict por archivo, en el mismo orden de entrada, con
+                'archivo', 'status' ('success', 'error' o 'timeout'), 'segmentos',
+                'duplicado_de', 'resultado', 'error', 'duracion' y 'trabajador'.
+        """
+        return self.enviar_archivos(nombres_archivos, carpeta_csv, modulo, funcion).result()
+
+    def enviar_archivos(self, nombres_archivos, carpeta_csv, modulo='main_procesamiento',
+                        funcion='procesar_archivo_especifico'):
+        """
+        Como procesar_archivos pero sin esperar.
+
+        Returns:
+            concurrent.futures.Future con la lista de procesar_archivos
+            (asyncio.wrap_future para esperarlo desde el event loop sin ocupar un hilo).
+        """
+        # Lectura del primer fix fuera del lock: no detiene a las otras llamadas
+        teselas = [tesela_archivo(carpeta_csv, nombre) for nombre in nombres_archivos]
+        with self._lock:
+            if self._cerrado:
+                raise RuntimeError('El grupo de trabajadores está cerrado')
+            tareas = {}
+            for nombre, tesela in zip(nombres_archivos, teselas):
+                id_tarea = self._siguiente_id
+                self._siguiente_id += 1
+                tareas[id_tarea] = nombre
+                trabajador = self._asignar(tesela)
+                trabajador.pendientes.append((id_tarea, modulo, funcion, nombre))
+            llamada = _Llamada(tareas)
+            for id_tarea in tareas:
+                self._llamadas[id_tarea] = llamada
+            self._despachar()
+            if self._recolector is None:
+                self._recolector = threading.Thread(target=self._recolectar, name='recway-pool-recolector', daemon=True)
+                self._recolector.start()
+        if not tareas:
+            llamada.futuro.set_result([])
+        return llamada.futuro
+
+    def _asignar(self, tesela):
+        menos_cargado = min(self._trabajadores, key=lambda t: t.carga)
+        if tesela is None:
+            return menos_cargado
+        afines = [self._trabajadores[i] for i in self._afinidad.get(tesela, ())]
+        if afines:
+            candidato = min(afines, key=lambda t: t.carga)
+            if candidato.carga <= menos_cargado.carga + TOLERANCIA_AFINIDAD:
+                return candidato
+        self._afinidad.setdefault(tesela, set()).add(menos_cargado.indice)
+        return menos_cargado
+
+    def _despachar(self):
+        libres = [t for t in self._trabajadores if t.actual is None]
+        for trabajador in libres:
+            if trabajador.pendientes:
+                self._enviar(trabajador, trabajador.pendientes.popleft())
+        for trabajador in libres:
+            if trabajador.actual is not None:
+                continue
+            # Trabajador desocupado sin archivos propios: toma el último de la cola más larga
+            mas_cargado = max(self._trabajadores, key=lambda t: len(t.pendientes))
+            if mas_cargado.pendientes:
+                self._enviar(trabajador, mas_cargado.pendientes.pop())
+
+    @staticmethod
+    def _enviar(trabajador, tarea):
+        trabajador.actual = (tarea[0], None)
+        trabajador.tareas.put(tarea)
+
+    def _recolectar(self):
+        """Hilo recolector: despacha, recibe resultados y revisa timeouts y trabajadores caídos."""
+        while True:
+            with self._lock:
+                if self._cerrado:
+                    return
+                # En cada vuelta, no solo cuando no llegan resultados: un trabajador colgado o
+                # muerto se detecta aunque los demás sigan entregando
+                completas = self._revisar_trabajadores()
+                self._despachar()
+                espera = self._espera()
+            self._resolver(completas)
+            try:
+                indice, id_tarea, status, resultado, error, duracion = self._resultados.get(timeout=espera)
+            except queue.Empty:
+                continue
+            with self._lock:
+                trabajador = self._trabajadores[indice]
+                propio = trabajador.actual is not None and trabajador.actual[0] == id_tarea
+                if status == 'inicio':
+                    if propio:
+                        trabajador.actual = (id_tarea, time.monotonic())
+                    continue
+                if propio:
+                    trabajador.actual = None
+                completas = self._completar(id_tarea, status, resultado, error, duracion, indice)
+            self._resolver(completas)
+
+    def _espera(self):
+        if self.timeout <= 0:
+            return 1.0
+        limites = [t.actual[1] + self.timeout for t in self._trabajadores if t.actual is not None and t.actual[1] is not None]
+        if not limites:
+            return 1.0
+        return max(0.05, min(min(limites) - time.monotonic(), 1.0))
+
+    def _completar(self, id_tarea, status, resultado, error, duracion, indice):
+        """Guarda el resultado en su llamada; retorna la llamada si quedó completa."""
+        llamada = self._llamadas.pop(id_tarea, None)
+        if llamada is None:
+            # Resultado tardío de un archivo que ya se reportó (timeout)
+            return []
+        llamada.salida[id_tarea] = self._registro(llamada.tareas[id_tarea], status, resultado, error, duracion, indice)
+        return [llamada] if llamada.completa else []
+
+    @staticmethod
+    def _resolver(llamadas):
+        # Fuera del lock: los callbacks del Future corren en este hilo
+        for llamada in llamadas:
+            llamada.futuro.set_result([llamada.salida[id_tarea] for id_tarea in llamada.tareas])
+
+    def _revisar_trabajadores(self):
+        ahora = time.monotonic()
+        completas = []
+        for trabajador in list(self._trabajadores):
+            if trabajador.actual is None:
+                continue
+            id_tarea, inicio = trabajador.actual
+            if self.timeout > 0 and inicio is not None and ahora - inicio >= self.timeout:
+                self.timeouts += 1
+                error = f'Se superó el tiempo máximo de {self.timeout:.0f} s'
+                estado = 'timeout'
+            elif not trabajador.proceso.is_alive():
+                error = f'El trabajador terminó inesperadamente (código {trabajador.proceso.exitcode})'
+                estado = 'error'
+            else:
+                continue
+            llamada = self._llamadas.get(id_tarea)
+            nombre = llamada.tareas[id_tarea] if llamada else None
+            print(f'[pool_procesamiento] {nombre}: {error}; reiniciando trabajador {trabajador.indice}')
+            duracion = ahora - inicio if inicio is not None else 0.0
+            completas += self._completar(id_tarea, estado, None, error, duracion, trabajador.indice)
+            self._reemplazar(trabajador)
+        return completas
+
+    def _reemplazar(self, trabajador):
+        trabajador.proceso.terminate()
+        trabajador.proceso.join(timeout=5)
+        nuevo = _Trabajador(self._contexto, trabajador.indice, self._resultados)
+        nuevo.pendientes = trabajador.pendientes
+        self._trabajadores[trabajador.indice] = nuevo
+        # El nuevo proceso empieza con el cache vacío
+        for indices in self._afinidad.values():
+            indices.discard(trabajador.indice)
+        self.reinicios += 1
+
+    @staticmethod
+    def _registro(nombre, status, resultado, error, duracion, trabajador):
+        return {
+            'archivo': nombre,
+            'status': status,
+            'segmentos': len(resultado) if hasattr(resultado, '__len__') else 0,
+            'duplicado_de': getattr(resultado, 'duplicado_de', None),
+            'resultado': resultado,
+            'error': error,
+            'duracion': duracion,
+            'trabajador': trabajador
+        }
+
+    def estadisticas(self) -> dict:
+        return {
+            'trabajadores': self.cantidad,
+            'vivos': sum(1 for t in self._trabajadores if t.proceso.is_alive()),
+            'timeout_archivo': self.timeout,
+            'timeouts': self.timeouts,
+            'reinicios': self.reinicios,
+            'teselas_con_afinidad': len(self._afinidad)
+        }
+
+    def cerrar(self):
+        with self._lock:
+            self._cerrado = True
+            pendientes = {id(llamada): llamada for llamada in self._llamadas.values()}
+            self._llamadas.clear()
+        for llamada in pendientes.values():
+            llamada.futuro.set_exception(RuntimeError('El grupo de trabajadores se cerró antes de terminar'))
+        if self._recolector is not None:
+            self._recolector.join(timeout=5)
+        for trabajador in self._trabajadores:
+            if trabajador.proceso.is_alive():
+                trabajador.tareas.put(None)
+        for trabajador in self._trabajadores:
+            trabajador.proceso.join(timeout=5)
+            if trabajador.proceso.is_alive():
+                trabajador.proceso.terminate()
+
+
+_pool = None
+_lock_pool = threading.Lock()
+
+
+def obtener_pool():
+    """Retorna el grupo de trabajadores del proceso (se crea la primera vez y se reutiliza)."""
+    global _pool
+    with _lock_pool:
+        if _pool is None:
+            _pool = PoolProcesamiento()
+            atexit.register(cerrar_pool)
+    return _pool
+
+
+def cerrar_pool():
+    global _pool
+    with _lock_pool:
+        if _pool is not None:
+            _pool.cerrar()
+            _pool = None
+
+
+def estadisticas_pool():
+    return _pool.estadisticas() if _pool is not None else None
+
+
+if __name__ == '__main__':
+    import main_procesamiento
+    import algoritmos_busqueda as ab
+    archivos = ab.buscar_archivos_por_nombre(main_procesamiento.carpeta_csv, main_procesamiento.prefijo_busqueda)
+    inicio = time.perf_counter()
+    for registro in obtener_pool().procesar_archivos(archivos, main_procesamiento.carpeta_csv):
+        print(registro['archivo'], registro['status'], registro['segmentos'], registro['error'] or '')
+    print(f'{len(archivos)} archivos en {time.perf_counter() - inicio:.1f} s', file=sys.stderr)
@@ -0,0 +1,275 @@
+"""
+Métricas de rugosidad por segmento (IRI, IRI modificado, IQR, az, ax, wx) y detección de huecos.
+
+Reemplaza los valores np.random.randint que se ponían en el JSON. Todo se calcula
+sobre los arreglos del viaje completo (una muestra por fila del CSV) y se
+reduce por segmento con np.bincount / np.lexsort; no hay bucles de Python por
+segmento ni por muestra.
+
+Cadena de filtros (la que estaba comentada en csv_processing_main con firwin + lfilter):
+- gyro_x: pasa bajos 6 Hz
+- acc_x: pasa bajos 10 Hz y pasa altos 1 Hz
+- acc_z: pasa bajos 3 Hz; además se le resta la media móvil de 1 s (gravedad e inclinación)
+
+Los FIR (ventana de Hamming, como firwin) se diseñan una vez por
+(frecuencia de corte, frecuencia de muestreo) y quedan en cache. Se aplican
+centrados (np.convolve 'same' con un número impar de coeficientes), que es
+lfilter compensando el retardo de grupo, para que las muestras no se corran
+hacia el segmento siguiente.
+
+Métricas por segmento (muestras de los fixes GPS asignados al segmento):
+- az, ax, wx: valor RMS de cada señal filtrada
+- IQR: rango intercuartil de az
+- iri: estimación del IRI en m/km, desplazamiento vertical acumulado (integral
+  de |velocidad vertical|, obtenida integrando az) por distancia recorrida
+  (integral de la velocidad GPS). No está calibrada por vehículo
+- IRI_modificado: RMS(az) / velocidad_media² × 1000 (1/km), indicador que no
+  depende de la integración
+- huecos: picos de |az| sobre UMBRAL_HUECO (m/s²); los picos a menos de
+  SEPARACION_HUECOS segundos se agrupan en un evento
+"""
+import os
+from functools import lru_cache
+
+import numpy as np
+
+FRECUENCIA_DEFECTO = 100.0  # Hz, si no se puede estimar de los datos ni de los metadatos
+DURACION_FIR = 1.0  # s, longitud de los FIR
+CORTE_WX = 6.0
+CORTE_AX = 10.0
+CORTE_PASA_ALTOS_AX = 1.0
+CORTE_AZ = 3.0
+VENTANA_BASE = 1.0  # s, media móvil que se resta a az y a la velocidad vertical
+UMBRAL_HUECO = float(os.getenv('RECWAY_UMBRAL_HUECO', '3.0'))
+SEPARACION_HUECOS = 0.5  # s
+
+METRICAS = ('iri', 'IRI_modificado', 'IQR', 'az', 'ax', 'wx')
+COLUMNAS_NECESARIAS = ('acc_x', 'acc_z', 'gyro_x')
+
+
+@lru_cache(maxsize=64)
+def disenar_fir(frecuencia_corte, frecuencia_muestreo, pasa_altos=False):
+    """
+    Coeficientes de un FIR de fase lineal (sinc con ventana de Hamming, ganancia 1 en la banda de paso).
+
+    Returns:
+        np.ndarray de solo lectura, o None si la frecuencia de corte no es menor que Nyquist
+        (el filtro no aplica y la señal se usa sin filtrar).
+    """
+    if frecuencia_corte >= frecuencia_muestreo / 2:
+        return None
+    cantidad = 2 * int(frecuencia_muestreo * DURACION_FIR / 2) + 1
+    n = np.arange(cantidad) - (cantidad - 1) / 2
+    coeficientes = np.sinc(2 * frecuencia_corte / frecuencia_muestreo * n) * np.hamming(cantidad)
+    coeficientes /= coeficientes.sum()
+    if pasa_altos:
+        # Inversión espectral: delta - pasa bajos
+        coeficientes = -coeficientes
+        coeficientes[(cantidad - 1) // 2] += 1
+    coeficientes.setflags(write=False)
+    return coeficientes
+
+
+def filtrar(senal, coeficientes):
+    """Aplica el FIR centrado (sin retardo). coeficientes=None deja la señal igual."""
+    senal = np.asarray(senal, dtype=np.float64)
+    if coeficientes is None or len(senal) == 0:
+        return senal
+    if len(senal) < len(coeficientes):
+        # np.convolve 'same' devuelve max(N, M) muestras
+        return np.convolve(senal, coeficientes, mode='full')[(len(coeficientes) - 1) // 2:][:len(senal)]
+    return np.convolve(senal, coeficientes, mode='same')
+
+
+def media_movil(senal, ventana):
+    """Media móvil centrada de 'ventana' muestras (en los bordes, con las muestras disponibles)."""
+    n = len(senal)
+    acumulada = np.concatenate(([0.0], np.cumsum(senal, dtype=np.float64)))
+    mitad = max(int(ventana), 1) // 2
+    posiciones = np.arange(n)
+    inicio = np.maximum(posiciones - mitad, 0)
+    fin = np.minimum(posiciones + mitad + 1, n)
+    return (acumulada[fin] - acumulada[inicio]) / (fin - inicio)
+
+
+def frecuencia_muestreo(viaje):
+    """
+    Frecuencia de muestreo de los sensores (Hz): filas del archivo entre fixes GPS
+    dividido por el tiempo entre ellos (mediana), o 'sampling_rate' de los metadatos.
+    """
+    if viaje.muestra_inicial is not None and len(viaje) > 1:
+        orden = np.argsort(viaje.muestra_inicial)
+        filas = np.diff(viaje.muestra_inicial[orden])
+        tiempo = np.diff(viaje.timestamp[orden])
+        validos = tiempo > 0
+        if np.any(validos):
+            return float(np.median(filas[validos] * 1000.0 / tiempo[validos]))
+    try:
+        return float(viaje.metadatos['sampling_rate'])
+    except (KeyError, TypeError, ValueError):
+        return FRECUENCIA_DEFECTO
+
+
+def _muestras_por_segmento(viaje, indices_iniciales, cantidad_filas):
+    """
+    Filas del archivo de cada segmento.
+
+    Returns:
+        (filas, fix, segmento): por cada fila cubierta, el fix (índice en el viaje) y el
+        segmento al que pertenece; las filas de fixes anteriores al primer segmento se omiten.
+    """
+    n = len(viaje)
+    segmento_fix = np.searchsorted(indices_iniciales, np.arange(n), side='right') - 1
+    inicio = np.minimum(viaje.muestra_inicial, cantidad_filas)
+    largo = np.maximum(np.minimum(viaje.muestra_final, cantidad_filas) - inicio, 0)
+    largo[segmento_fix < 0] = 0
+    fix = np.repeat(np.arange(n), largo)
+    filas = np.repeat(inicio - (np.cumsum(largo) - largo), largo) + np.arange(int(largo.sum()))
+    return filas, fix, segmento_fix[fix]
+
+
+def _cuantil_por_grupo(ordenados, inicio, conteo, q):
+    """Cuantil q (interpolación lineal, como np.percentile) de cada grupo de valores ya ordenados."""
+    resultado = np.full(len(conteo), np.nan)
+    hay = conteo > 0
+    posicion = inicio[hay] + q * (conteo[hay] - 1)
+    bajo = np.floor(posicion).astype(np.int64)
+    alto = np.minimum(bajo + 1, inicio[hay] + conteo[hay] - 1)
+    fraccion = posicion - bajo
+    resultado[hay] = ordenados[bajo] * (1 - fraccion) + ordenados[alto] * fraccion
+    return resultado
+
+
+class MetricasSegmentos:
+    """
+    Métricas por segmento: arreglos de longitud 'cantidad' en metricas[nombre]
+    (NaN si el segmento no tiene muestras).
+
+    Huecos en arreglos planos ordenados por segmento: los del segmento s son las
+    posiciones [desplazamientos_huecos[s], desplazamientos_huecos[s + 1]) de
+    huecos_latitud, huecos_longitud, huecos_magnitud y huecos_velocidad.
+    """
+
+    def __init__(self, cantidad):
+        self.metricas = {nombre: np.full(cantidad, np.nan) for nombre in METRICAS}
+        self.desplazamientos_huecos = np.zeros(cantidad + 1, dtype=np.int64)
+        self.huecos_latitud = np.empty(0, dtype=np.float64)
+        self.huecos_longitud = np.empty(0, dtype=np.float64)
+        self.huecos_magnitud = np.empty(0, dtype=np.float64)
+        self.huecos_velocidad = np.empty(0, dtype=np.float64)
+        self.frecuencia_muestreo = None
+
+    def __len__(self):
+        return len(self.desplazamientos_huecos) - 1
+
+    def valores(self, segmento):
+        """dict de métricas del segmento listo para JSON (None en lugar de NaN)."""
+        return {nombre: valor_json(valores[segmento]) for nombre, valores in self.metricas.items()}
+
+    def huecos(self, segmento):
+        """Lista de dicts {'latitud', 'longitud', 'magnitud', 'velocidad'} del segmento."""
+        inicio, fin = self.desplazamientos_huecos[segmento], self.desplazamientos_huecos[segmento + 1]
+        return [
+            {'latitud': latitud, 'longitud': longitud, 'magnitud': round(magnitud, 4), 'velocidad': round(velocidad, 4)}
+            for latitud, longitud, magnitud, velocidad in zip(
+                self.huecos_latitud[inicio:fin].tolist(), self.huecos_longitud[inicio:fin].tolist(),
+                self.huecos_magnitud[inicio:fin].tolist(), self.huecos_velocidad[inicio:fin].tolist()
+            )
+        ]
+
+
+def valor_json(valor):
+    """Métrica redondeada a 4 decimales, o None si es NaN."""
+    valor = float(valor)
+    return None if np.isnan(valor) else round(valor, 4)
+
+
+def metricas_segmentos(viaje, indices_iniciales, frecuencia=None):
+    """
+    Calcula las métricas de todos los segmentos de un viaje.
+
+    Args:
+        viaje (contexto_viaje.ContextoViaje): con senales, muestra_inicial y muestra_final.
+        indices_iniciales: índice (en el viaje) del primer fix de cada segmento, en orden
+            creciente; cada segmento termina en el fix anterior al inicio del siguiente.
+        frecuencia (float): frecuencia de muestreo en Hz; por defecto se estima del viaje
+            (streaming la fija para toda la sesión, cada tramo tiene pocos fixes).
+
+    Returns:
+        MetricasSegmentos (todo NaN y sin huecos si el viaje no tiene señales).
+    """
+    indices_iniciales = np.asarray(indices_iniciales, dtype=np.int64)
+    cantidad = len(indices_iniciales)
+    resultado = MetricasSegmentos(cantidad)
+    if cantidad == 0 or viaje.muestra_inicial is None or any(c not in viaje.senales for c in COLUMNAS_NECESARIAS):
+        return resultado
+    fs = frecuencia or frecuencia_muestreo(viaje)
+    resultado.frecuencia_muestreo = fs
+    ventana = int(round(VENTANA_BASE * fs))
+
+    az = filtrar(viaje.senales['acc_z'], disenar_fir(CORTE_AZ, fs))
+    az = az - media_movil(az, ventana)
+    ax = filtrar(viaje.senales['acc_x'], disenar_fir(CORTE_AX, fs))
+    ax = filtrar(ax, disenar_fir(CORTE_PASA_ALTOS_AX, fs, pasa_altos=True))
+    wx = filtrar(viaje.senales['gyro_x'], disenar_fir(CORTE_WX, fs))
+    velocidad_vertical = np.cumsum(az) / fs
+    velocidad_vertical -= media_movil(velocidad_vertical, ventana)
+
+    filas, fix, segmento = _muestras_por_segmento(viaje, indices_iniciales, len(az))
+    conteo = np.bincount(segmento, minlength=cantidad)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for nombre, senal in (('az', az), ('ax', ax), ('wx', wx)):
+            resultado.metricas[nombre] = np.sqrt(np.bincount(segmento, senal[filas] ** 2, cantidad) / conteo)
+        velocidad = viaje.velocidad[fix]
+        distancia = np.bincount(segmento, velocidad, cantidad) / fs
+        desplazamiento = np.bincount(segmento, np.abs(velocidad_vertical[filas]), cantidad) / fs
+        resultado.metricas['iri'] = np.where(distancia > 0, 1000 * desplazamiento / distancia, np.nan)
+        velocidad_media = distancia * fs / conteo
+        resultado.metricas['IRI_modificado'] = np.where(
+            velocidad_media > 0, 1000 * resultado.metricas['az'] / velocidad_media ** 2, np.nan
+        )
+
+    # IQR: una sola ordenación por (segmento, valor) de todas las muestras
+    valores_az = az[filas]
+    ordenados = valores_az[np.lexsort((valores_az, segmento))]
+    inicio = np.cumsum(conteo) - conteo
+    resultado.metricas['IQR'] = (
+        _cuantil_por_grupo(ordenados, inicio, conteo, 0.75) - _cuantil_por_grupo(ordenados, inicio, conteo, 0.25)
+    )
+
+    _detectar_huecos(resultado, viaje, az, filas, fix, segmento, fs)
+    return resultado
+
+
+def _detectar_huecos(resultado, viaje, az, filas, fix, segmento, fs):
+    magnitud = np.abs(az)
+    sobre_umbral = np.flatnonzero(magnitud > UMBRAL_HUECO)  # filas en orden del archivo
+    if len(sobre_umbral) == 0:
+        return
+    # Fix y segmento de cada fila del archivo (-1 si la fila no pertenece a ningún segmento)
+    fix_fila = np.full(len(az), -1, dtype=np.int64)
+    fix_fila[filas] = fix
+    segmento_fila = np.full(len(az), -1, dtype=np.int64)
+    segmento_fila[filas] = segmento
+    # Eventos: filas sobre el umbral separadas por menos de SEPARACION_HUECOS
+    cortes = np.flatnonzero(np.diff(sobre_umbral) > SEPARACION_HUECOS * fs) + 1
+    inicios = np.concatenate(([0], cortes))
+    maximos = np.maximum.reduceat(magnitud[sobre_umbral], inicios)
+    evento = np.repeat(np.arange(len(inicios)), np.diff(np.append(inicios, len(sobre_umbral))))
+    es_pico = magnitud[sobre_umbral] == maximos[evento]
+    _, primero = np.unique(evento[es_pico], return_index=True)
+    picos = sobre_umbral[np.flatnonzero(es_pico)[primero]]
+    segmento_pico = segmento_fila[picos]
+    validos = segmento_pico >= 0
+    picos, maximos, segmento_pico = picos[validos], maximos[validos], segmento_pico[validos]
+    # Orden estable por segmento: dentro de cada segmento los huecos quedan en orden del archivo
+    orden = np.argsort(segmento_pico, kind='stable')
+    picos, maximos, segmento_pico = picos[orden], maximos[orden], segmento_pico[orden]
+    fix_pico = fix_fila[picos]
+    resultado.huecos_latitud = viaje.latitud[fix_pico]
+    resultado.huecos_longitud = viaje.longitud[fix_pico]
+    resultado.huecos_magnitud = maximos
+    resultado.huecos_velocidad = viaje.velocidad[fix_pico]
+    resultado.desplazamientos_huecos = np.concatenate(
+        ([0], np.cumsum(np.bincount(segmento_pico, minlength=len(resultado))))
+    ).astype(np.int64)
@@ -0,0 +1,115 @@
+"""
+Puntos de control del emparejamiento de un viaje (reanudación tras una caída).
+
+Si el proceso moría a mitad de un viaje largo (timeout, trabajador reemplazado,
+instancia interrumpida) el reintento emparejaba la trayectoria desde la fila 0.
+Con un PuntoControl, emparejamiento_lote guarda cada 'intervalo' muestras un
+bloque con:
+- Las filas [desde, hasta) del ResultadoEmparejamiento (arista, subsegmento,
+  cambio y proyección de cada muestra) y los segmentos emitidos en ese rango
+- El estado del emparejador en 'hasta' (tesela, arista actual y subsegmento)
+
+Cada bloque es un archivo propio (uploads/puntos_control/<archivo>/<desde>.pkl,
+escritura atómica), así el costo de guardar es proporcional al bloque y no al
+viaje. Al reintentar se cargan los bloques consecutivos cuya huella coincide con
+la trayectoria actual (mismas muestras, L y segmento_maximo) y se continúa desde
+el último; al terminar el archivo main_procesamiento los descarta.
+
+Configuración por variables de entorno:
+- RECWAY_PUNTO_CONTROL_MUESTRAS: muestras por bloque (defecto 50000; 0 desactiva)
+"""
+import os
+import pickle
+import shutil
+import hashlib
+
+import numpy as np
+
+import serializacion as sr
+
+VERSION = 1
+ARREGLOS = ('indice_arista', 'aristas', 'posicion_subsegmento', 'cambio', 'punto_proyectado')
+
+
+def intervalo_muestras():
+    return int(os.getenv('RECWAY_PUNTO_CONTROL_MUESTRAS', '50000'))
+
+
+def habilitado():
+    return intervalo_muestras() > 0
+
+
+def huella_trayectoria(latitudes, longitudes, headings, L, segmento_maximo):
+    """Identifica la entrada del emparejamiento: un bloque solo sirve para la misma trayectoria y parámetros."""
+    resumen = hashlib.blake2b(digest_size=16)
+    for arreglo in (latitudes, longitudes, headings):
+        resumen.update(np.ascontiguousarray(arreglo, dtype=np.float64).tobytes())
+    resumen.update(repr((float(L), float(segmento_maximo), VERSION)).encode())
+    return resumen.hexdigest()
+
+
+class PuntoControl:
+    """Bloques guardados del emparejamiento de un archivo."""
+
+    def __init__(self, carpeta, nombre_archivo, intervalo=None):
+        self.carpeta = os.path.join(carpeta, nombre_archivo)
+        self.intervalo = intervalo or intervalo_muestras()
+        self.huella = None
+
+    def _bloques(self):
+        if not os.path.isdir(self.carpeta):
+            return []
+        return sorted(n for n in os.listdir(self.carpeta) if n.endswith('.pkl'))
+
+    def restaurar(self, huella, resultado):
+        """
+        Copia en 'resultado' los bloques guardados para esta huella.
+
+        Returns:
+            (hasta, estado): fila desde la que se continúa (0 si no hay bloques válidos) y
+            el dict de estado del emparejador guardado con el último bloque (None si hasta es 0).
+        """
+        self.huella = huella
+        hasta, estado = 0, None
+        bloques = self._bloques()
+        for posicion, nombre in enumerate(bloques):
+            try:
+                with open(os.path.join(self.carpeta, nombre), 'rb') as archivo:
+                    bloque = pickle.load(archivo)
+            except Exception as e:
+                print(f'[puntos_control] bloque {nombre} ilegible: {e}')
+                bloque = None
+            if bloque is None or bloque.get('version') != VERSION or bloque['huella'] != huella or bloque['desde'] != hasta:
+                # Desde aquí la cadena no sirve (otra trayectoria, otro intervalo o bloque dañado)
+                for sobrante in bloques[posicion:]:
+                    os.remove(os.path.join(self.carpeta, sobrante))
+                break
+            desde, hasta = bloque['desde'], bloque['hasta']
+            for campo in ARREGLOS:
+                getattr(resultado, campo)[desde:hasta] = bloque['arreglos'][campo]
+            resultado.subsegmentos.update(bloque['subsegmentos'])
+            resultado.info_aristas.update(bloque['info_aristas'])
+            estado = bloque['estado']
+        if hasta > 0:
+            print(f'[puntos_control] {os.path.basename(self.carpeta)}: se continúa desde la muestra {hasta}')
+        return hasta, estado
+
+    def guardar(self, resultado, estado, desde, hasta):
+        """Guarda las filas [desde, hasta) de 'resultado' y el estado del emparejador en 'hasta'."""
+        if hasta <= desde:
+            return
+        cambios = (np.flatnonzero(resultado.cambio[desde:hasta]) + desde).tolist()
+        bloque = {
+            'version': VERSION,
+            'huella': self.huella,
+            'desde': desde,
+            'hasta': hasta,
+            'arreglos': {campo: getattr(resultado, campo)[desde:hasta] for campo in ARREGLOS},
+            'subsegmentos': {k: resultado.subsegmentos[k] for k in cambios if k in resultado.subsegmentos},
+            'info_aristas': {k: resultado.info_aristas[k] for k in cambios if k in resultado.info_aristas},
+            'estado': estado,
+        }
+        sr.escribir(os.path.join(self.carpeta, f'{desde:012d}.pkl'), pickle.dumps(bloque, pickle.HIGHEST_PROTOCOL))
+
+    def descartar(self):
+        shutil.rmtree(self.carpeta, ignore_errors=True)
@@ -0,0 +1,264 @@
+"""
+Registro persistente de archivos procesados, por contenido (sha256).
+
+El file watcher solo recordaba en memoria las rutas ya vistas: se perdía al
+reiniciar y un viaje subido dos veces (upload lo guarda como RecWay_x_1.csv) se
+procesaba completo otra vez. Aquí cada contenido distinto es una fila de una base
+SQLite (uploads/registro_archivos.sqlite3, modo WAL para varios procesos del mismo
+equipo) con su estado, tiempos y archivos de salida:
+- reclamar: antes de procesar, marca el contenido 'en_proceso'. Si ya estaba
+  'completado' (o lo está procesando otro proceso) retorna ese registro y el
+  archivo no se procesa; un 'fallido', un 'en_proceso' sin latido por más de
+  RECWAY_LATIDO_MAXIMO segundos (proceso caído) o el reintento del mismo archivo
+  lo vuelven a reclamar
+- Latido: mientras procesa, el proceso que reclamó renueva latido_en cada
+  INTERVALO_LATIDO segundos, así un viaje de varias horas no se da por abandonado
+- completar / fallar: resultado del procesamiento
+- Cada nombre de archivo con el que llegó un contenido queda en la tabla nombres
+  (buscar_por_nombre)
+
+No depende de la base de datos PostgreSQL, así que funciona en todos los modos
+(cola de trabajos, pool de procesos o hilos del file watcher).
+
+Configuración por variables de entorno:
+- RECWAY_REGISTRO_ARCHIVOS: '1' (defecto) activa el registro; '0' procesa siempre
+- RECWAY_LATIDO_MAXIMO: segundos sin latido para considerar abandonado un 'en_proceso'
+  (defecto 120, como en cola_trabajos)
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+TAMANO_BLOQUE = 1024 * 1024
+ESTADOS = ('en_proceso', 'completado', 'fallido')
+LATIDO_MAXIMO = float(os.getenv('RECWAY_LATIDO_MAXIMO', '120'))
+INTERVALO_LATIDO = 15.0
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS archivos (
+    sha256 TEXT PRIMARY KEY,
+    archivo TEXT NOT NULL,
+    bytes INTEGER,
+    estado TEXT NOT NULL,
+    segmentos INTEGER,
+    salida TEXT,
+    almacenamiento TEXT,
+    ruta_csv TEXT,
+    error TEXT,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    duplicados INTEGER NOT NULL DEFAULT 0,
+    creado_en REAL NOT NULL,
+    iniciado_en REAL,
+    latido_en REAL,
+    terminado_en REAL,
+    duracion REAL
+);
+CREATE TABLE IF NOT EXISTS nombres (
+    archivo TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    registrado_en REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_nombres_sha256 ON nombres (sha256);
+CREATE INDEX IF NOT EXISTS idx_archivos_creado ON archivos (creado_en);
+"""
+
+_inicializadas = set()
+
+
+def habilitado():
+    return os.getenv('RECWAY_REGISTRO_ARCHIVOS', '1') == '1'
+
+
+def huella_archivo(ruta):
+    """
+    sha256 del contenido, leído por bloques.
+
+    Returns:
+        (sha256, bytes)
+    """
+    resumen = hashlib.sha256()
+    total = 0
+    with open(ruta, 'rb') as archivo:
+        while bloque := archivo.read(TAMANO_BLOQUE):
+            resumen.update(bloque)
+            total += len(bloque)
+    return resumen.hexdigest(), total
+
+
+def conectar(ruta_registro):
+    # Conexión en autocommit: las transacciones se abren explícitamente con BEGIN IMMEDIATE
+    conexion = sqlite3.connect(ruta_registro, timeout=30, isolation_level=None)
+    conexion.row_factory = sqlite3.Row
+    if ruta_registro not in _inicializadas:
+        os.makedirs(os.path.dirname(ruta_registro) or '.', exist_ok=True)
+        conexion.execute('PRAGMA journal_mode=WAL')
+        conexion.executescript(ESQUEMA)
+        columnas = {fila['name'] for fila in conexion.execute('PRAGMA table_info(archivos)')}
+        if 'latido_en' not in columnas:
+            # Registro creado antes del latido
+            conexion.execute('ALTER TABLE archivos ADD COLUMN latido_en REAL')
+        _inicializadas.add(ruta_registro)
+    return conexion
+
+
+def _ejecutar(ruta_registro, sql, parametros=(), todas=False):
+    conexion = conectar(ruta_registro)
+    try:
+        cursor = conexion.execute(sql, parametros)
+        return [dict(f) for f in cursor.fetchall()] if todas else _dict(cursor.fetchone())
+    finally:
+        conexion.close()
+
+
+def _dict(fila):
+    return dict(fila) if fila is not None else None
+
+
+def reclamar(ruta_registro, sha256, nombre_archivo, tamano, vigencia=None):
+    """
+    Marca el contenido como 'en_proceso' para este proceso (luego hay que mantener su Latido).
+
+    Args:
+        vigencia: segundos sin latido tras los cuales un 'en_proceso' se considera
+            abandonado (defecto LATIDO_MAXIMO).
+
+    Returns:
+        None si se reclamó (hay que procesarlo), o el registro existente si el
+        contenido ya está 'completado' o lo está procesando otro proceso.
+    """
+    vigencia = LATIDO_MAXIMO if vigencia is None else vigencia
+    ahora = time.time()
+    conexion = conectar(ruta_registro)
+    try:
+        conexion.execute('BEGIN IMMEDIATE')
+        fila = _dict(conexion.execute('SELECT * FROM archivos WHERE sha256 = ?', (sha256,)).fetchone())
+        conexion.execute(
+            'INSERT OR REPLACE INTO nombres (archivo, sha256, registrado_en) VALUES (?, ?, ?)',
+            (nombre_archivo, sha256, ahora)
+        )
+        # Un 'en_proceso' con el mismo nombre es un reintento del mismo archivo (el anterior cayó)
+        vigente = fila is not None and (
+            fila['estado'] == 'completado'
+            or (fila['estado'] == 'en_proceso' and fila['archivo'] != nombre_archivo
+                and ahora - (fila['latido_en'] or fila['iniciado_en'] or 0) < vigencia)
+        )
+        if vigente:
+            if fila['estado'] == 'completado' and fila['archivo'] != nombre_archivo:
+                conexion.execute('UPDATE archivos SET duplicados = duplicados + 1 WHERE sha256 = ?', (sha256,))
+            conexion.execute('COMMIT')
+            return fila
+        conexion.execute(
+            """
+            INSERT INTO archivos (sha256, archivo, bytes, estado, intentos, creado_en, iniciado_en, latido_en)
+            VALUES (?, ?, ?, 'en_proceso', 1, ?, ?, ?)
+            ON CONFLICT (sha256) DO UPDATE SET
+                archivo = excluded.archivo, estado = 'en_proceso', intentos = intentos + 1, error = NULL,
+                iniciado_en = excluded.iniciado_en, latido_en = excluded.latido_en, terminado_en = NULL, duracion = NULL
+            """,
+            (sha256, nombre_archivo, tamano, ahora, ahora, ahora)
+        )
+        conexion.execute('COMMIT')
+        return None
+    except BaseException:
+        if conexion.in_transaction:
+            conexion.execute('ROLLBACK')
+        raise
+    finally:
+        conexion.close()
+
+
+def latido(ruta_registro, sha256):
+    _ejecutar(
+        ruta_registro,
+        "UPDATE archivos SET latido_en = ? WHERE sha256 = ? AND estado = 'en_proceso'",
+        (time.time(), sha256)
+    )
+
+
+class Latido(threading.Thread):
+    """Renueva el latido del contenido reclamado mientras se procesa (detener() al terminar)."""
+
+    def __init__(self, ruta_registro, sha256, intervalo=INTERVALO_LATIDO):
+        super().__init__(name=f'latido-registro-{sha256[:8]}', daemon=True)
+        self.ruta_registro = ruta_registro
+        self.sha256 = sha256
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+
+    def run(self):
+        while not self._detener.wait(self.intervalo):
+            try:
+                latido(self.ruta_registro, self.sha256)
+            except Exception as e:
+                print(f'[registro_archivos][ERROR] latido de {self.sha256[:12]}: {e}')
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+
+def completar(ruta_registro, sha256, segmentos, salida=None, almacenamiento=None, ruta_csv=None):
+    """Registra el resultado: cantidad de segmentos y archivos de salida (nombres) del viaje."""
+    ahora = time.time()
+    _ejecutar(
+        ruta_registro,
+        """
+        UPDATE archivos SET estado = 'completado', segmentos = ?, salida = ?, almacenamiento = ?,
+            ruta_csv = ?, terminado_en = ?, duracion = ? - iniciado_en
+        WHERE sha256 = ?
+        """,
+        (segmentos, salida, almacenamiento, ruta_csv, ahora, ahora, sha256)
+    )
+
+
+def fallar(ruta_registro, sha256, error):
+    ahora = time.time()
+    _ejecutar(
+        ruta_registro,
+        "UPDATE archivos SET estado = 'fallido', error = ?, terminado_en = ?, duracion = ? - iniciado_en "
+        "WHERE sha256 = ?",
+        (str(error)[:2000], ahora, ahora, sha256)
+    )
+
+
+def buscar(ruta_registro, sha256):
+    return _ejecutar(ruta_registro, 'SELECT * FROM archivos WHERE sha256 = ?', (sha256,))
+
+
+def buscar_por_nombre(ruta_registro, nombre_archivo):
+    """Registro del contenido con el que llegó el archivo 'nombre_archivo' (None si no se registró)."""
+    return _ejecutar(
+        ruta_registro,
+        'SELECT a.* FROM nombres n JOIN archivos a ON a.sha256 = n.sha256 WHERE n.archivo = ?',
+        (nombre_archivo,)
+    )
+
+
+def listar(ruta_registro, estado=None, limite=100):
+    """Registros más recientes primero, opcionalmente filtrados por estado."""
+    if estado is not None and estado not in ESTADOS:
+        raise ValueError(f"Estado no válido: {estado} (opciones: {', '.join(ESTADOS)})")
+    return _ejecutar(
+        ruta_registro,
+        'SELECT * FROM archivos WHERE ? IS NULL OR estado = ? ORDER BY creado_en DESC LIMIT ?',
+        (estado, estado, limite), todas=True
+    )
+
+
+def limpiar(ruta_registro):
+    """Borra el registro (cuando se borran los resultados). Returns: cantidad de contenidos borrados."""
+    conexion = conectar(ruta_registro)
+    try:
+        conexion.execute('BEGIN IMMEDIATE')
+        cantidad = conexion.execute('DELETE FROM archivos').rowcount
+        conexion.execute('DELETE FROM nombres')
+        conexion.execute('COMMIT')
+        return cantidad
+    except BaseException:
+        if conexion.in_transaction:
+            conexion.execute('ROLLBACK')
+        raise
+    finally:
+        conexion.close()
@@ -0,0 +1,127 @@
+"""
+Resultado de un viaje procesado en arreglos (estructura de arreglos).
+
+Antes cada segmento era un dict con la lista 'geometria' de un dict por vértice
+({'orden', 'longitud', 'latitud'}) y la lista de dicts 'huecos'; un viaje largo
+creaba cientos de miles de objetos pequeños que además se copiaban entre
+procesos (pool_procesamiento). ResultadoViaje guarda:
+- Un arreglo por campo de los segmentos (id, longitud, timestamp, métricas...)
+- Los vértices de todos los segmentos en un solo arreglo (V, 2) [lon, lat] con
+  desplazamientos: los del segmento i son vertices[desplazamientos_vertices[i]:desplazamientos_vertices[i + 1]]
+- Los huecos igual, en arreglos planos con desplazamientos
+
+Los dicts del formato JSON de siempre se crean solo al serializar (a_dicts / segmento).
+"""
+import numpy as np
+
+import algoritmos_posicinamiento as ap
+import procesamiento_senales as ps
+
+VALOR_NOMBRE_DEFECTO = 'Undefined'
+VALOR_TIPO_DEFECTO = 'unknown'
+CAMPOS_METRICAS = ('IQR', 'iri', 'IRI_modificado', 'az', 'ax', 'wx')  # orden de los campos en el JSON
+
+
+class ResultadoViaje:
+    """
+    Segmentos de un viaje:
+    - ids (uint64, ap.hash_segmento), nombres y tipos (listas; OSM puede dar listas de nombres)
+    - longitudes (m), puntos_iniciales (índice de la muestra en el viaje), timestamps (ms)
+    - vertices (V, 2) y desplazamientos_vertices (S + 1)
+    - metricas (ps.MetricasSegmentos): métricas por segmento y huecos en arreglos planos
+    """
+
+    def __init__(self, nombre_archivo, ids, nombres, tipos, longitudes, puntos_iniciales, timestamps,
+                 vertices, desplazamientos_vertices, metricas=None):
+        cantidad = len(ids)
+        self.nombre_archivo = nombre_archivo
+        self.ids = np.asarray(ids, dtype=np.uint64)
+        self.nombres = list(nombres)
+        self.tipos = list(tipos)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.puntos_iniciales = np.asarray(puntos_iniciales, dtype=np.int64)
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+        self.desplazamientos_vertices = np.asarray(desplazamientos_vertices, dtype=np.int64)
+        self.metricas = metricas if metricas is not None else ps.MetricasSegmentos(cantidad)
+        self.duplicado_de = None  # registro_archivos del contenido ya procesado si no se reprocesó
+
+    @classmethod
+    def vacio(cls, nombre_archivo=None):
+        return cls(nombre_archivo, [], [], [], [], [], [], np.empty((0, 2)), [0])
+
+    @classmethod
+    def desde_emparejamiento(cls, viaje, emparejamiento, metricas=None):
+        """
+        Construye el resultado a partir del emparejamiento en lote (un segmento por cada
+        muestra con cambio) y de las métricas de procesamiento_senales.
+        """
+        inicios = np.flatnonzero(emparejamiento.cambio)
+        aristas = emparejamiento.aristas[inicios]
+        ids = ap.hash_segmentos(
+            aristas[:, 0], aristas[:, 1], emparejamiento.posicion_subsegmento[inicios] * 1000 + aristas[:, 2]
+        )
+        nombres, tipos, longitudes, coordenadas = [], [], [], []
+        for i in inicios.tolist():
+            info_edge = emparejamiento.info_aristas[i]
+            coordenadas_subsegmento, longitud_subsegmento = emparejamiento.subsegmentos[i]
+            nombres.append(info_edge['name'] if info_edge['name'] is not None else VALOR_NOMBRE_DEFECTO)
+            tipos.append(info_edge['highway'] if info_edge['highway'] is not None else VALOR_TIPO_DEFECTO)
+            longitudes.append(longitud_subsegmento)
+            coordenadas.append(np.asarray(coordenadas_subsegmento, dtype=np.float64).reshape(-1, 2))
+        largos = [len(c) for c in coordenadas]
+        vertices = np.concatenate(coordenadas) if coordenadas else np.empty((0, 2))
+        desplazamientos = np.concatenate(([0], np.cumsum(largos, dtype=np.int64)))
+        if metricas is None:
+            metricas = ps.metricas_segmentos(viaje, inicios)
+        return cls(
+            viaje.nombre_archivo, ids, nombres, tipos, longitudes, inicios, viaje.timestamp[inicios],
+            vertices, desplazamientos, metricas
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def geometria(self, i):
+        """Vértices (lon, lat) del segmento i (vista, sin copiar)."""
+        return self.vertices[self.desplazamientos_vertices[i]:self.desplazamientos_vertices[i + 1]]
+
+    def fechas(self):
+        """Fecha ISO 8601 de inicio de cada segmento (hora local, como ap.timestamp_a_iso8601)."""
+        return [ap.timestamp_a_iso8601(t) for t in self.timestamps.tolist()]
+
+    def nbytes(self):
+        """Memoria aproximada de los arreglos del resultado."""
+        m = self.metricas
+        arreglos = [self.ids, self.longitudes, self.puntos_iniciales, self.timestamps, self.vertices,
+                    self.desplazamientos_vertices, m.desplazamientos_huecos, m.huecos_latitud,
+                    m.huecos_longitud, m.huecos_magnitud, m.huecos_velocidad, *m.metricas.values()]
+        return sum(a.nbytes for a in arreglos)
+
+    def segmento(self, i, fecha=None):
+        """dict del segmento i en el formato JSON de procesar_archivo_especifico."""
+        vertices = self.geometria(i).tolist()
+        geometria = [{'orden': j, 'longitud': lon, 'latitud': lat} for j, (lon, lat) in enumerate(vertices)]
+        datos = {
+            'numero': i,
+            'id': int(self.ids[i]),
+            'nombre': self.nombres[i],
+            'longitud': float(self.longitudes[i]),
+            'tipo': self.tipos[i],
+            'latitud_origen': vertices[0][1],
+            'latitud_destino': vertices[-1][1],
+            'longitud_origen': vertices[0][0],
+            'longitud_destino': vertices[-1][0],
+            'geometria': geometria,
+            'fecha': fecha if fecha is not None else ap.timestamp_a_iso8601(int(self.timestamps[i])),
+        }
+        valores = self.metricas.valores(i)
+        for nombre in CAMPOS_METRICAS:
+            datos[nombre] = valores[nombre]
+        datos['huecos'] = self.metricas.huecos(i)
+        return datos
+
+    def a_dicts(self):
+        """Lista de dicts (formato JSON) de todos los segmentos; solo para serializar."""
+        fechas = self.fechas()
+        return [self.segmento(i, fechas[i]) for i in range(len(self))]
@@ -0,0 +1,262 @@
+"""
+Serialización de los resultados de viaje a JSON.
+
+Cada viaje se escribía dos veces con json.dump(..., indent=2) (uploads/json/output
+y uploads/json/storage/datos<nombre>save.json). La indentación casi duplica el
+tamaño y el json estándar es lento con muchos floats. Aquí:
+- El contenido se serializa una sola vez a bytes con el formato configurado:
+  'compacto' (orjson si está instalado, si no json sin espacios) o 'indentado'
+  (el formato anterior, json con indent=2)
+- El archivo de almacenamiento se escribe una vez y el de salida es un enlace
+  duro al mismo contenido (o una copia si el sistema de archivos no permite enlaces)
+- Opcionalmente el almacenamiento se comprime con gzip o zstd (.json.gz / .json.zst);
+  en ese caso el archivo de salida se escribe aparte sin comprimir
+
+Escritura atómica: cada archivo se escribe con un nombre temporal en la misma
+carpeta y se renombra (os.replace) al terminar, así quien lo lea nunca ve un
+archivo a medio escribir. El archivo de salida es datos<nombre>.json (antes todos
+los viajes escribían output/datos1.json y los procesos en paralelo se
+sobrescribían entre sí). Al terminar un viaje se agrega una línea a
+index.jsonl en la carpeta de salida (ver registrar_en_indice / leer_indice),
+que los consumidores pueden seguir en lugar de consultar los archivos.
+
+Configuración por variables de entorno:
+- RECWAY_FORMATO_JSON: 'compacto' (defecto) o 'indentado'
+- RECWAY_COMPRESION_JSON: 'ninguna' (defecto), 'gzip' o 'zstd'
+"""
+import os
+import gzip
+import json
+import shutil
+import uuid
+import threading
+from datetime import datetime, timezone
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo el lock entre hilos
+    fcntl = None
+
+FORMATOS = ('compacto', 'indentado')
+COMPRESIONES = {'ninguna': '', 'gzip': '.gz', 'zstd': '.zst'}
+NIVEL_GZIP = 6
+NIVEL_ZSTD = 3
+NOMBRE_INDICE = 'index.jsonl'
+
+_lock_indice = threading.Lock()
+
+
+def formato_defecto():
+    return os.getenv('RECWAY_FORMATO_JSON', 'compacto')
+
+
+def compresion_defecto():
+    return os.getenv('RECWAY_COMPRESION_JSON', 'ninguna')
+
+
+def serializar(datos, formato=None):
+    """
+    Serializa a JSON en bytes UTF-8 (sin escapar caracteres no ASCII).
+
+    Args:
+        formato (str): 'compacto' o 'indentado' (defecto RECWAY_FORMATO_JSON).
+    """
+    formato = formato or formato_defecto()
+    if formato == 'indentado':
+        return json.dumps(datos, ensure_ascii=False, indent=2).encode('utf-8')
+    if formato != 'compacto':
+        raise ValueError(f"Formato JSON no soportado: {formato} (opciones: {', '.join(FORMATOS)})")
+    if orjson is not None:
+        return orjson.dumps(datos)
+    return json.dumps(datos, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def comprimir(contenido, compresion=None):
+    """
+    Returns:
+        (contenido_comprimido, extension): extension '' si compresion es 'ninguna'.
+    """
+    compresion = compresion or compresion_defecto()
+    if compresion not in COMPRESIONES:
+        raise ValueError(f"Compresión no soportada: {compresion} (opciones: {', '.join(COMPRESIONES)})")
+    if compresion == 'gzip':
+        return gzip.compress(contenido, compresslevel=NIVEL_GZIP), COMPRESIONES[compresion]
+    if compresion == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstandard no está instalado; use RECWAY_COMPRESION_JSON=gzip o 'ninguna'")
+        return zstandard.ZstdCompressor(level=NIVEL_ZSTD).compress(contenido), COMPRESIONES[compresion]
+    return contenido, ''
+
+
+def descomprimir(contenido, ruta):
+    """Inverso de comprimir según la extensión de la ruta."""
+    if ruta.endswith('.gz'):
+        return gzip.decompress(contenido)
+    if ruta.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError('zstandard no está instalado')
+        return zstandard.ZstdDecompressor().decompress(contenido)
+    return contenido
+
+
+def leer(ruta):
+    """Lee un JSON guardado con guardar_resultado (comprimido o no)."""
+    with open(ruta, 'rb') as archivo:
+        contenido = descomprimir(archivo.read(), ruta)
+    return orjson.loads(contenido) if orjson is not None else json.loads(contenido)
+
+
+def nombres_resultado(nombre_archivo):
+    """
+    Nombres de los archivos de un viaje: RecWay_x.csv -> ('datosRecWay_x.json', 'datosRecWay_x' + 'save.json').
+    Son únicos por archivo de entrada (upload agrega un sufijo si el nombre ya existe);
+    reprocesar un viaje reemplaza sus propios archivos.
+    """
+    base = 'datos' + os.path.splitext(os.path.basename(nombre_archivo))[0]
+    return base + '.json', base + 'save.json'
+
+
+def guardar_viaje(datos, nombre_archivo, carpeta_salida, carpeta_almacenamiento, formato=None, compresion=None,
+                  registrar=True):
+    """
+    guardar_resultado con los nombres del viaje y registro en index.jsonl de la carpeta de salida.
+
+    Args:
+        registrar: con False solo se escriben los archivos y se retorna el registro sin
+            agregarlo; quien llama lo agrega con registrar_en_indice cuando el viaje
+            termina (así un reintento no deja dos líneas del mismo viaje).
+
+    Returns:
+        dict: el registro del índice.
+    """
+    nombre_salida, nombre_almacenamiento = nombres_resultado(nombre_archivo)
+    ruta_salida = os.path.join(carpeta_salida, nombre_salida)
+    ruta_almacenamiento = guardar_resultado(
+        datos, ruta_salida, os.path.join(carpeta_almacenamiento, nombre_almacenamiento), formato, compresion
+    )
+    registro = {
+        'archivo': nombre_archivo,
+        'salida': nombre_salida,
+        'almacenamiento': os.path.basename(ruta_almacenamiento),
+        'segmentos': len(datos),
+        'bytes': os.path.getsize(ruta_salida),
+    }
+    return registrar_en_indice(carpeta_salida, registro) if registrar else registro
+
+
+def _ruta_temporal(ruta):
+    carpeta, nombre = os.path.split(ruta)
+    return os.path.join(carpeta, f'.{nombre}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp')
+
+
+def escribir(ruta, contenido):
+    """Escribe bytes de forma atómica (archivo temporal en la misma carpeta + os.replace)."""
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    temporal = _ruta_temporal(ruta)
+    try:
+        with open(temporal, 'wb') as archivo:
+            archivo.write(contenido)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+
+def enlazar_o_copiar(origen, destino):
+    """Enlace duro de origen en destino, reemplazándolo de forma atómica; copia si no se puede enlazar."""
+    os.makedirs(os.path.dirname(destino) or '.', exist_ok=True)
+    temporal = _ruta_temporal(destino)
+    try:
+        try:
+            os.link(origen, temporal)
+        except OSError:
+            shutil.copyfile(origen, temporal)
+        os.replace(temporal, destino)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+
+def guardar_resultado(datos, ruta_salida, ruta_almacenamiento, formato=None, compresion=None):
+    """
+    Escribe el resultado de un viaje en la carpeta de almacenamiento y en la de salida.
+
+    Args:
+        datos: Lista de dicts (ResultadoViaje.a_dicts()).
+        ruta_salida (str): Archivo de salida (siempre JSON sin comprimir).
+        ruta_almacenamiento (str): Archivo de almacenamiento; con compresión se le agrega
+            la extensión '.gz' o '.zst'.
+
+    Returns:
+        str: ruta final del archivo de almacenamiento.
+    """
+    contenido = serializar(datos, formato)
+    comprimido, extension = comprimir(contenido, compresion)
+    ruta_almacenamiento += extension
+    escribir(ruta_almacenamiento, comprimido)
+    if extension:
+        escribir(ruta_salida, contenido)
+    else:
+        enlazar_o_copiar(ruta_almacenamiento, ruta_salida)
+    return ruta_almacenamiento
+
+
+def registrar_en_indice(carpeta_salida, registro):
+    """
+    Agrega una línea JSON a index.jsonl de la carpeta de salida (después de que los
+    archivos del viaje ya están en su lugar). Se escribe la línea completa en una sola
+    llamada en modo append, con lock entre hilos y, en Linux, entre procesos (flock).
+
+    Returns:
+        dict: el registro con 'fecha_registro' agregada.
+    """
+    registro = dict(registro, fecha_registro=datetime.now(timezone.utc).isoformat())
+    linea = json.dumps(registro, ensure_ascii=False).encode('utf-8') + b'\n'
+    os.makedirs(carpeta_salida, exist_ok=True)
+    with _lock_indice:
+        with open(os.path.join(carpeta_salida, NOMBRE_INDICE), 'ab') as archivo:
+            if fcntl is not None:
+                fcntl.flock(archivo.fileno(), fcntl.LOCK_EX)
+            try:
+                archivo.write(linea)
+                archivo.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(archivo.fileno(), fcntl.LOCK_UN)
+    return registro
+
+
+def leer_indice(carpeta_salida, desde=0, limite=None):
+    """
+    Lee los registros de index.jsonl a partir de la posición en bytes 'desde'
+    (la 'siguiente' de la llamada anterior), para seguir el índice como tail -f.
+    Una última línea incompleta no se devuelve hasta que esté completa.
+
+    Returns:
+        (registros, siguiente)
+    """
+    ruta = os.path.join(carpeta_salida, NOMBRE_INDICE)
+    registros = []
+    if not os.path.exists(ruta):
+        return registros, 0
+    with open(ruta, 'rb') as archivo:
+        archivo.seek(desde)
+        siguiente = desde
+        for linea in archivo:
+            if not linea.endswith(b'\n') or (limite is not None and len(registros) >= limite):
+                break
+            siguiente += len(linea)
+            registros.append(json.loads(linea))
+    return registros, siguiente
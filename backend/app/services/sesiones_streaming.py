@@ -0,0 +1,412 @@
+"""
+Sesiones de ingesta en tiempo real (streaming) de telemetría GPS/IMU.
+
+Un viaje solo se procesaba cuando el teléfono exportaba el CSV completo a
+uploads/csv/raw. Con una sesión el dispositivo envía las filas mientras graba
+(endpoint WebSocket /stream/ws) en el mismo formato del archivo: líneas
+'# clave: valor' de metadatos, el encabezado 'timestamp,...' y las filas. Cada
+mensaje se procesa al llegar:
+- Eliminación de fixes GPS repetidos, heading filtrado (media móvil de 18 fixes)
+  y filtro de velocidad, como main_procesamiento pero incremental
+- Emparejamiento con emparejamiento_lote.EmparejadorIncremental, que conserva el
+  estado (tesela, arista y subsegmento) entre mensajes
+- Un segmento se cierra cuando empieza el siguiente; sus métricas
+  (procesamiento_senales) se calculan cuando llegaron MARGEN_SENALES segundos de
+  señales después de su fin (los filtros FIR y las medias móviles son centrados)
+  y entonces se emite y, si la persistencia está activa, se carga en la base de
+  datos (una fuente_datos_dispositivo por sesión)
+
+Diferencias con el procesamiento del archivo completo: la trayectoria se empareja
+en el orden de grabación (main_procesamiento la recorre invertida) y la frecuencia
+de muestreo se estima con los primeros fixes de la sesión.
+
+Memoria por sesión acotada: solo se conservan los fixes del segmento abierto y de
+los cerrados aún sin emitir, las señales desde el inicio del primero de ellos (a
+lo sumo RECWAY_STREAMING_MAX_SEGUNDOS de grabación) y los últimos
+SEGMENTOS_RECIENTES segmentos emitidos.
+
+Configuración por variables de entorno:
+- RECWAY_STREAMING_MAX_SESIONES: sesiones simultáneas (defecto 50)
+- RECWAY_STREAMING_MAX_SEGUNDOS: segundos de señales por sesión (defecto 600)
+"""
+import io
+import os
+import time
+import uuid
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import contexto_viaje as cv
+import emparejamiento_lote as el
+import lectura_csv as lc
+import main_procesamiento as procesamiento
+import persistencia_bd as pb
+import procesamiento_senales as ps
+import resultado_viaje as rv
+
+UMBRAL_VELOCIDAD = 3  # m/s, igual que filtrar_muestras_por_velocidad en main_procesamiento
+VENTANA_HEADING = 18  # fixes, igual que ap.ajustar_heading_y_filtrar
+MARGEN_SENALES = 2.0  # s; soporte de los filtros de procesamiento_senales (~1.5 s) con holgura
+FIXES_FRECUENCIA = 30  # intervalos entre fixes para fijar la frecuencia de muestreo
+SEGMENTOS_RECIENTES = 200
+
+TIPOS_FIX = {
+    'timestamp': np.int64, 'latitud': np.float64, 'longitud': np.float64, 'velocidad': np.float64,
+    'heading': np.float64, 'fila_inicial': np.int64, 'fila_final': np.int64, 'posicion': np.int64, 'cambio': bool,
+}
+
+
+def max_sesiones():
+    return int(os.getenv('RECWAY_STREAMING_MAX_SESIONES', '50'))
+
+
+def max_segundos():
+    return float(os.getenv('RECWAY_STREAMING_MAX_SEGUNDOS', '600'))
+
+
+class LimiteSesiones(RuntimeError):
+    pass
+
+
+class SesionStreaming:
+    """Estado del procesamiento incremental de un viaje que llega por partes."""
+
+    def __init__(self, id_sesion, nombre=None, carpeta_grafos=None, L=None, segmento_maximo=None, persistir=None):
+        datos = procesamiento.DatosProcesamiento()
+        self.id_sesion = id_sesion
+        self.nombre = nombre or f'stream_{id_sesion}'
+        self.emparejador = el.EmparejadorIncremental(
+            carpeta_grafos or datos.carpeta_grafos, L or datos.L, segmento_maximo or datos.segmento_maximo
+        )
+        self.persistir = pb.habilitada() if persistir is None else persistir
+        self.metadatos = {}
+        self.columnas_archivo = None
+        self.columnas_senales = []
+        self.creada_en = time.time()
+        self.ultima_actividad = self.creada_en
+        self.filas = 0  # filas recibidas
+        self.fixes = 0  # fixes GPS distintos recibidos
+        self.segmentos_emitidos = 0
+        self.errores_persistencia = 0
+        self.recientes = deque(maxlen=SEGMENTOS_RECIENTES)
+        self._lock = threading.Lock()
+        self._resto = ''  # línea incompleta al final del último mensaje
+        self._senales = {}
+        self._base = 0  # fila de la primera muestra conservada en _senales
+        self._ultimo_gps = None  # (lat, lng) del último fix distinto
+        self._headings = deque(maxlen=VENTANA_HEADING - 1)
+        self._intervalos = deque(maxlen=FIXES_FRECUENCIA)  # filas por segundo entre fixes distintos
+        self._ultimo_fix_fila = None  # (fila, timestamp) del último fix distinto
+        self._frecuencia = None
+        self._fixes = {campo: np.empty(0, dtype=tipo) for campo, tipo in TIPOS_FIX.items()}
+        self._aristas = np.empty((0, 3), dtype=np.int64)
+        self._primer_fix = 0  # número (en la sesión) del primer fix de _fixes
+        self._subsegmentos = {}
+        self._info_aristas = {}
+        self._inicios = []  # número de fix de inicio de los segmentos sin emitir (el último está abierto)
+        self._id_fuente = None
+
+    # ----------------------------------------------------------------- entrada
+
+    def agregar(self, texto):
+        """
+        Procesa un fragmento del CSV (puede terminar a mitad de una línea).
+
+        Returns:
+            list: dicts (formato JSON de procesar_archivo_especifico) de los segmentos que quedaron listos.
+        """
+        with self._lock:
+            self.ultima_actividad = time.time()
+            lineas = (self._resto + texto).split('\n')
+            self._resto = lineas.pop()
+            return self._procesar_lineas(lineas)
+
+    def terminar(self):
+        """Procesa lo pendiente y emite también el último segmento (el viaje terminó)."""
+        with self._lock:
+            lineas = [self._resto] if self._resto.strip() else []
+            self._resto = ''
+            segmentos = self._procesar_lineas(lineas)
+            return segmentos + self._emitir(final=True)
+
+    def _procesar_lineas(self, lineas):
+        datos = []
+        for linea in lineas:
+            linea = linea.strip()
+            if not linea:
+                continue
+            if self.columnas_archivo is None:
+                self._leer_encabezado(linea)
+            else:
+                datos.append(linea)
+        if not datos:
+            return []
+        bloque = pd.read_csv(
+            io.StringIO('\n'.join(datos)),
+            header=None,
+            names=self.columnas_archivo,
+            usecols=list(lc.COLUMNAS_GPS) + self.columnas_senales,
+            dtype={c: lc.TIPOS_COLUMNAS[c] for c in (*lc.COLUMNAS_GPS, *self.columnas_senales)}
+        )
+        self._agregar_bloque(bloque)
+        segmentos = self._emitir(final=False)
+        self._recortar()
+        return segmentos
+
+    def _leer_encabezado(self, linea):
+        # Mismo criterio que lectura_csv.LectorCSV: metadatos '#' hasta la línea 'timestamp...'
+        if linea.startswith('timestamp'):
+            columnas = linea.split(',')
+            faltantes = [c for c in lc.COLUMNAS_GPS if c not in columnas]
+            if faltantes:
+                raise ValueError(f'El encabezado no contiene las columnas: {faltantes}')
+            self.columnas_archivo = columnas
+            self.columnas_senales = [c for c in lc.COLUMNAS_SENALES if c in columnas]
+            self._senales = {c: np.empty(0, dtype=np.float32) for c in self.columnas_senales}
+        elif linea.startswith('#'):
+            if ':' in linea:
+                clave, valor = linea.strip('# ').split(':', 1)
+                self.metadatos[clave.strip()] = valor.strip()
+        else:
+            raise ValueError("Se esperaba el encabezado 'timestamp,...' antes de las filas")
+
+    def _agregar_bloque(self, bloque):
+        n = len(bloque)
+        filas = self.filas + np.arange(n)
+        for columna in self.columnas_senales:
+            self._senales[columna] = np.concatenate((self._senales[columna], bloque[columna].to_numpy(np.float32)))
+
+        # Fixes distintos (la comparación continúa entre mensajes, como eliminar_duplicados_por_bloques)
+        latitud = bloque['gps_lat'].to_numpy()
+        longitud = bloque['gps_lng'].to_numpy()
+        lat_previa = np.r_[np.nan if self._ultimo_gps is None else self._ultimo_gps[0], latitud[:-1]]
+        lng_previa = np.r_[np.nan if self._ultimo_gps is None else self._ultimo_gps[1], longitud[:-1]]
+        nuevos = np.flatnonzero((latitud != lat_previa) | (longitud != lng_previa))
+        self._ultimo_gps = (latitud[-1], longitud[-1])
+        self.filas += n
+        if len(nuevos) == 0:
+            return
+        fila_inicial = filas[nuevos]
+        timestamp = bloque['timestamp'].to_numpy()[nuevos]
+        velocidad = bloque['gps_speed'].to_numpy()[nuevos]
+        self.fixes += len(nuevos)
+        self._estimar_frecuencia(fila_inicial, timestamp)
+
+        # El último fix conservado termina donde empieza el primer fix nuevo
+        if len(self._fixes['fila_final']) and self._fixes['fila_final'][-1] < 0:
+            self._fixes['fila_final'][-1] = fila_inicial[0]
+        fila_final = np.r_[fila_inicial[1:], -1]
+
+        # Heading en [-180, 180) con media móvil de los últimos VENTANA_HEADING fixes (min_periods=1)
+        heading = ((bloque['gps_heading'].to_numpy()[nuevos] + 180) % 360) - 180
+        previos = np.asarray(self._headings, dtype=np.float64)
+        todos = np.r_[previos, heading]
+        acumulado = np.r_[0.0, np.cumsum(todos)]
+        fin = np.arange(len(previos), len(todos)) + 1
+        inicio = np.maximum(fin - VENTANA_HEADING, 0)
+        heading_filtrado = (acumulado[fin] - acumulado[inicio]) / (fin - inicio)
+        self._headings.extend(heading.tolist())
+
+        aceptados = velocidad > UMBRAL_VELOCIDAD
+        if not aceptados.any():
+            return
+        emparejamiento = self.emparejador.emparejar(
+            latitud[nuevos][aceptados], longitud[nuevos][aceptados], heading_filtrado[aceptados]
+        )
+        numero = self._primer_fix + len(self._fixes['timestamp'])
+        for local in np.flatnonzero(emparejamiento.cambio).tolist():
+            self._inicios.append(numero + local)
+            self._subsegmentos[numero + local] = emparejamiento.subsegmentos[local]
+            self._info_aristas[numero + local] = emparejamiento.info_aristas[local]
+        nuevos_fixes = {
+            'timestamp': timestamp[aceptados], 'latitud': latitud[nuevos][aceptados],
+            'longitud': longitud[nuevos][aceptados], 'velocidad': velocidad[aceptados],
+            'heading': heading_filtrado[aceptados], 'fila_inicial': fila_inicial[aceptados],
+            'fila_final': fila_final[aceptados], 'posicion': emparejamiento.posicion_subsegmento,
+            'cambio': emparejamiento.cambio,
+        }
+        for campo, tipo in TIPOS_FIX.items():
+            self._fixes[campo] = np.concatenate((self._fixes[campo], np.asarray(nuevos_fixes[campo], dtype=tipo)))
+        self._aristas = np.concatenate((self._aristas, emparejamiento.aristas))
+
+    def _estimar_frecuencia(self, fila_inicial, timestamp):
+        if self._frecuencia is not None:
+            return
+        filas, tiempos = fila_inicial, timestamp
+        if self._ultimo_fix_fila is not None:
+            filas, tiempos = np.r_[self._ultimo_fix_fila[0], filas], np.r_[self._ultimo_fix_fila[1], tiempos]
+        self._ultimo_fix_fila = (filas[-1], tiempos[-1])
+        tiempo = np.diff(tiempos)
+        validos = tiempo > 0
+        self._intervalos.extend((np.diff(filas)[validos] * 1000.0 / tiempo[validos]).tolist())
+        if len(self._intervalos) >= FIXES_FRECUENCIA:
+            # Fija la frecuencia para la sesión: los FIR se diseñan una vez
+            self._frecuencia = float(np.median(self._intervalos))
+
+    def frecuencia(self):
+        if self._frecuencia is not None:
+            return self._frecuencia
+        if self._intervalos:
+            return float(np.median(self._intervalos))
+        try:
+            return float(self.metadatos['sampling_rate'])
+        except (KeyError, ValueError):
+            return ps.FRECUENCIA_DEFECTO
+
+    # ------------------------------------------------------------------ salida
+
+    def _emitir(self, final):
+        """Calcula, persiste y retorna los segmentos cerrados que ya tienen MARGEN_SENALES de señales."""
+        fs = self.frecuencia()
+        margen = int(np.ceil(MARGEN_SENALES * fs))
+        listos = 0
+        for i in range(len(self._inicios)):
+            if i + 1 == len(self._inicios):
+                # El último segmento sigue abierto hasta que termine el viaje
+                if final:
+                    listos += 1
+                break
+            ultimo = self._inicios[i + 1] - 1 - self._primer_fix
+            if not final and self.filas < self._fixes['fila_final'][ultimo] + margen:
+                break
+            listos += 1
+        if listos == 0:
+            return []
+        primero = self._inicios[0] - self._primer_fix
+        fin = (self._inicios[listos] - self._primer_fix) if listos < len(self._inicios) else len(self._fixes['timestamp'])
+        resultado = self._resultado(primero, fin, [s - self._primer_fix - primero for s in self._inicios[:listos]],
+                                    fs, margen)
+        if self.persistir:
+            self._persistir(resultado)
+        segmentos = resultado.a_dicts()
+        for segmento in segmentos:
+            segmento['numero'] += self.segmentos_emitidos
+        self.segmentos_emitidos += len(segmentos)
+        self.recientes.extend(segmentos)
+        for numero in self._inicios[:listos]:
+            self._subsegmentos.pop(numero, None)
+            self._info_aristas.pop(numero, None)
+        del self._inicios[:listos]
+        return segmentos
+
+    def _resultado(self, primero, fin, inicios, fs, margen):
+        """ResultadoViaje de los fixes [primero, fin) de _fixes, con segmentos en 'inicios' (relativos a primero)."""
+        fixes = {campo: valores[primero:fin] for campo, valores in self._fixes.items()}
+        fila_final = np.where(fixes['fila_final'] < 0, self.filas, fixes['fila_final']).astype(np.int64)
+        desde = max(int(fixes['fila_inicial'][0]) - margen, self._base)
+        hasta = min(int(fila_final[-1]) + margen, self.filas)
+        senales = {c: valores[desde - self._base:hasta - self._base] for c, valores in self._senales.items()}
+        viaje = cv.ContextoViaje(
+            self.nombre, fixes['timestamp'], fixes['latitud'], fixes['longitud'], fixes['velocidad'],
+            fixes['heading'], self.metadatos, np.maximum(fixes['fila_inicial'] - desde, 0), fila_final - desde,
+            senales
+        )
+        emparejamiento = el.ResultadoEmparejamiento(fin - primero)
+        emparejamiento.aristas[:] = self._aristas[primero:fin]
+        emparejamiento.posicion_subsegmento[:] = fixes['posicion']
+        emparejamiento.cambio[inicios] = True
+        for local in inicios:
+            numero = self._primer_fix + primero + local
+            emparejamiento.subsegmentos[local] = self._subsegmentos[numero]
+            emparejamiento.info_aristas[local] = self._info_aristas[numero]
+        metricas = ps.metricas_segmentos(viaje, inicios, frecuencia=fs)
+        return rv.ResultadoViaje.desde_emparejamiento(viaje, emparejamiento, metricas)
+
+    def _persistir(self, resultado):
+        try:
+            if self._id_fuente is None:
+                self._id_fuente = pb.crear_fuente(self.metadatos)
+            pb.persistir_viaje(resultado, self.metadatos, id_fuente=self._id_fuente)
+        except Exception as e:
+            # Los segmentos se emiten igual; el viaje completo se puede subir después como CSV
+            self.errores_persistencia += 1
+            print(f'[sesiones_streaming][ERROR] {self.nombre}: persistencia: {e}')
+
+    def _recortar(self):
+        """Descarta los fixes anteriores al primer segmento sin emitir y las señales que ya no se usan."""
+        if self._inicios:
+            descartar = self._inicios[0] - self._primer_fix
+        else:
+            # Sin segmento abierto los fixes no pertenecen a ningún segmento (como antes del primer cambio)
+            descartar = len(self._fixes['timestamp'])
+        if descartar > 0:
+            for campo in TIPOS_FIX:
+                self._fixes[campo] = self._fixes[campo][descartar:]
+            self._aristas = self._aristas[descartar:]
+            self._primer_fix += descartar
+        margen = int(np.ceil(MARGEN_SENALES * self.frecuencia()))
+        base = self.filas - margen
+        if len(self._fixes['fila_inicial']):
+            base = int(self._fixes['fila_inicial'][0]) - margen
+        # Un segmento abierto muy largo conserva solo las últimas señales
+        base = min(self.filas, max(base, self._base, self.filas - int(max_segundos() * self.frecuencia())))
+        if base > self._base:
+            for columna in self.columnas_senales:
+                self._senales[columna] = self._senales[columna][base - self._base:].copy()
+            self._base = base
+
+    def estado(self):
+        with self._lock:
+            return {
+                'id_sesion': self.id_sesion,
+                'nombre': self.nombre,
+                'creada_en': self.creada_en,
+                'ultima_actividad': self.ultima_actividad,
+                'filas': self.filas,
+                'fixes': self.fixes,
+                'frecuencia_muestreo': self.frecuencia(),
+                'segmentos_emitidos': self.segmentos_emitidos,
+                'segmentos_pendientes': len(self._inicios),
+                'fixes_en_memoria': len(self._fixes['timestamp']),
+                'filas_en_memoria': self.filas - self._base,
+                'bytes_en_memoria': self.nbytes(),
+                'persistencia': self.persistir,
+                'errores_persistencia': self.errores_persistencia,
+            }
+
+    def nbytes(self):
+        """Memoria aproximada de los arreglos de la sesión (sin los segmentos recientes)."""
+        arreglos = [*self._senales.values(), *self._fixes.values(), self._aristas]
+        return sum(a.nbytes for a in arreglos)
+
+
+_sesiones = {}
+_lock_sesiones = threading.Lock()
+
+
+def crear_sesion(nombre=None, **opciones):
+    """Registra una sesión nueva; LimiteSesiones si ya hay RECWAY_STREAMING_MAX_SESIONES activas."""
+    with _lock_sesiones:
+        if len(_sesiones) >= max_sesiones():
+            raise LimiteSesiones(f'Se alcanzó el máximo de {max_sesiones()} sesiones de streaming')
+        id_sesion = uuid.uuid4().hex[:12]
+        sesion = SesionStreaming(id_sesion, nombre, **opciones)
+        _sesiones[id_sesion] = sesion
+    print(f'[sesiones_streaming] sesión {id_sesion} iniciada ({sesion.nombre})')
+    return sesion
+
+
+def obtener_sesion(id_sesion):
+    with _lock_sesiones:
+        return _sesiones.get(id_sesion)
+
+
+def terminar_sesion(id_sesion):
+    """Emite los segmentos pendientes y quita la sesión del registro. Returns: dicts de los segmentos."""
+    with _lock_sesiones:
+        sesion = _sesiones.pop(id_sesion, None)
+    if sesion is None:
+        return []
+    segmentos = sesion.terminar()
+    print(f'[sesiones_streaming] sesión {id_sesion} terminada: {sesion.segmentos_emitidos} segmentos, '
+          f'{sesion.filas} filas')
+    return segmentos
+
+
+def listar_sesiones():
+    with _lock_sesiones:
+        sesiones = list(_sesiones.values())
+    return [sesion.estado() for sesion in sesiones]
@@ -0,0 +1,281 @@
+"""
+Formato binario precompilado para las teselas de grafos de OSM.
+
+Leer un GraphML (XML) con ox.load_graphml tarda segundos por tesela. Este módulo
+compila cada archivo 'segN<k>pos....graphml' una sola vez a una carpeta
+'segN<k>pos....tesela' con arreglos NumPy (.npy) que se abren con
+np.load(mmap_mode='r'), de modo que la carga toma milisegundos y las páginas
+de memoria se comparten entre procesos que abren la misma tesela.
+
+Contenido de la carpeta compilada:
+- nodos_id.npy      (N,)   int64    identificador OSM de cada nodo
+- nodos_xy.npy      (N, 2) float64  (lon, lat) de cada nodo
+- aristas.npy       (E, 3) int64    (u, v, key) de cada arista
+- aristas_nodos.npy (E, 2) int64    posición de u y v en nodos_id
+- geom_offsets.npy  (E+1,) int64    inicio de la geometría de cada arista en geom_coords
+- geom_coords.npy   (M, 2) float64  vértices (lon, lat) de todas las aristas
+- tiene_geometria.npy, oneway.npy (E,) bool
+- longitud.npy      (E,)   float64
+- highway.npy, nombre.npy (E,) int32 código en el vocabulario de meta.json (-1 si no existe)
+- meta.json         versión, crs, vocabularios y archivo de origen
+
+El G reconstruido desde los arreglos solo tiene 'x'/'y' en los nodos y 'length',
+'oneway', 'highway', 'name' y 'geometry' en las aristas: los demás atributos de OSM
+('osmid', 'reversed', 'lanes', 'maxspeed', ...) no se guardan en la tesela. Lo mismo
+vale para una tesela cargada desde el GraphML, que usa el mismo G reconstruido.
+
+Uso offline:
+    python teselas_grafo.py <carpeta_grafos>
+"""
+import os
+import sys
+import json
+import shutil
+
+import numpy as np
+import networkx as nx
+import shapely
+import osmnx as ox
+
+VERSION_FORMATO = 1
+EXTENSION_COMPILADA = '.tesela'
+ARREGLOS = (
+    'nodos_id', 'nodos_xy', 'aristas', 'aristas_nodos', 'geom_offsets', 'geom_coords',
+    'tiene_geometria', 'oneway', 'longitud', 'highway', 'nombre'
+)
+
+
+class TeselaGrafo:
+    """
+    Tesela de grafo en forma de arreglos, con el MultiDiGraph de networkx construido bajo demanda.
+
+    Los algoritmos por muestra siguen usando `G`; los algoritmos vectorizados
+    trabajan directamente sobre los arreglos.
+    """
+
+    def __init__(self, arreglos, meta, G=None, ruta=None):
+        for nombre in ARREGLOS:
+            setattr(self, nombre, arreglos[nombre])
+        self.meta = meta
+        self.ruta = ruta
+        self._G = G
+
+    @property
+    def cantidad_aristas(self):
+        return len(self.aristas)
+
+    @property
+    def cantidad_nodos(self):
+        return len(self.nodos_id)
+
+    @property
+    def G(self):
+        if self._G is None:
+            self._G = self._construir_grafo()
+        return self._G
+
+    @property
+    def nbytes(self):
+        """
+        Tamaño aproximado en memoria propia del proceso: arreglos no mapeados más el
+        grafo de networkx si ya se construyó. Los arreglos abiertos con mmap no cuentan:
+        sus páginas son del page cache, compartidas entre procesos y liberables por el kernel.
+        """
+        total = sum(
+            getattr(self, nombre).nbytes for nombre in ARREGLOS
+            if not isinstance(getattr(self, nombre), np.memmap)
+        )
+        if self._G is not None:
+            # networkx usa del orden de 1 KB por arista y 0.5 KB por nodo (diccionarios anidados)
+            total += self.cantidad_aristas * 1024 + self.cantidad_nodos * 512
+        return total
+
+    def coordenadas_arista(self, indice):
+        """Retorna la geometría de la arista como lista [(lon, lat), ...]."""
+        inicio, fin = self.geom_offsets[indice], self.geom_offsets[indice + 1]
+        return [tuple(p) for p in self.geom_coords[inicio:fin].tolist()]
+
+    def atributo(self, vocabulario, codigo):
+        return json.loads(self.meta[vocabulario][codigo]) if codigo >= 0 else None
+
+    def _construir_grafo(self):
+        G = nx.MultiDiGraph(**self.meta.get('grafo', {}))
+        G.graph['crs'] = self.meta['crs']
+        nodos_xy = np.asarray(self.nodos_xy)
+        G.add_nodes_from(
+            (nodo, {'x': x, 'y': y}) for nodo, (x, y) in zip(self.nodos_id.tolist(), nodos_xy.tolist())
+        )
+        # Las geometrías se crean todas en una sola llamada vectorizada de shapely
+        geom_offsets = np.asarray(self.geom_offsets)
+        indices = np.repeat(np.arange(self.cantidad_aristas), np.diff(geom_offsets))
+        geometrias = shapely.linestrings(np.asarray(self.geom_coords), indices=indices)
+        vocab_highway = [json.loads(valor) for valor in self.meta['vocab_highway']]
+        vocab_nombre = [json.loads(valor) for valor in self.meta['vocab_nombre']]
+        columnas = zip(
+            self.aristas.tolist(), self.longitud.tolist(), self.oneway.tolist(),
+            self.highway.tolist(), self.nombre.tolist(), self.tiene_geometria.tolist(), geometrias
+        )
+        aristas = []
+        for (u, v, key), longitud, oneway, highway, nombre, tiene_geometria, geometria in columnas:
+            datos = {'length': longitud, 'oneway': oneway}
+            if highway >= 0:
+                datos['highway'] = vocab_highway[highway]
+            if nombre >= 0:
+                datos['name'] = vocab_nombre[nombre]
+            if tiene_geometria:
+                datos['geometry'] = geometria
+            aristas.append((u, v, key, datos))
+        G.add_edges_from(aristas)
+        return G
+
+    @classmethod
+    def desde_grafo(cls, G, ruta=None):
+        """Construye los arreglos de la tesela a partir de un grafo ya cargado con osmnx."""
+        nodos_id = np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes())
+        posicion = {nodo: i for i, nodo in enumerate(nodos_id.tolist())}
+        nodos_xy = np.array([(G.nodes[n]['x'], G.nodes[n]['y']) for n in nodos_id.tolist()], dtype=np.float64)
+        vocab_highway, vocab_nombre = {}, {}
+        aristas, aristas_nodos, longitud, oneway = [], [], [], []
+        tiene_geometria, highway, nombre = [], [], []
+        offsets, coords = [0], []
+        for u, v, key, datos in G.edges(keys=True, data=True):
+            aristas.append((u, v, key))
+            aristas_nodos.append((posicion[u], posicion[v]))
+            longitud.append(datos.get('length', 0.0))
+            oneway.append(datos.get('oneway', False) in [True, 'yes', '1', 'True'])
+            highway.append(_codificar(vocab_highway, datos.get('highway')))
+            nombre.append(_codificar(vocab_nombre, datos.get('name')))
+            if 'geometry' in datos:
+                puntos = list(datos['geometry'].coords)
+                tiene_geometria.append(True)
+            else:
+                puntos = [tuple(nodos_xy[posicion[u]]), tuple(nodos_xy[posicion[v]])]
+                tiene_geometria.append(False)
+            coords.extend(puntos)
+            offsets.append(offsets[-1] + len(puntos))
+        arreglos = {
+            'nodos_id': nodos_id,
+            'nodos_xy': nodos_xy.reshape(-1, 2),
+            'aristas': np.array(aristas, dtype=np.int64).reshape(-1, 3),
+            'aristas_nodos': np.array(aristas_nodos, dtype=np.int64).reshape(-1, 2),
+            'geom_offsets': np.array(offsets, dtype=np.int64),
+            'geom_coords': np.array(coords, dtype=np.float64).reshape(-1, 2),
+            'tiene_geometria': np.array(tiene_geometria, dtype=bool),
+            'oneway': np.array(oneway, dtype=bool),
+            'longitud': np.array(longitud, dtype=np.float64),
+            'highway': np.array(highway, dtype=np.int32),
+            'nombre': np.array(nombre, dtype=np.int32),
+        }
+        meta = {
+            'version': VERSION_FORMATO,
+            'crs': str(G.graph.get('crs', 'epsg:4326')),
+            'grafo': {k: v for k, v in G.graph.items() if isinstance(v, (str, int, float, bool))},
+            'vocab_highway': list(vocab_highway.keys()),
+            'vocab_nombre': list(vocab_nombre.keys()),
+        }
+        return cls(arreglos, meta, G=G, ruta=ruta)
+
+    @classmethod
+    def abrir(cls, ruta_compilada):
+        """Abre una tesela compilada en modo memory-map (solo lectura)."""
+        with open(os.path.join(ruta_compilada, 'meta.json'), 'r', encoding='utf-8') as archivo:
+            meta = json.load(archivo)
+        if meta.get('version') != VERSION_FORMATO:
+            raise ValueError(f"Versión de tesela no soportada en {ruta_compilada}: {meta.get('version')}")
+        arreglos = {
+            nombre: np.load(os.path.join(ruta_compilada, nombre + '.npy'), mmap_mode='r') for nombre in ARREGLOS
+        }
+        return cls(arreglos, meta, ruta=ruta_compilada)
+
+
+def _codificar(vocabulario, valor):
+    if valor is None:
+        return -1
+    llave = json.dumps(valor, ensure_ascii=False)
+    if llave not in vocabulario:
+        vocabulario[llave] = len(vocabulario)
+    return vocabulario[llave]
+
+
+def ruta_compilada(ruta_graphml):
+    """Retorna la ruta de la carpeta compilada correspondiente a un archivo GraphML."""
+    base, _ = os.path.splitext(ruta_graphml)
+    return base + EXTENSION_COMPILADA
+
+
+def tesela_vigente(ruta_graphml):
+    """True si existe una versión compilada más reciente que el GraphML de origen."""
+    meta = os.path.join(ruta_compilada(ruta_graphml), 'meta.json')
+    if not os.path.isfile(meta):
+        return False
+    if not os.path.isfile(ruta_graphml):
+        return True
+    return os.path.getmtime(meta) >= os.path.getmtime(ruta_graphml)
+
+
+def compilar_tesela(ruta_graphml):
+    """
+    Compila un archivo GraphML al formato binario de tesela.
+
+    La escritura se hace en una carpeta temporal que luego se renombra, para que
+    un proceso leyendo la tesela nunca vea una compilación a medias.
+
+    Returns:
+        str: Ruta de la carpeta compilada.
+    """
+    tesela = TeselaGrafo.desde_grafo(ox.load_graphml(filepath=ruta_graphml))
+    destino = ruta_compilada(ruta_graphml)
+    temporal = destino + '.tmp%d' % os.getpid()
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+    for nombre in ARREGLOS:
+        np.save(os.path.join(temporal, nombre + '.npy'), getattr(tesela, nombre))
+    meta = dict(tesela.meta, origen=os.path.basename(ruta_graphml))
+    with open(os.path.join(temporal, 'meta.json'), 'w', encoding='utf-8') as archivo:
+        json.dump(meta, archivo, ensure_ascii=False)
+    shutil.rmtree(destino, ignore_errors=True)
+    os.rename(temporal, destino)
+    return destino
+
+
+def compilar_carpeta(carpeta_grafos, forzar=False):
+    """
+    Compila todas las teselas GraphML de una carpeta (y subcarpetas) que no estén vigentes.
+
+    Returns:
+        list: Rutas de las teselas compiladas en esta ejecución.
+    """
+    compiladas = []
+    for root, dirs, files in os.walk(carpeta_grafos):
+        dirs[:] = [d for d in dirs if not d.endswith(EXTENSION_COMPILADA)]
+        for file in files:
+            if not (file.startswith('segN') and file.endswith('.graphml')):
+                continue
+            ruta = os.path.join(root, file)
+            if forzar or not tesela_vigente(ruta):
+                print(f'[teselas_grafo] compilando {file}')
+                compiladas.append(compilar_tesela(ruta))
+    return compiladas
+
+
+def cargar_tesela(ruta_graphml):
+    """
+    Carga una tesela usando la versión compilada cuando existe y está vigente,
+    o el GraphML original en caso contrario.
+    """
+    if tesela_vigente(ruta_graphml):
+        return TeselaGrafo.abrir(ruta_compilada(ruta_graphml))
+    tesela = TeselaGrafo.desde_grafo(ox.load_graphml(filepath=ruta_graphml), ruta=ruta_graphml)
+    # G se reconstruye desde los arreglos (igual que en una tesela compilada) para que el orden
+    # de predecesores/sucesores coincida con la adyacencia precomputada (adyacencia_grafo).
+    # Por eso pierde 'osmid', 'reversed' y los demás atributos que la tesela no guarda
+    tesela._G = None
+    return tesela
+
+
+if __name__ == '__main__':
+    carpeta = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', '..', 'grafos_archivos5'
+    )
+    for ruta in compilar_carpeta(carpeta, forzar='--forzar' in sys.argv):
+        print(ruta)
@@ -0,0 +1,209 @@
+"""
+Procesos trabajadores de la cola de trabajos (ver cola_trabajos).
+
+Se ejecuta aparte del API (servicio 'worker' en docker-compose):
+
+    cd backend && python -m app.services.trabajador_cola
+
+- Un proceso supervisor lanza RECWAY_TRABAJADORES procesos 'spawn'; cada uno toma
+  trabajos de la cola, procesa el archivo con main_procesamiento y registra el
+  resultado o el error (la cola decide si se reintenta). El cache_grafos de cada
+  proceso queda caliente entre trabajos
+- Mientras procesa, un hilo del trabajador envía el latido del trabajo en su propia
+  conexión; si se configuró RECWAY_TIMEOUT_ARCHIVO (por defecto no hay límite) y el
+  archivo lo supera, el trabajo se marca como fallido (con reintento) y el proceso termina. El supervisor reemplaza los procesos
+  que terminan y devuelve a la cola los trabajos de trabajadores sin latido
+- Sin trabajos, el trabajador espera un NOTIFY de encolar o el siguiente sondeo
+  (RECWAY_SONDEO_COLA segundos, para los reintentos programados)
+- SIGTERM / SIGINT: cada trabajador termina el archivo en curso y sale
+"""
+import os
+import sys
+import time
+import signal
+import threading
+import traceback
+import multiprocessing
+from pathlib import Path
+
+services_dir = str(Path(__file__).parent)
+if services_dir not in sys.path:
+    sys.path.insert(0, services_dir)
+
+import cola_trabajos as ct
+import pool_procesamiento as pp
+
+INTERVALO_LATIDO = 10  # segundos
+INTERVALO_SUPERVISION = 5
+INTERVALO_RECUPERACION = 30
+
+
+def sondeo_cola():
+    return float(os.getenv('RECWAY_SONDEO_COLA', '5'))
+
+
+class _Latido(threading.Thread):
+    """Latido del trabajo en curso y control del tiempo máximo por archivo."""
+
+    def __init__(self, trabajo, timeout):
+        super().__init__(name=f"latido-{trabajo['id_trabajo']}", daemon=True)
+        self.trabajo = trabajo
+        self.timeout = timeout
+        self._detener = threading.Event()
+
+    def run(self):
+        inicio = time.monotonic()
+        id_trabajo = self.trabajo['id_trabajo']
+        try:
+            with ct.conectar() as conexion:
+                while not self._detener.wait(min(INTERVALO_LATIDO, self.timeout) if self.timeout > 0 else INTERVALO_LATIDO):
+                    if self.timeout > 0 and time.monotonic() - inicio >= self.timeout:
+                        error = f'Se superó el tiempo máximo de {self.timeout:.0f} s'
+                        estado = ct.fallar(id_trabajo, error, conexion)
+                        print(f"[trabajador_cola] {self.trabajo['archivo']}: {error} "
+                              f"({estado['estado'] if estado else '?'}); terminando el proceso")
+                        sys.stdout.flush()
+                        os._exit(1)
+                    ct.latido(id_trabajo, conexion)
+        except Exception as e:
+            # Sin latido el supervisor terminará devolviendo el trabajo a la cola
+            print(f'[trabajador_cola][ERROR] latido del trabajo {id_trabajo}: {e}')
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+
+def _ya_procesado(procesamiento, nombre_archivo):
+    return (
+        not os.path.exists(os.path.join(procesamiento.carpeta_csv, nombre_archivo))
+        and os.path.exists(os.path.join(procesamiento.carpeta_almacenamiento_csv, nombre_archivo))
+    )
+
+
+def procesar_trabajo(trabajo, conexion, procesamiento, timeout):
+    id_trabajo = trabajo['id_trabajo']
+    nombre_archivo = trabajo['archivo']
+    print(f"[trabajador_cola] trabajo {id_trabajo}: {nombre_archivo} (intento {trabajo['intentos']})")
+    if trabajo['intentos'] > 1 and _ya_procesado(procesamiento, nombre_archivo):
+        # El intento anterior terminó el archivo (ya se movió a processed) pero el trabajador
+        # cayó antes de registrarlo: los JSON y la base de datos se escriben antes de mover
+        print(f'[trabajador_cola] trabajo {id_trabajo}: {nombre_archivo} ya estaba procesado')
+        ct.completar(id_trabajo, {'segmentos': None, 'ya_procesado': True}, conexion)
+        return
+    latido = _Latido(trabajo, timeout)
+    latido.start()
+    inicio = time.perf_counter()
+    try:
+        resultado = procesamiento.procesar_archivo_especifico(
+            nombre_archivo,
+            progreso=lambda fraccion, etapa: ct.actualizar_progreso(id_trabajo, fraccion, etapa, conexion),
+            propagar_errores=True
+        )
+        latido.detener()
+        registro = {'segmentos': len(resultado), 'duracion': time.perf_counter() - inicio}
+        if resultado.duplicado_de is not None:
+            # Mismo contenido que un archivo ya procesado: sus resultados son los del original
+            original = resultado.duplicado_de
+            registro.update(segmentos=original['segmentos'], duplicado_de={
+                clave: original[clave] for clave in ('sha256', 'archivo', 'salida', 'almacenamiento', 'terminado_en')
+            })
+        ct.completar(id_trabajo, registro, conexion)
+    except Exception as e:
+        latido.detener()
+        traceback.print_exc()
+        estado = ct.fallar(id_trabajo, e, conexion)
+        if estado is not None and estado['estado'] == 'pendiente':
+            print(f"[trabajador_cola] trabajo {id_trabajo}: se reintentará desde {estado['disponible_en']}")
+        else:
+            print(f'[trabajador_cola][ERROR] trabajo {id_trabajo}: fallido ({e})')
+
+
+def _esperar(segundos, detenido, conexion=None):
+    """
+    Espera hasta 'segundos' en tramos de 1 s para atender la señal de parada;
+    con conexión, termina antes si llega un NOTIFY de encolar.
+    """
+    limite = time.monotonic() + segundos
+    while not detenido() and (restante := limite - time.monotonic()) > 0:
+        if conexion is None:
+            time.sleep(min(1.0, restante))
+        elif any(True for _ in conexion.notifies(timeout=min(1.0, restante), stop_after=1)):
+            return
+
+
+def ejecutar_trabajador(indice, detener):
+    """Bucle de un proceso trabajador: toma, procesa y registra trabajos hasta que se pida detener."""
+    # El manejador solo marca un threading.Event: llamar detener.set() desde una señal
+    # puede bloquearse si el hilo principal tiene tomado el lock del Event
+    parada = threading.Event()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: parada.set())
+
+    def detenido():
+        return parada.is_set() or detener.is_set()
+
+    import main_procesamiento as procesamiento
+    timeout = pp.timeout_archivo()
+    conexion = None
+    while not detenido():
+        try:
+            if conexion is None or conexion.closed:
+                conexion = ct.conectar()
+                conexion.execute(f'LISTEN {ct.CANAL}')
+            trabajo = ct.tomar(ct.identificador_trabajador(), conexion)
+            if trabajo is None:
+                # Hasta un NOTIFY, el próximo reintento programado o el siguiente sondeo
+                siguiente = ct.segundos_hasta_siguiente(conexion)
+                _esperar(sondeo_cola() if siguiente is None else min(sondeo_cola(), siguiente + 0.05), detenido, conexion)
+                continue
+            procesar_trabajo(trabajo, conexion, procesamiento, timeout)
+        except Exception as e:
+            print(f'[trabajador_cola][ERROR] trabajador {indice}: {e}')
+            if conexion is not None:
+                conexion.close()
+            conexion = None
+            _esperar(sondeo_cola(), detenido)
+    if conexion is not None:
+        conexion.close()
+
+
+def supervisar(cantidad=None):
+    """Mantiene 'cantidad' procesos trabajadores vivos hasta recibir SIGTERM o SIGINT."""
+    cantidad = cantidad or pp.cantidad_trabajadores()
+    contexto = multiprocessing.get_context('spawn')
+    detener = contexto.Event()
+    parada = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parada.set())
+    signal.signal(signal.SIGINT, lambda *_: parada.set())
+    procesos = [None] * cantidad
+    ultima_recuperacion = 0.0
+    print(f'[trabajador_cola] iniciando {cantidad} trabajadores')
+    while not parada.is_set():
+        for indice, proceso in enumerate(procesos):
+            if proceso is not None and proceso.is_alive():
+                continue
+            if proceso is not None:
+                print(f'[trabajador_cola] trabajador {indice} terminó (código {proceso.exitcode}); reemplazándolo')
+            procesos[indice] = contexto.Process(
+                target=ejecutar_trabajador, args=(indice, detener), name=f'recway-cola-{indice}'
+            )
+            procesos[indice].start()
+        if time.monotonic() - ultima_recuperacion >= INTERVALO_RECUPERACION:
+            ultima_recuperacion = time.monotonic()
+            try:
+                recuperados = ct.recuperar_abandonados()
+                if recuperados:
+                    print(f'[trabajador_cola] {recuperados} trabajos sin latido devueltos a la cola')
+            except Exception as e:
+                print(f'[trabajador_cola][ERROR] recuperando trabajos: {e}')
+        parada.wait(INTERVALO_SUPERVISION)
+    detener.set()
+    print('[trabajador_cola] deteniendo trabajadores')
+    for proceso in procesos:
+        if proceso is not None:
+            proceso.join()
+
+
+if __name__ == '__main__':
+    supervisar()
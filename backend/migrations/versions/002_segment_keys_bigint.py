@@ -0,0 +1,35 @@
+"""segment and sample foreign keys as bigint
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-18 10:00:00.000000
+
+Los ids de segmento son hashes de 64 bits (ap.hash_segmento) y los de muestra,
+fuente y registro son bigserial; las llaves foráneas en integer no los admiten.
+Necesaria para la carga con COPY de services/persistencia_bd.py.
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+COLUMNAS = (
+    ('geometria', 'id_segmento_seleccionado'),
+    ('indicesSegmento', 'id_segmento_seleccionado'),
+    ('huecoSegmento', 'id_segmento_seleccionado'),
+    ('muestra', 'id_segmento_seleccionado'),
+    ('indices_muestra', 'id_muestra'),
+    ('huecoMuestra', 'id_muestra_seleccionada'),
+    ('registro_sensores', 'id_fuente'),
+)
+
+def upgrade() -> None:
+    for tabla, columna in COLUMNAS:
+        op.execute(f'ALTER TABLE {tabla} ALTER COLUMN {columna} TYPE bigint')
+
+def downgrade() -> None:
+    for tabla, columna in COLUMNAS:
+        op.execute(f'ALTER TABLE {tabla} ALTER COLUMN {columna} TYPE integer')
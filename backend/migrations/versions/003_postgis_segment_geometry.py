@@ -0,0 +1,49 @@
+"""postgis geometry columns and gist indexes
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-18 12:00:00.000000
+
+segmento.geom (LineString) se llena a partir de los vértices de geometria;
+registro_sensores.posicion (Point) es una columna generada desde gps_lng/gps_lat.
+Ambas con índice GiST para consultas por caja (&&) o distancia (geom::geography).
+El índice B-tree compuesto idx_registro_gps no sirve para cajas y se reemplaza.
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+SQL_RELLENAR_GEOMETRIA = """
+UPDATE segmento s SET geom = l.geom
+FROM (
+    SELECT id_segmento_seleccionado AS id_segmento,
+           ST_MakeLine(ST_SetSRID(ST_MakePoint(coordenada_x, coordenada_y), 4326) ORDER BY orden) AS geom
+    FROM geometria
+    GROUP BY id_segmento_seleccionado
+    HAVING count(*) > 1
+) l
+WHERE l.id_segmento = s.id_segmento AND s.geom IS NULL
+"""
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS postgis')
+    op.execute('ALTER TABLE segmento ADD COLUMN IF NOT EXISTS geom geometry(LineString, 4326)')
+    op.execute(SQL_RELLENAR_GEOMETRIA)
+    op.execute('CREATE INDEX IF NOT EXISTS idx_segmento_geom ON segmento USING GIST (geom)')
+    op.execute(
+        'ALTER TABLE registro_sensores ADD COLUMN IF NOT EXISTS posicion geometry(Point, 4326) '
+        'GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(gps_lng, gps_lat), 4326)) STORED'
+    )
+    op.execute('CREATE INDEX IF NOT EXISTS idx_registro_posicion ON registro_sensores USING GIST (posicion)')
+    op.execute('DROP INDEX IF EXISTS idx_registro_gps')
+
+def downgrade() -> None:
+    op.execute('CREATE INDEX IF NOT EXISTS idx_registro_gps ON registro_sensores(gps_lat, gps_lng)')
+    op.execute('DROP INDEX IF EXISTS idx_registro_posicion')
+    op.execute('ALTER TABLE registro_sensores DROP COLUMN IF EXISTS posicion')
+    op.execute('DROP INDEX IF EXISTS idx_segmento_geom')
+    op.execute('ALTER TABLE segmento DROP COLUMN IF EXISTS geom')
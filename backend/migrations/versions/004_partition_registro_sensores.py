@@ -0,0 +1,171 @@
+"""monthly partitions and brin indexes for registro_sensores
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-18 14:00:00.000000
+
+registro_sensores pasa a estar particionada por rango de timestamp (un mes por
+partición, ms desde epoch UTC) con una partición DEFAULT. Los B-tree de timestamp e
+id_fuente se reemplazan por BRIN: las filas se cargan en orden de llegada, así que
+ambas columnas crecen con la posición física y el BRIN ocupa unos KB por partición.
+Las funciones crear_particiones_registro y eliminar_particiones_registro las usa
+services/persistencia_bd.py antes de cada carga (creación y retención automáticas).
+
+Las filas existentes se copian a la tabla nueva en la migración; con mucho
+historial conviene correrla en una ventana de mantenimiento.
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+COLUMNAS = """
+    id_registro bigint NOT NULL DEFAULT nextval('registro_sensores_id_registro_seq'),
+    timestamp bigint NOT NULL,
+    acc_x double precision,
+    acc_y double precision,
+    acc_z double precision,
+    acc_magnitude double precision,
+    gyro_x double precision,
+    gyro_y double precision,
+    gyro_z double precision,
+    gyro_magnitude double precision,
+    gps_lat double precision,
+    gps_lng double precision,
+    gps_accuracy double precision,
+    gps_speed double precision,
+    gps_speed_accuracy double precision,
+    gps_altitude double precision,
+    gps_altitude_accuracy double precision,
+    gps_heading double precision,
+    gps_heading_accuracy double precision,
+    gps_timestamp bigint,
+    gps_provider varchar(50),
+    device_orientation double precision,
+    sample_rate double precision,
+    gps_changed boolean DEFAULT false,
+    posicion geometry(Point, 4326) GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(gps_lng, gps_lat), 4326)) STORED,
+    id_fuente bigint NOT NULL,
+    FOREIGN KEY (id_fuente) REFERENCES fuente_datos_dispositivo(id_fuente) ON DELETE CASCADE
+"""
+
+COLUMNAS_COPIA = (
+    'id_registro, timestamp, acc_x, acc_y, acc_z, acc_magnitude, gyro_x, gyro_y, gyro_z, gyro_magnitude, '
+    'gps_lat, gps_lng, gps_accuracy, gps_speed, gps_speed_accuracy, gps_altitude, gps_altitude_accuracy, '
+    'gps_heading, gps_heading_accuracy, gps_timestamp, gps_provider, device_orientation, sample_rate, '
+    'gps_changed, id_fuente'
+)
+
+SQL_CREAR_PARTICIONES = """
+CREATE OR REPLACE FUNCTION crear_particiones_registro(desde bigint, hasta bigint) RETURNS integer AS $$
+DECLARE
+    mes date := date_trunc('month', to_timestamp(desde / 1000.0) AT TIME ZONE 'UTC')::date;
+    ultimo date := date_trunc('month', to_timestamp(hasta / 1000.0) AT TIME ZONE 'UTC')::date;
+    inicio bigint;
+    fin bigint;
+    nombre text;
+    creadas integer := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('registro_sensores_particiones'));
+    WHILE mes <= ultimo LOOP
+        nombre := 'registro_sensores_' || to_char(mes, 'YYYYMM');
+        inicio := (extract(epoch FROM mes::timestamp AT TIME ZONE 'UTC') * 1000)::bigint;
+        fin := (extract(epoch FROM (mes + interval '1 month')::timestamp AT TIME ZONE 'UTC') * 1000)::bigint;
+        IF to_regclass(nombre) IS NULL THEN
+            IF EXISTS (SELECT 1 FROM registro_sensores_default WHERE timestamp >= inicio AND timestamp < fin) THEN
+                RAISE NOTICE 'registro_sensores_default tiene filas de %; no se crea la partición', nombre;
+            ELSE
+                EXECUTE format('CREATE TABLE %I PARTITION OF registro_sensores FOR VALUES FROM (%s) TO (%s)',
+                               nombre, inicio, fin);
+                creadas := creadas + 1;
+            END IF;
+        END IF;
+        mes := (mes + interval '1 month')::date;
+    END LOOP;
+    RETURN creadas;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+SQL_ELIMINAR_PARTICIONES = """
+CREATE OR REPLACE FUNCTION eliminar_particiones_registro(meses_retencion integer) RETURNS integer AS $$
+DECLARE
+    limite text := to_char(date_trunc('month', now() AT TIME ZONE 'UTC') - make_interval(months => meses_retencion), 'YYYYMM');
+    particion record;
+    eliminadas integer := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('registro_sensores_particiones'));
+    FOR particion IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'registro_sensores'::regclass
+          AND c.relname ~ '^registro_sensores_[0-9]{6}$'
+          AND right(c.relname, 6) < limite
+    LOOP
+        EXECUTE format('ALTER TABLE registro_sensores DETACH PARTITION %I', particion.relname);
+        EXECUTE format('DROP TABLE %I', particion.relname);
+        eliminadas := eliminadas + 1;
+    END LOOP;
+    RETURN eliminadas;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+def upgrade() -> None:
+    op.execute('ALTER TABLE registro_sensores RENAME TO registro_sensores_antiguo')
+    op.execute('ALTER TABLE registro_sensores_antiguo RENAME CONSTRAINT registro_sensores_pkey TO registro_sensores_antiguo_pkey')
+    op.execute('DROP INDEX IF EXISTS idx_registro_fuente')
+    op.execute('DROP INDEX IF EXISTS idx_registro_timestamp')
+    op.execute('DROP INDEX IF EXISTS idx_registro_posicion')
+    op.execute(
+        f'CREATE TABLE registro_sensores ({COLUMNAS}, PRIMARY KEY (id_registro, timestamp)) '
+        'PARTITION BY RANGE (timestamp)'
+    )
+    op.execute('ALTER SEQUENCE registro_sensores_id_registro_seq OWNED BY registro_sensores.id_registro')
+    op.execute('CREATE TABLE registro_sensores_default PARTITION OF registro_sensores DEFAULT')
+    op.execute(SQL_CREAR_PARTICIONES)
+    op.execute(SQL_ELIMINAR_PARTICIONES)
+    # Particiones para los meses con filas dentro de la ventana de persistencia_bd (24 meses
+    # atrás hasta el mes siguiente); timestamps fuera de lugar quedan en la partición DEFAULT
+    op.execute(
+        'SELECT crear_particiones_registro('
+        'GREATEST(LEAST(min(timestamp), (extract(epoch FROM now()) * 1000)::bigint), '
+        '(extract(epoch FROM date_trunc(\'month\', now() AT TIME ZONE \'UTC\') - interval \'24 months\') * 1000)::bigint), '
+        'LEAST(GREATEST(max(timestamp), (extract(epoch FROM now() + interval \'1 month\') * 1000)::bigint), '
+        '(extract(epoch FROM date_trunc(\'month\', now() AT TIME ZONE \'UTC\') + interval \'2 months\') * 1000)::bigint - 1)) '
+        'FROM registro_sensores_antiguo'
+    )
+    op.execute(
+        f'INSERT INTO registro_sensores ({COLUMNAS_COPIA}) '
+        f'SELECT {COLUMNAS_COPIA} FROM registro_sensores_antiguo ORDER BY timestamp'
+    )
+    op.execute('DROP TABLE registro_sensores_antiguo')
+    op.execute('CREATE INDEX idx_registro_fuente ON registro_sensores USING BRIN (id_fuente)')
+    op.execute('CREATE INDEX idx_registro_timestamp ON registro_sensores USING BRIN (timestamp)')
+    op.execute('CREATE INDEX idx_registro_posicion ON registro_sensores USING GIST (posicion)')
+
+def downgrade() -> None:
+    op.execute('ALTER TABLE registro_sensores RENAME TO registro_sensores_particionada')
+    op.execute('ALTER TABLE registro_sensores_particionada RENAME CONSTRAINT registro_sensores_pkey TO registro_sensores_particionada_pkey')
+    op.execute(
+        f'CREATE TABLE registro_sensores ({COLUMNAS}, '
+        'CONSTRAINT registro_sensores_pkey PRIMARY KEY (id_registro))'
+    )
+    op.execute('DROP INDEX IF EXISTS idx_registro_fuente')
+    op.execute('DROP INDEX IF EXISTS idx_registro_timestamp')
+    op.execute('DROP INDEX IF EXISTS idx_registro_posicion')
+    op.execute(
+        f'INSERT INTO registro_sensores ({COLUMNAS_COPIA}) '
+        f'SELECT {COLUMNAS_COPIA} FROM registro_sensores_particionada'
+    )
+    op.execute('ALTER SEQUENCE registro_sensores_id_registro_seq OWNED BY registro_sensores.id_registro')
+    op.execute('DROP TABLE registro_sensores_particionada')
+    op.execute('DROP FUNCTION IF EXISTS crear_particiones_registro(bigint, bigint)')
+    op.execute('DROP FUNCTION IF EXISTS eliminar_particiones_registro(integer)')
+    op.execute('CREATE INDEX idx_registro_fuente ON registro_sensores(id_fuente)')
+    op.execute('CREATE INDEX idx_registro_timestamp ON registro_sensores(timestamp)')
+    op.execute('CREATE INDEX idx_registro_posicion ON registro_sensores USING GIST (posicion)')
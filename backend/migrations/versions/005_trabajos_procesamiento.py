@@ -0,0 +1,52 @@
+"""durable processing job queue
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-18 16:00:00.000000
+
+trabajos_procesamiento reemplaza a BackgroundTasks: cada archivo a procesar es una
+fila que los procesos de services/trabajador_cola.py toman con FOR UPDATE SKIP LOCKED
+(ver services/cola_trabajos.py). El índice parcial de pendientes sigue el orden en
+que se toman; el índice único parcial evita dos trabajos activos del mismo archivo.
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS trabajos_procesamiento (
+            id_trabajo bigserial PRIMARY KEY,
+            archivo varchar(255) NOT NULL,
+            estado varchar(20) NOT NULL DEFAULT 'pendiente'
+                CHECK (estado IN ('pendiente', 'en_proceso', 'completado', 'fallido')),
+            prioridad integer NOT NULL DEFAULT 0,
+            intentos integer NOT NULL DEFAULT 0,
+            max_intentos integer NOT NULL DEFAULT 3,
+            progreso real NOT NULL DEFAULT 0,
+            etapa varchar(50),
+            trabajador varchar(100),
+            resultado jsonb,
+            error text,
+            creado_en timestamptz NOT NULL DEFAULT now(),
+            disponible_en timestamptz NOT NULL DEFAULT now(),
+            iniciado_en timestamptz,
+            actualizado_en timestamptz NOT NULL DEFAULT now(),
+            terminado_en timestamptz
+        )
+    """)
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS idx_trabajos_pendientes ON trabajos_procesamiento '
+        "(prioridad DESC, disponible_en, id_trabajo) WHERE estado = 'pendiente'"
+    )
+    op.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_trabajos_archivo_activo ON trabajos_procesamiento (archivo) '
+        "WHERE estado IN ('pendiente', 'en_proceso')"
+    )
+
+def downgrade() -> None:
+    op.execute('DROP TABLE IF EXISTS trabajos_procesamiento')
@@ -0,0 +1,7 @@
+"""Configuración de pytest: los servicios se importan como módulos sueltos, igual que en la app."""
+import sys
+from pathlib import Path
+
+services_dir = Path(__file__).resolve().parent.parent / 'app' / 'services'
+if str(services_dir) not in sys.path:
+    sys.path.insert(0, str(services_dir))
@@ -0,0 +1,185 @@
+"""
+Equivalencias del emparejamiento en lote (emparejamiento_lote) sobre una tesela sintética:
+- emparejar_trayectoria da la misma secuencia de segmentos que el recorrido por fila
+  (ubicar_muestra_grafo + segmentar_grafo de main_procesamiento)
+- continuar desde un punto de control da lo mismo que una ejecución sin interrupción
+- EmparejadorIncremental por bloques da lo mismo que emparejar_trayectoria
+"""
+import math
+from types import SimpleNamespace
+
+import networkx as nx
+import numpy as np
+import osmnx as ox
+import pytest
+from shapely.geometry import LineString
+
+import algoritmos_posicinamiento as ap
+import emparejamiento_lote as el
+import main_procesamiento as mp
+import puntos_control as pc
+
+L = 0.0003
+SEGMENTO_MAXIMO = 60
+# Cuadrícula de 4 x 4 intersecciones cada ~165 m (aristas de 2 a 3 subsegmentos) en una sola tesela
+LAT_BASE, LON_BASE = 4.6000, -74.0800
+PASO = 0.0015
+CAMPOS = ('indice_arista', 'aristas', 'posicion_subsegmento', 'cambio')
+
+
+def _distancia_m(lat1, lon1, lat2, lon2):
+    dy = (lat2 - lat1) * 111320.0
+    dx = (lon2 - lon1) * 111320.0 * math.cos(math.radians(lat1))
+    return math.hypot(dx, dy)
+
+
+def _grafo_cuadricula():
+    G = nx.MultiDiGraph(crs='epsg:4326')
+    nodo = lambda fila, columna: 1000 + fila * 10 + columna
+    for fila in range(4):
+        for columna in range(4):
+            G.add_node(nodo(fila, columna), x=LON_BASE + columna * PASO, y=LAT_BASE + fila * PASO)
+    calles = []
+    for fila in range(4):
+        for columna in range(3):
+            calles.append((nodo(fila, columna), nodo(fila, columna + 1), f'Calle {fila}'))
+    for columna in range(4):
+        for fila in range(3):
+            calles.append((nodo(fila, columna), nodo(fila + 1, columna), f'Carrera {columna}'))
+    for u, v, nombre in calles:
+        for origen, destino in ((u, v), (v, u)):
+            x1, y1 = G.nodes[origen]['x'], G.nodes[origen]['y']
+            x2, y2 = G.nodes[destino]['x'], G.nodes[destino]['y']
+            datos = {'length': _distancia_m(y1, x1, y2, x2), 'oneway': False, 'highway': 'residential', 'name': nombre}
+            if nombre == 'Calle 1':
+                # Geometría con un vértice intermedio (ligeramente desplazado) para cubrir aristas con 'geometry'
+                medio = ((x1 + x2) / 2, (y1 + y2) / 2 + 0.00005)
+                datos['geometry'] = LineString([(x1, y1), medio, (x2, y2)])
+            G.add_edge(origen, destino, key=0, **datos)
+    return G
+
+
+@pytest.fixture(scope='module')
+def carpeta_grafos(tmp_path_factory):
+    carpeta = tmp_path_factory.mktemp('grafos')
+    numero = ap.determinar_grafo(LAT_BASE, LON_BASE)
+    fila, columna = divmod(numero, ap.COLUMNAS_GRAFOS)
+    lat_izquierda = ap.LAT_ORIGEN_GRAFOS - fila * ap.INTERVALO_LAT_GRAFOS
+    lon_izquierda = ap.LON_ORIGEN_GRAFOS + columna * ap.INTERVALO_LON_GRAFOS
+    nombre = (f'segN{numero}pos{lat_izquierda}&{lat_izquierda - ap.INTERVALO_LAT_GRAFOS}'
+              f'&{lon_izquierda}&{lon_izquierda + ap.INTERVALO_LON_GRAFOS}.graphml')
+    ox.save_graphml(_grafo_cuadricula(), filepath=str(carpeta / nombre))
+    return str(carpeta)
+
+
+@pytest.fixture(scope='module')
+def trayectoria():
+    """Recorrido por la cuadrícula con giros, una muestra cada ~8 m y ruido de ~1 m."""
+    esquinas = [(0, 0), (0, 3), (2, 3), (2, 1), (3, 1), (3, 0), (1, 0)]  # (fila, columna)
+    puntos = []
+    for (f1, c1), (f2, c2) in zip(esquinas[:-1], esquinas[1:]):
+        lat1, lon1 = LAT_BASE + f1 * PASO, LON_BASE + c1 * PASO
+        lat2, lon2 = LAT_BASE + f2 * PASO, LON_BASE + c2 * PASO
+        pasos = max(1, int(_distancia_m(lat1, lon1, lat2, lon2) / 8))
+        for t in np.arange(pasos) / pasos:
+            puntos.append((lat1 + t * (lat2 - lat1), lon1 + t * (lon2 - lon1)))
+    puntos = np.array(puntos)
+    ruido = np.random.default_rng(7).normal(0, 0.00001, puntos.shape)
+    latitudes, longitudes = puntos[:, 0] + ruido[:, 0], puntos[:, 1] + ruido[:, 1]
+    avance = np.diff(puntos, axis=0, append=puntos[-1:] + (puntos[-1:] - puntos[-2:-1]))
+    headings = np.degrees(np.arctan2(avance[:, 1], avance[:, 0]))
+    headings = ((headings + 180) % 360) - 180
+    return latitudes, longitudes, headings
+
+
+def _secuencia_lote(resultado):
+    return [
+        (k, *resultado.aristas[k].tolist(), int(resultado.posicion_subsegmento[k]))
+        for k in np.flatnonzero(resultado.cambio).tolist()
+    ]
+
+
+def _secuencia_por_fila(latitudes, longitudes, headings, carpeta_grafos):
+    viaje = SimpleNamespace(latitud=latitudes, longitud=longitudes, velocidad=np.zeros(len(latitudes)), heading=headings)
+    datos = mp.DatosProcesamiento(viaje)
+    datos.carpeta_grafos = carpeta_grafos
+    datos.L, datos.segmento_maximo = L, SEGMENTO_MAXIMO
+    secuencia = []
+    for i in range(len(latitudes)):
+        mp.adquirir_latitud_longitud(datos, i)
+        mp.procesamiento_mapa_simple(datos)
+        mp.ubicar_muestra_grafo(datos)
+        mp.segmentar_grafo(datos)
+        if datos.cambio_segmento:
+            secuencia.append((i, *datos.id_edge, datos.posicion_subsegmento))
+    return secuencia
+
+
+def _comparar(obtenido, esperado):
+    for campo in CAMPOS:
+        np.testing.assert_array_equal(getattr(obtenido, campo), getattr(esperado, campo), err_msg=campo)
+    np.testing.assert_allclose(obtenido.punto_proyectado, esperado.punto_proyectado)
+    assert obtenido.subsegmentos.keys() == esperado.subsegmentos.keys()
+    assert obtenido.info_aristas == esperado.info_aristas
+
+
+def test_lote_igual_a_recorrido_por_fila(carpeta_grafos, trayectoria):
+    resultado = el.emparejar_trayectoria(*trayectoria, carpeta_grafos, L=L, segmento_maximo=SEGMENTO_MAXIMO)
+    secuencia = _secuencia_lote(resultado)
+    # Los giros y los subsegmentos de las aristas largas producen varios segmentos
+    assert len(secuencia) > 10
+    assert (resultado.indice_arista >= 0).all()
+    assert secuencia == _secuencia_por_fila(*trayectoria, carpeta_grafos)
+
+
+class _PuntoControlInterrumpido(pc.PuntoControl):
+    """Simula la caída del proceso después de guardar 'bloques' bloques."""
+
+    def __init__(self, carpeta, nombre_archivo, intervalo, bloques):
+        super().__init__(carpeta, nombre_archivo, intervalo=intervalo)
+        self.bloques = bloques
+
+    def guardar(self, resultado, estado, desde, hasta):
+        super().guardar(resultado, estado, desde, hasta)
+        self.bloques -= 1
+        if self.bloques == 0:
+            raise KeyboardInterrupt
+
+
+def test_reanudar_punto_control_igual_a_ejecucion_completa(carpeta_grafos, trayectoria, tmp_path):
+    completo = el.emparejar_trayectoria(*trayectoria, carpeta_grafos, L=L, segmento_maximo=SEGMENTO_MAXIMO)
+    intervalo = 37  # no coincide con los cambios de arista: el corte cae dentro de rachas
+    with pytest.raises(KeyboardInterrupt):
+        el.emparejar_trayectoria(
+            *trayectoria, carpeta_grafos, L=L, segmento_maximo=SEGMENTO_MAXIMO,
+            punto_control=_PuntoControlInterrumpido(str(tmp_path), 'viaje.csv', intervalo, bloques=3)
+        )
+
+    punto_control = pc.PuntoControl(str(tmp_path), 'viaje.csv', intervalo=intervalo)
+    guardados = []
+    punto_control.guardar = lambda resultado, estado, desde, hasta: guardados.append(desde)
+    reanudado = el.emparejar_trayectoria(
+        *trayectoria, carpeta_grafos, L=L, segmento_maximo=SEGMENTO_MAXIMO, punto_control=punto_control
+    )
+    # Continuó desde el tercer bloque en vez de la fila 0
+    assert guardados and guardados[0] == 3 * intervalo
+    _comparar(reanudado, completo)
+
+
+@pytest.mark.parametrize('tamanos', [(1,), (7, 50, 3), (64,)])
+def test_bloques_incrementales_igual_a_lote(carpeta_grafos, trayectoria, tamanos):
+    latitudes, longitudes, headings = trayectoria
+    completo = el.emparejar_trayectoria(latitudes, longitudes, headings, carpeta_grafos, L=L,
+                                        segmento_maximo=SEGMENTO_MAXIMO)
+    emparejador = el.EmparejadorIncremental(carpeta_grafos, L=L, segmento_maximo=SEGMENTO_MAXIMO)
+    unido = el.ResultadoEmparejamiento(len(latitudes))
+    a, parte = 0, 0
+    while a < len(latitudes):
+        b = min(len(latitudes), a + tamanos[parte % len(tamanos)])
+        bloque = emparejador.emparejar(latitudes[a:b], longitudes[a:b], headings[a:b])
+        for campo in CAMPOS + ('numero_grafo', 'punto_proyectado'):
+            getattr(unido, campo)[a:b] = getattr(bloque, campo)
+        unido.subsegmentos.update({a + k: valor for k, valor in bloque.subsegmentos.items()})
+        unido.info_aristas.update({a + k: valor for k, valor in bloque.info_aristas.items()})
+        a, parte = b, parte + 1
+    _comparar(unido, completo)